@@ -0,0 +1,854 @@
+"""
+problog.batch - Batch evaluation
+--------------------------------
+
+Evaluates compiled circuits for many weight assignments at once using NumPy.
+
+..
+    Part of the ProbLog distribution.
+
+    Copyright 2015 KU Leuven, DTAI Research Group
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+from __future__ import print_function
+
+from collections import defaultdict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .constraint import ConstraintAD
+from .errors import InconsistentEvidenceError, InstallError, ProbLogError
+from .evaluator import SemiringProbability
+
+
+_CONJ = 0
+_DISJ = 1
+_NOT = 2
+
+
+class BatchEvaluator(object):
+    """Evaluates a circuit in negation normal form for many weight assignments at once.
+
+    The circuit is flattened into levels such that each node only depends on nodes of lower \
+    levels.
+    All conjunctions (or disjunctions) of one level are computed with a single NumPy reduction \
+    over the rows of their children, so the Python overhead depends on the depth of the circuit \
+    and not on the number of assignments.
+    Values are computed in the probability semiring.
+
+    :param formula: circuit consisting of atoms, conjunctions and disjunctions (negation only on \
+    atoms)
+    :type formula: LogicDAG
+    :param slots: weight slot of each atom in the circuit {atom key: slot}
+    :param weights: base weights of the slots {slot: (positive weight, negative weight)}
+    :param facts: list of (name, slot) of the facts that can be set in a batch
+    :param constraints: annotated disjunctions as list of (choice slots, extra slot)
+    :param queries: list of (name, root, clamps) where clamps is a tuple of literals (signed \
+    atom keys) that are fixed to true for this query
+    :param evidence: (root, clamps) of the normalization
+    :param smooth: smooth the circuit (required when disjunctions don't mention the same atoms)
+    """
+
+    def __init__(self, formula, slots, weights, facts, constraints, queries, evidence,
+                 smooth=False):
+        if numpy is None:
+            raise InstallError('Batch evaluation requires NumPy.')
+
+        slot_index = {}
+        for slot in weights:
+            slot_index[slot] = len(slot_index)
+        self._pos = numpy.ones(len(slot_index))
+        self._neg = numpy.ones(len(slot_index))
+        for slot, (pos, neg) in weights.items():
+            self._pos[slot_index[slot]] = pos
+            self._neg[slot_index[slot]] = neg
+
+        self.facts = []
+        self._fact_index = {}
+        for name, slot in facts:
+            if slot in slot_index and name not in self._fact_index:
+                self._fact_index[name] = slot_index[slot]
+                self.facts.append(name)
+
+        self._constraints = []
+        for choices, extra in constraints:
+            choices = [slot_index[s] for s in choices if s in slot_index]
+            self._constraints.append((numpy.array(choices, dtype=int), slot_index.get(extra)))
+
+        self._formula = formula
+        self._slots = {key: slot_index[slot] for key, slot in slots.items() if slot in slot_index}
+        self._smooth = smooth
+
+        # Row 0 is TRUE, row 1 is FALSE.
+        self._rows = {0: 0, None: 1}
+        self._level = [0, 0]
+        self._vars = [frozenset(), frozenset()]
+        self._ops = []
+        self._literals = []    # (row, slot, positive)
+        self._smoothed = {}
+
+        roots = [root for name, root, clamps in queries] + [evidence[0]]
+        for key in topological_order(formula, roots):
+            self._add_node(key)
+
+        if smooth:
+            all_vars = frozenset().union(*[self._vars[self._row(r)] for r in roots])
+            root_row = {r: self._smooth_row(self._row(r), all_vars) for r in roots}
+        else:
+            root_row = {r: self._row(r) for r in roots}
+
+        self.queries = [name for name, root, clamps in queries]
+        self._passes = defaultdict(list)
+        for i, (name, root, clamps) in enumerate(queries):
+            self._passes[tuple(clamps)].append((i, root_row[root]))
+        self._evidence = (root_row[evidence[0]], tuple(evidence[1]))
+
+        self._levels = self._group_levels()
+        self._decisions = None  # see _find_decisions
+        self._literal_rows = numpy.array([r for r, s, p in self._literals], dtype=int)
+        self._literal_slots = numpy.array([s for r, s, p in self._literals], dtype=int)
+        self._literal_pos = numpy.array([p for r, s, p in self._literals], dtype=bool)
+
+    def __len__(self):
+        """Number of rows in the flattened circuit."""
+        return len(self._level)
+
+    def evaluate(self, weights, facts=None):
+        """Evaluate all queries for each assignment of weights.
+
+        :param weights: probabilities of the facts, one row per assignment
+        :type weights: array of shape (n_assignments, n_facts)
+        :param facts: names of the facts corresponding to the columns (default: ``self.facts``)
+        :return: probabilities of the queries (in the order of ``self.queries``) given evidence; \
+        assignments for which the evidence has probability zero get NaN
+        :rtype: numpy.ndarray of shape (n_assignments, n_queries)
+        """
+        pos, neg = self._slot_weights(weights, facts)
+        result, evidence = self._unnormalized(pos, neg)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            result /= evidence[:, None]
+            result[evidence == 0.0] = numpy.nan
+        return result
+
+    def gradient(self, weights, coefficients, facts=None):
+        """Compute a weighted sum of the query probabilities and its derivatives with respect to \
+        the probabilities of the facts, using one forward and one backward pass over the circuit \
+        per group of queries.
+
+        The value is ``sum_i coefficients[i] * P(query_i, evidence)`` (not normalized).
+        The probability of the evidence is computed in the same way.
+        Both are linear in the probability of each fact, so together they determine the exact \
+        conditional value after changing the probability of any single fact.
+
+        :param weights: probabilities of the facts, one row per assignment
+        :type weights: array of shape (n_assignments, n_facts)
+        :param coefficients: coefficient of each query (in the order of ``self.queries``)
+        :param facts: names of the facts corresponding to the columns (default: ``self.facts``)
+        :return: tuple (value, value gradient, evidence, evidence gradient) of arrays with shapes \
+        (n_assignments,), (n_assignments, n_facts), (n_assignments,), (n_assignments, n_facts)
+        """
+        if facts is None:
+            facts = self.facts
+        pos, neg = self._slot_weights(weights, facts)
+        leaves = self._leaves(pos, neg)
+        n = pos.shape[1]
+        values = numpy.empty((len(self), n))
+        grad = numpy.empty((len(self), n))
+
+        value = numpy.zeros(n)
+        d_pos = numpy.zeros(pos.shape)
+        d_neg = numpy.zeros(pos.shape)
+        for clamps, outputs in self._passes.items():
+            outputs = [(row, coefficients[i]) for i, row in outputs if coefficients[i]]
+            if outputs:
+                self._propagate(values, leaves, clamps)
+                grad.fill(0.0)
+                for row, c in outputs:
+                    value += c * values[row]
+                    grad[row] += c
+                self._backpropagate(values, grad, clamps, d_pos, d_neg)
+
+        row, clamps = self._evidence
+        self._propagate(values, leaves, clamps)
+        evidence = values[row].copy()
+        grad.fill(0.0)
+        grad[row] = 1.0
+        e_pos = numpy.zeros(pos.shape)
+        e_neg = numpy.zeros(pos.shape)
+        self._backpropagate(values, grad, clamps, e_pos, e_neg)
+
+        columns = self._columns(facts)
+        return (value, self._fact_gradient(d_pos, d_neg, columns), evidence,
+                self._fact_gradient(e_pos, e_neg, columns))
+
+    def bounds(self, weights, free, facts=None):
+        """Bound the probabilities of the queries when the facts in ``free`` may have any \
+        probability.
+
+        The circuit is monotone in the weights of its literals, so the unnormalized \
+        probabilities are bounded by setting both weights of the free facts to zero (lower bound) \
+        or one (upper bound).
+        Disjunctions that branch on a free fact (``(f, X) or (-f, Y)``, as in decision-DNNF and \
+        in smoothing) instead take the minimum (lower bound) or maximum (upper bound) of X and Y.
+
+        :param weights: probabilities of the facts, one row per assignment (values for the free \
+        facts are ignored)
+        :type weights: array of shape (n_assignments, n_facts)
+        :param free: names of the facts whose probability is unknown
+        :param facts: names of the facts corresponding to the columns (default: ``self.facts``)
+        :return: lower and upper bounds on the probabilities of the queries
+        :rtype: tuple of two numpy.ndarray of shape (n_assignments, n_queries)
+        """
+        pos, neg = self._slot_weights(weights, facts)
+        free = self._columns(free)
+        for choices, extra in self._constraints:
+            if numpy.isin(free, choices).any():
+                raise ValueError('Facts in annotated disjunctions can not be free.')
+        if self._decisions is None:
+            self._decisions = self._find_decisions()
+        is_free = numpy.zeros(len(self._pos), dtype=bool)
+        is_free[free] = True
+        pos[free] = 0.0
+        neg[free] = 0.0
+        lower, lower_evidence = self._unnormalized(pos, neg, (numpy.minimum, is_free))
+        pos[free] = 1.0
+        neg[free] = 1.0
+        upper, upper_evidence = self._unnormalized(pos, neg, (numpy.maximum, is_free))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            lower = numpy.where(upper_evidence[:, None] > 0.0,
+                                lower / upper_evidence[:, None], 0.0)
+            upper = numpy.where(lower_evidence[:, None] > 0.0,
+                                upper / lower_evidence[:, None], 1.0)
+        return numpy.clip(lower, 0.0, 1.0), numpy.clip(upper, 0.0, 1.0)
+
+    def mpe(self, weights=None, facts=None, minimize=False):
+        """Find the most probable explanation of the evidence for each assignment of weights.
+
+        The circuit is evaluated in the max-product semiring (in log-space): disjunctions take \
+        the maximum of their children instead of the sum.
+        The explanation is then recovered by following the best child of each disjunction \
+        from the root.
+        This is exact for deterministic and decomposable circuits (d-DNNF, SDD).
+        Slots that do not occur in the explanation (e.g. facts that are not part of the circuit) \
+        get their most likely value.
+
+        :param weights: probabilities of the facts, one row per assignment (default: the \
+        probabilities in the formula)
+        :type weights: array of shape (n_assignments, n_facts)
+        :param facts: names of the facts corresponding to the columns (default: ``self.facts``)
+        :param minimize: find the least probable explanation with non-zero probability instead
+        :return: list of (probability, literals) with one entry per assignment where literals is \
+        a list of fact names (negated for false facts), or None if the evidence is impossible
+        :rtype: list[tuple[float, list[Term]]]
+        """
+        if weights is None:
+            weights, facts = numpy.ones((1, 0)), []
+        pos, neg = self._slot_weights(weights, facts)
+        with numpy.errstate(divide='ignore'):
+            log_pos = numpy.log(pos)
+            log_neg = numpy.log(neg)
+        n = pos.shape[1]
+        root, clamps = self._evidence
+        values = numpy.empty((len(self), n))
+        values[0] = 0.0
+        values[1] = -numpy.inf
+        values[self._literal_rows] = self._leaves(log_pos, log_neg)
+        for lit in clamps:
+            row = self._rows.get(-lit)
+            if row is not None:
+                values[row] = -numpy.inf
+        for rows, children, offsets, ufunc in self._levels:
+            child_values = values[children]
+            if ufunc is numpy.multiply:
+                values[rows] = numpy.add.reduceat(child_values, offsets, axis=0)
+            elif minimize:
+                child_values[child_values == -numpy.inf] = numpy.inf
+                best = numpy.minimum.reduceat(child_values, offsets, axis=0)
+                best[best == numpy.inf] = -numpy.inf
+                values[rows] = best
+            else:
+                values[rows] = numpy.maximum.reduceat(child_values, offsets, axis=0)
+
+        operations = dict((row, (op, children)) for row, op, children in self._ops)
+        literals = dict((row, (slot, positive)) for row, slot, positive in self._literals)
+        names = dict((slot, name) for name, slot in self._fact_index.items())
+        result = []
+        for j in range(n):
+            if values[root, j] == -numpy.inf:
+                result.append((0.0, None))
+                continue
+            value = values[root, j]
+            assignment = {}
+            visited = set()
+            stack = [root]
+            while stack:
+                row = stack.pop()
+                if row in visited:
+                    continue
+                visited.add(row)
+                if row in literals:
+                    slot, positive = literals[row]
+                    assignment[slot] = positive
+                elif row in operations:
+                    op, children = operations[row]
+                    if op == _CONJ:
+                        stack.extend(children)
+                    else:
+                        child_values = values[children, j]
+                        if minimize:
+                            child_values = numpy.where(child_values == -numpy.inf, numpy.inf,
+                                                       child_values)
+                            stack.append(children[int(numpy.argmin(child_values))])
+                        else:
+                            stack.append(children[int(numpy.argmax(child_values))])
+            for slot in range(len(pos)):
+                if slot not in assignment:
+                    w_pos, w_neg = log_pos[slot, j], log_neg[slot, j]
+                    if minimize and min(w_pos, w_neg) > -numpy.inf:
+                        assignment[slot] = w_pos < w_neg
+                    else:
+                        assignment[slot] = w_pos >= w_neg
+                    value += w_pos if assignment[slot] else w_neg
+            explanation = []
+            for slot, name in sorted(names.items()):
+                explanation.append(name if assignment[slot] else -name)
+            result.append((float(numpy.exp(value)), explanation))
+        return result
+
+    def _columns(self, facts):
+        try:
+            return numpy.array([self._fact_index[f] for f in facts], dtype=int)
+        except KeyError as err:
+            raise ValueError('Unknown fact: %s' % err.args[0])
+
+    def _slot_weights(self, weights, facts):
+        """Positive and negative weights of all slots (one column per assignment)."""
+        if facts is None:
+            facts = self.facts
+        weights = numpy.asarray(weights, dtype=float)
+        if weights.ndim != 2 or weights.shape[1] != len(facts):
+            raise ValueError('Expected an array of shape (n, %d), got %s.'
+                             % (len(facts), weights.shape))
+        columns = self._columns(facts)
+
+        n = weights.shape[0]
+        pos = numpy.repeat(self._pos[:, None], n, axis=1)
+        neg = numpy.repeat(self._neg[:, None], n, axis=1)
+        pos[columns] = weights.T
+        neg[columns] = 1.0 - weights.T
+        for choices, extra in self._constraints:
+            neg[choices] = 1.0
+            if extra is not None:
+                pos[extra] = 1.0 - pos[choices].sum(axis=0)
+                neg[extra] = 1.0
+        return pos, neg
+
+    def _leaves(self, pos, neg):
+        return numpy.where(self._literal_pos[:, None], pos[self._literal_slots],
+                           neg[self._literal_slots])
+
+    def _unnormalized(self, pos, neg, decide=None):
+        """Unnormalized probabilities of the queries and of the evidence."""
+        leaves = self._leaves(pos, neg)
+        n = pos.shape[1]
+        values = numpy.empty((len(self), n))
+        result = numpy.empty((n, len(self.queries)))
+
+        for clamps, outputs in self._passes.items():
+            self._propagate(values, leaves, clamps, decide)
+            for i, row in outputs:
+                result[:, i] = values[row]
+
+        row, clamps = self._evidence
+        self._propagate(values, leaves, clamps, decide)
+        return result, values[row].copy()
+
+    def _find_decisions(self):
+        """Find the disjunctions that branch on the value of a fact and add rows for their \
+        branches without the literal of the fact.
+
+        :return: {level index: (rows, slots, branch literal rows, branch rows)}
+        """
+        literals = dict((row, (slot, positive)) for row, slot, positive in self._literals)
+        conjunctions = dict((row, children) for row, op, children in self._ops if op == _CONJ)
+
+        def factors(row):
+            # Children of a conjunction, with nested conjunctions flattened.
+            result = []
+            for c in conjunctions[row]:
+                if c in conjunctions:
+                    result += factors(c)
+                else:
+                    result.append(c)
+            return result
+
+        def branches(row):
+            if row in literals:
+                return {literals[row]: (row, [])}
+            result = {}
+            if row in conjunctions:
+                children = factors(row)
+                for c in children:
+                    if c in literals:
+                        result[literals[c]] = (c, [o for o in children if o != c])
+            return result
+
+        found = []
+        for row, op, children in list(self._ops):
+            if op == _DISJ and len(children) == 2:
+                first = branches(children[0])
+                second = branches(children[1])
+                for (slot, positive), (literal1, rest1) in first.items():
+                    if (slot, not positive) in second:
+                        literal2, rest2 = second[(slot, not positive)]
+                        found.append((row, slot, literal1, literal2,
+                                      self._product_row(rest1), self._product_row(rest2)))
+                        break
+        self._levels = self._group_levels()
+
+        level_index = {}
+        for i, (rows, children, offsets, ufunc) in enumerate(self._levels):
+            for row in rows:
+                level_index[row] = i
+        decisions = defaultdict(list)
+        for decision in found:
+            decisions[level_index[decision[0]]].append(decision)
+        result = {}
+        for i, ds in decisions.items():
+            result[i] = (numpy.array([d[0] for d in ds], dtype=int),
+                         numpy.array([d[1] for d in ds], dtype=int),
+                         numpy.array([[d[2], d[3]] for d in ds], dtype=int),
+                         numpy.array([[d[4], d[5]] for d in ds], dtype=int))
+        return result
+
+    def _product_row(self, children):
+        if not children:
+            return self._rows[0]
+        elif len(children) == 1:
+            return children[0]
+        else:
+            return self._add_row(_CONJ, children)
+
+    def _propagate(self, values, leaves, clamps, decide=None):
+        """Compute the values of all rows.
+
+        :param decide: tuple (ufunc, free) where free is a boolean array over the slots; \
+        disjunctions that branch on a free slot are computed by applying ufunc to their branches
+        """
+        values[0] = 1.0
+        values[1] = 0.0
+        values[self._literal_rows] = leaves
+        clamped = []
+        for lit in clamps:
+            row = self._rows.get(-lit)
+            if row is not None:
+                values[row] = 0.0
+                clamped.append(row)
+        for i, (rows, children, offsets, ufunc) in enumerate(self._levels):
+            values[rows] = ufunc.reduceat(values[children], offsets, axis=0)
+            if decide is not None and i in self._decisions:
+                decision_rows, slots, literal_rows, branch_rows = self._decisions[i]
+                selected = decide[1][slots]
+                if selected.any():
+                    branch_values = values[branch_rows[selected]]
+                    # A branch whose literal is clamped to false is not possible.
+                    branch_values[numpy.isin(literal_rows[selected], clamped)] = 0.0
+                    values[decision_rows[selected]] = decide[0](branch_values[:, 0],
+                                                                branch_values[:, 1])
+
+    def _backpropagate(self, values, grad, clamps, d_pos, d_neg):
+        """Propagate the derivatives in grad from the roots to the leaves (after \
+        :meth:`_propagate`) and add the derivatives of the leaves to d_pos and d_neg."""
+        for rows, children, offsets, ufunc in reversed(self._levels):
+            counts = numpy.diff(numpy.append(offsets, len(children)))
+            contribution = numpy.repeat(grad[rows], counts, axis=0)
+            if ufunc is numpy.multiply:
+                # Derivative of a product: the product of the other children (without division,
+                # as children are often zero).
+                child_values = values[children]
+                zero = child_values == 0.0
+                nonzero = numpy.where(zero, 1.0, child_values)
+                product = numpy.repeat(numpy.multiply.reduceat(nonzero, offsets, axis=0), counts,
+                                       axis=0)
+                zeros = numpy.repeat(numpy.add.reduceat(zero.astype(int), offsets, axis=0), counts,
+                                     axis=0)
+                others = numpy.where(zero, numpy.where(zeros == 1, product, 0.0),
+                                     numpy.where(zeros == 0, product / nonzero, 0.0))
+                contribution *= others
+            numpy.add.at(grad, children, contribution)
+        for lit in clamps:
+            row = self._rows.get(-lit)
+            if row is not None:
+                grad[row] = 0.0
+        leaf_grad = grad[self._literal_rows]
+        positive = self._literal_pos
+        numpy.add.at(d_pos, self._literal_slots[positive], leaf_grad[positive])
+        numpy.add.at(d_neg, self._literal_slots[~positive], leaf_grad[~positive])
+
+    def _fact_gradient(self, d_pos, d_neg, columns):
+        """Derivatives with respect to the probabilities of the facts in the given slots."""
+        result = d_pos - d_neg
+        for choices, extra in self._constraints:
+            # Choices of an annotated disjunction have a constant negative weight, and their
+            # probability is subtracted from the extra choice.
+            result[choices] = d_pos[choices]
+            if extra is not None:
+                result[choices] -= d_pos[extra]
+        return result[columns].T
+
+    def _row(self, key):
+        row = self._rows.get(key)
+        if row is None and key is not None:
+            node = self._formula.get_node(abs(key))
+            if type(node).__name__ != 'atom':
+                raise ValueError('Circuit is not in negation normal form.')
+            row = self._new_row(0, frozenset([abs(key)]))
+            self._literals.append((row, self._slots[abs(key)], key > 0))
+            self._rows[key] = row
+        return row
+
+    def _new_row(self, level, variables):
+        self._level.append(level)
+        if self._smooth:
+            self._vars.append(variables)
+        return len(self._level) - 1
+
+    def _add_row(self, op, children):
+        variables = None
+        if self._smooth:
+            variables = frozenset().union(*[self._vars[c] for c in children])
+        row = self._new_row(1 + max(self._level[c] for c in children), variables)
+        self._ops.append((row, op, children))
+        return row
+
+    def _add_node(self, key):
+        node = self._formula.get_node(key)
+        if type(node).__name__ == 'atom':
+            return
+        children = [self._row(c) for c in node.children]
+        if type(node).__name__ == 'conj':
+            op = _CONJ
+            if not children:
+                self._rows[key] = self._rows[0]
+                return
+        else:
+            op = _DISJ
+            if not children:
+                self._rows[key] = self._rows[None]
+                return
+            if self._smooth:
+                variables = frozenset().union(*[self._vars[c] for c in children])
+                children = [self._smooth_row(c, variables) for c in children]
+        self._rows[key] = self._add_row(op, children)
+
+    def _smooth_row(self, row, variables):
+        """Extend the given row with a tautology (a or -a) for each missing variable."""
+        missing = variables - self._vars[row]
+        if not missing:
+            return row
+        result = self._smoothed.get((row, missing))
+        if result is None:
+            children = [row]
+            for var in sorted(missing):
+                tautology = self._smoothed.get(var)
+                if tautology is None:
+                    tautology = self._add_row(_DISJ, [self._row(var), self._row(-var)])
+                    self._smoothed[var] = tautology
+                children.append(tautology)
+            result = self._add_row(_CONJ, children)
+            self._smoothed[(row, missing)] = result
+        return result
+
+    def _group_levels(self):
+        groups = defaultdict(list)
+        for row, op, children in self._ops:
+            groups[(self._level[row], op)].append((row, children))
+        levels = []
+        for level, op in sorted(groups):
+            rows = []
+            children = []
+            offsets = []
+            for row, cs in groups[(level, op)]:
+                rows.append(row)
+                offsets.append(len(children))
+                children += cs
+            ufunc = numpy.multiply if op == _CONJ else numpy.add
+            levels.append((numpy.array(rows, dtype=int), numpy.array(children, dtype=int),
+                           numpy.array(offsets, dtype=int), ufunc))
+        return levels
+
+
+class BatchSampler(object):
+    """Monte Carlo estimation of the probabilities of the queries of a ground program.
+
+    The program is grounded only once.
+    Fact values are drawn with NumPy for a batch of samples at once and packed into words of \
+    64 samples, such that the formula is evaluated with one bitwise operation per node for \
+    64 samples.
+    As in :class:`BatchEvaluator`, all nodes of a level of the formula are evaluated with a \
+    single NumPy reduction.
+    Choices of an annotated disjunction are drawn jointly, such that exactly one of them \
+    (or none) is true.
+    Samples that do not satisfy the evidence are rejected.
+
+    Only programs in which all probabilities are numbers are supported.
+
+    :param formula: acyclic ground program
+    :type formula: LogicDAG
+    :param seed: seed of the random generator
+    :param batch_size: number of samples drawn at once (rounded up to a multiple of 64)
+    """
+
+    def __init__(self, formula, seed=None, batch_size=16384):
+        if numpy is None:
+            raise InstallError('Vectorized sampling requires NumPy.')
+
+        self._formula = formula
+        self._rng = numpy.random.RandomState(seed)
+        self.batch_size = max(64, ((batch_size + 63) // 64) * 64)
+
+        # Row 0 is TRUE, row 1 is FALSE.
+        self._rows = {0: 0, None: 1}
+        self._level = [0, 0]
+        self._ops = []
+        # Each leaf row is true when the random number of its group lies in [low, high).
+        self._leaves = []   # (row, group, low, high)
+        self._groups = 0
+
+        for c in formula.constraints():
+            if isinstance(c, ConstraintAD) and c.is_nontrivial():
+                self._add_choices(sorted(c.nodes), c.extra_node)
+
+        queries = list(formula.queries())
+        evidence = evidence_literals(formula)
+        for key in topological_order(formula, [k for n, k in queries] + evidence):
+            self._add_node(key)
+
+        self.queries = [name for name, key in queries]
+        self._query_rows = numpy.array([self._row(key) for name, key in queries], dtype=int)
+        self._evidence_rows = numpy.array([self._row(key) for key in evidence], dtype=int)
+        self._levels = self._group_levels()
+
+        self._leaf_rows = numpy.array([r for r, g, l, h in self._leaves], dtype=int)
+        self._leaf_groups = numpy.array([g for r, g, l, h in self._leaves], dtype=int)
+        self._leaf_low = numpy.array([l for r, g, l, h in self._leaves])[:, None]
+        self._leaf_high = numpy.array([h for r, g, l, h in self._leaves])[:, None]
+
+        self.counts = numpy.zeros(len(self.queries), dtype=numpy.int64)
+        self.accepted = 0
+        self.rejected = 0
+
+    def __len__(self):
+        """Number of rows in the flattened formula."""
+        return len(self._level)
+
+    def sample(self, n):
+        """Draw samples and add them to the counts.
+
+        :param n: number of samples to draw
+        """
+        while n > 0:
+            size = min(n, self.batch_size)
+            words = (size + 63) // 64
+            values = numpy.empty((len(self), words), dtype=numpy.uint64)
+            self._draw(values, words * 64)
+
+            accepted = _packed_mask(size, words)
+            for row in self._evidence_rows:
+                accepted &= values[row]
+            n_accepted = _popcount(accepted)
+            self.counts += _popcount(values[self._query_rows] & accepted, axis=1)
+            self.accepted += n_accepted
+            self.rejected += size - n_accepted
+            n -= size
+
+    def estimate(self):
+        """Get the estimated probabilities of the queries given the evidence.
+
+        :return: {query: probability} (NaN if no sample was accepted)
+        """
+        if self.accepted == 0:
+            return dict((q, float('nan')) for q in self.queries)
+        return dict((q, float(c) / self.accepted) for q, c in zip(self.queries, self.counts))
+
+    def _draw(self, values, size):
+        values[0] = ~numpy.uint64(0)
+        values[1] = 0
+        if self._leaves:
+            u = self._rng.random_sample((self._groups, size))[self._leaf_groups]
+            bits = (u >= self._leaf_low) & (u < self._leaf_high)
+            values[self._leaf_rows] = numpy.packbits(bits, axis=1).view(numpy.uint64)
+        for rows, children, offsets, op in self._levels:
+            if op is None:
+                values[rows] = ~values[children]
+            else:
+                values[rows] = op.reduceat(values[children], offsets, axis=0)
+
+    def _add_choices(self, nodes, extra):
+        group = self._new_group()
+        low = 0.0
+        for key in nodes:
+            p = self._probability(key)
+            self._add_leaf(key, group, low, low + p)
+            low += p
+        if extra is not None:
+            self._add_leaf(extra, group, low, 2.0)
+
+    def _add_leaf(self, key, group, low, high):
+        row = self._new_row(0)
+        self._leaves.append((row, group, low, high))
+        self._rows[key] = row
+        return row
+
+    def _new_group(self):
+        self._groups += 1
+        return self._groups - 1
+
+    def _probability(self, key):
+        probability = self._formula.get_node(key).probability
+        if probability is True:
+            return 1.0
+        try:
+            return float(probability)
+        except Exception:
+            raise ProbLogError('Vectorized sampling requires numeric probabilities, found \'%s\'.'
+                               % probability)
+
+    def _row(self, key):
+        row = self._rows.get(key)
+        if row is None:
+            if key < 0:
+                child = self._row(-key)
+                row = self._new_row(self._level[child] + 1)
+                self._ops.append((row, _NOT, [child]))
+            else:
+                row = self._add_leaf(key, self._new_group(), 0.0, self._probability(key))
+            self._rows[key] = row
+        return row
+
+    def _new_row(self, level):
+        self._level.append(level)
+        return len(self._level) - 1
+
+    def _add_node(self, key):
+        node = self._formula.get_node(key)
+        if type(node).__name__ == 'atom':
+            return
+        children = [self._row(c) for c in node.children]
+        if not children:
+            self._rows[key] = self._rows[0 if type(node).__name__ == 'conj' else None]
+            return
+        row = self._new_row(1 + max(self._level[c] for c in children))
+        self._ops.append((row, _CONJ if type(node).__name__ == 'conj' else _DISJ, children))
+        self._rows[key] = row
+
+    def _group_levels(self):
+        groups = defaultdict(list)
+        for row, op, children in self._ops:
+            groups[(self._level[row], op)].append((row, children))
+        levels = []
+        for level, op in sorted(groups):
+            rows = []
+            children = []
+            offsets = []
+            for row, cs in groups[(level, op)]:
+                rows.append(row)
+                offsets.append(len(children))
+                children += cs
+            ufunc = {_CONJ: numpy.bitwise_and, _DISJ: numpy.bitwise_or, _NOT: None}[op]
+            levels.append((numpy.array(rows, dtype=int), numpy.array(children, dtype=int),
+                           numpy.array(offsets, dtype=int), ufunc))
+        return levels
+
+
+def _packed_mask(size, words):
+    """Packed words in which the first size samples are set."""
+    return numpy.packbits(numpy.arange(words * 64) < size).view(numpy.uint64)
+
+
+def _popcount(words, axis=None):
+    """Number of bits set in an array of packed words."""
+    return _POPCOUNT_TABLE[words.view(numpy.uint8)].sum(axis=axis, dtype=numpy.int64)
+
+
+if numpy is not None:
+    _POPCOUNT_TABLE = numpy.array([bin(i).count('1') for i in range(256)], dtype=numpy.uint8)
+
+
+def topological_order(formula, roots):
+    """Get the nodes that the given roots depend on, children before parents.
+
+    :param formula: acyclic formula
+    :param roots: list of node keys
+    :return: list of (positive) node keys
+    """
+    order = []
+    visited = set()
+    stack = [(abs(r), False) for r in roots if r is not None and r != 0]
+    while stack:
+        key, expanded = stack.pop()
+        if expanded:
+            order.append(key)
+        elif key not in visited:
+            visited.add(key)
+            node = formula.get_node(key)
+            if type(node).__name__ != 'atom':
+                stack.append((key, True))
+                for c in node.children:
+                    if c is not None and c != 0 and abs(c) not in visited:
+                        stack.append((abs(c), False))
+    return order
+
+
+def evidence_literals(formula):
+    """Get the evidence of a formula as a list of literals.
+
+    :param formula: formula
+    :return: list of node keys that are true (negative for negative evidence)
+    :raises InconsistentEvidenceError: if the evidence is deterministically inconsistent
+    """
+    result = []
+    for name, index, value in formula.evidence_all():
+        if value == 0 or (index == 0 and value > 0) or (index is None and value < 0):
+            pass
+        elif index == 0 or index is None:
+            raise InconsistentEvidenceError(source='evidence(%s,%s)'
+                                                   % (name, 'true' if value > 0 else 'false'))
+        else:
+            result.append(value * index)
+    return result
+
+
+def batch_weights(formula, weights=None):
+    """Collect the base weights, facts and annotated disjunctions of a formula.
+
+    :param formula: formula
+    :param weights: dictionary of { node name : weight } that overrides the builtin weights
+    :return: tuple (weights, facts, constraints) as expected by :class:`BatchEvaluator`
+    """
+    weights = formula.extract_weights(SemiringProbability(), weights)
+    facts = []
+    for name, key in formula.get_names(formula.LABEL_NAMED):
+        w = formula.get_weights().get(key)
+        if key is not None and key > 0 and w is not None \
+                and w is not formula.WEIGHT_NEUTRAL and w is not False:
+            facts.append((name, key))
+    constraints = []
+    for c in formula.constraints():
+        if isinstance(c, ConstraintAD) and c.is_nontrivial():
+            constraints.append((sorted(c.nodes), c.extra_node))
+    return weights, facts, constraints
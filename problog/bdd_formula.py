@@ -156,7 +156,82 @@ class BDDManager(DDManager):
         return pall
 
     def wmc_literal(self, node, weights, semiring, literal):
-        raise NotImplementedError('not supported')
+        return self.wmc_literals(node, weights, semiring, [literal])[0]
+
+    def wmc_literals(self, node, weights, semiring, literals):
+        """Evaluate several literals with one upward and one downward pass over the BDD.
+
+        As in :meth:`wmc`, variables that do not occur on a path are assumed to have a total \
+        weight of one.
+
+        :param node: root of the BDD
+        :param weights: weights for the variables in the node
+        :param semiring: use the operations defined by this semiring
+        :param literals: literals to evaluate
+        :return: list with for each literal its weighted model count conjoined with the node \
+            relative to the weighted model count of the node
+        """
+        zero = semiring.zero()
+        root = node.node
+
+        # Internal nodes in topological order (children first).
+        order = []
+        visited = set()
+        stack = [(root, False)]
+        while stack:
+            current, expanded = stack.pop()
+            if expanded:
+                order.append(current)
+            elif current not in visited and current.lo is not None:
+                visited.add(current)
+                stack.append((current, True))
+                stack.append((current.lo, False))
+                stack.append((current.hi, False))
+
+        # Upward pass: weighted model count of each node.
+        variables = {}
+        up = {bdd.BDDNODEZERO: zero, bdd.BDDNODEONE: semiring.one()}
+        for current in order:
+            var = variables[current] = self.get_variable(current)
+            pos, neg = weights[var]
+            up[current] = semiring.plus(semiring.times(pos, up[current.hi]),
+                                        semiring.times(neg, up[current.lo]))
+        total = up[root]
+
+        # Downward pass: derivative of the total with respect to each node.
+        down = dict((current, zero) for current in up)
+        down[root] = semiring.one()
+        through = {}    # weight of the models that contain a node of the variable
+        positive = {}   # weight of the models that set the variable to true in such a node
+        negative = {}
+        for current in reversed(order):
+            var = variables[current]
+            pos, neg = weights[var]
+            d = down[current]
+            d_pos = semiring.times(d, pos)
+            d_neg = semiring.times(d, neg)
+            down[current.hi] = semiring.plus(down[current.hi], d_pos)
+            down[current.lo] = semiring.plus(down[current.lo], d_neg)
+            through[var] = semiring.plus(through.get(var, zero), semiring.times(d, up[current]))
+            positive[var] = semiring.plus(positive.get(var, zero),
+                                          semiring.times(d_pos, up[current.hi]))
+            negative[var] = semiring.plus(negative.get(var, zero),
+                                          semiring.times(d_neg, up[current.lo]))
+
+        result = []
+        for literal in literals:
+            var = abs(literal)
+            pos, neg = weights[var]
+            if literal > 0:
+                value, weight = positive.get(var, zero), pos
+            else:
+                value, weight = negative.get(var, zero), neg
+            # Models that skip the variable take it with its prior probability.
+            skipped = semiring.negate(semiring.normalize(through.get(var, zero), total))
+            prior = semiring.normalize(weight, semiring.plus(pos, neg))
+            result.append(semiring.plus(semiring.normalize(value, total),
+                                        semiring.times(skipped, prior)))
+        return result
 
     def wmc_true(self, weights, semiring):
         return semiring.one()
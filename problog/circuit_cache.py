@@ -0,0 +1,274 @@
+"""
+problog.circuit_cache - Persistent cache of compiled circuits
+-------------------------------------------------------------
+
+Stores compiled formulae (SDD, BDD, d-DNNF) on disk, keyed by the structure of the ground program.
+
+..
+    Part of the ProbLog distribution.
+
+    Copyright 2015 KU Leuven, DTAI Research Group
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+from __future__ import print_function
+
+import hashlib
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .formula import LogicDAG
+from .dd_formula import DD
+from .ddnnf_formula import DDNNF
+from .version import version
+from .util import Timer
+
+
+class CircuitCache(object):
+    """On-disk cache of compiled formulae.
+
+    The cache key is a fingerprint of the ground program that only covers what influences \
+    compilation: the node structure, the constraints, the labeled nodes and the requested \
+    target class.
+    Atom weights and evidence values are not part of the key.
+    They are copied from the current ground program when a cached circuit is reused.
+
+    When the total size of the cache exceeds ``max_size`` the least recently used entries are \
+    removed.
+
+    :param directory: directory in which to store the compiled formulae (created if needed)
+    :param max_size: maximal total size of the cache in bytes (None for no limit)
+    """
+
+    suffix = '.circuit'
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def create_from(self, target, source, **kwdargs):
+        """Create a formula of the given class, reusing a cached compilation when possible.
+
+        :param target: class of the compiled formula (e.g. SDD or DDNNF)
+        :param source: program or formula to compile
+        :param kwdargs: additional arguments passed to the transformations
+        :return: formula of class target
+        """
+        ground = LogicDAG.create_from(source, **kwdargs)
+        key = self.fingerprint(ground, target)
+        compiled = self.load(key)
+        if compiled is not None and self.update(compiled, ground):
+            self.hits += 1
+            logging.getLogger('problog').debug('Circuit cache hit: %s' % key)
+        else:
+            self.misses += 1
+            compiled = target.create_from(ground, **kwdargs)
+            if _source_keys(compiled) is not None:
+                self.store(key, compiled)
+        return compiled
+
+    def fingerprint(self, formula, target):
+        """Compute the cache key of a ground formula.
+
+        :param formula: ground formula
+        :type formula: LogicDAG
+        :param target: class of the compiled formula
+        :return: hexadecimal digest
+        :rtype: str
+        """
+        h = hashlib.sha1()
+        h.update(('%s|%s|%s\n' % (version, target.__module__, target.__name__)).encode('utf-8'))
+        for i, n, t in formula:
+            if t == 'atom':
+                line = 'a %r %s' % (n.group, n.probability is formula.WEIGHT_NEUTRAL)
+            else:
+                line = '%s %s' % (t[0], ' '.join(map(str, n.children)))
+            h.update((line + '\n').encode('utf-8'))
+
+        for c in formula.constraints():
+            clauses = sorted(repr(sorted(cl, key=repr)) for cl in (c.as_clauses() or []))
+            h.update(('c %s\n' % clauses).encode('utf-8'))
+
+        names = []
+        for name, node, label in formula.get_names_with_label():
+            if label in _EVIDENCE_LABELS:
+                label = 'evidence'
+            names.append('n %s %s %s' % (label, node, name))
+        for line in sorted(names):
+            h.update((line + '\n').encode('utf-8'))
+        return h.hexdigest()
+
+    def load(self, key):
+        """Load the compiled formula stored under the given key.
+
+        :param key: cache key
+        :return: compiled formula or None if it is not in the cache
+        """
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                with Timer('Loading cached circuit'):
+                    formula = pickle.load(f)
+        except (IOError, OSError):
+            return None
+        except Exception as err:
+            logging.getLogger('problog').warning('Discarding unreadable cache entry %s: %s'
+                                                 % (filename, err))
+            self._remove(filename)
+            return None
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return formula
+
+    def store(self, key, formula):
+        """Store a compiled formula under the given key and enforce the size limit.
+
+        :param key: cache key
+        :param formula: compiled formula
+        """
+        fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(formula, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpname, self._filename(key))
+        except Exception as err:
+            logging.getLogger('problog').warning('Unable to store circuit in cache: %s' % err)
+            self._remove(tmpname)
+            return
+        self.evict()
+
+    def update(self, compiled, ground):
+        """Copy the weights and evidence values of a ground formula to a cached compiled formula.
+
+        :param compiled: compiled formula loaded from the cache
+        :param ground: ground formula with the same fingerprint
+        :return: True if the compiled formula was updated, False if its type is not supported
+        """
+        source_keys = _source_keys(compiled)
+        if source_keys is None:
+            return False
+
+        weights = compiled.get_weights()
+        new_weights = ground.get_weights()
+        for key, source in source_keys.items():
+            weights[key] = new_weights.get(source, weights[key])
+
+        evidence_keys = {}
+        for label in _EVIDENCE_LABELS:
+            for name, key in compiled.get_names(label):
+                evidence_keys[name] = key
+        compiled.clear_evidence()
+        for name, key, value in ground.evidence_all():
+            compiled.add_evidence(name, evidence_keys[name], {1: True, -1: False, 0: None}[value])
+        return True
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits within its size limit."""
+        if self.max_size is None:
+            return
+        entries = []
+        total = 0
+        for fn in os.listdir(self.directory):
+            if fn.endswith(self.suffix):
+                filename = os.path.join(self.directory, fn)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, filename))
+                total += st.st_size
+        entries.sort()
+        for mtime, size, filename in entries:
+            if total <= self.max_size:
+                break
+            self._remove(filename)
+            total -= size
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    @staticmethod
+    def _remove(filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+class MemoryCircuitCache(CircuitCache):
+    """In-memory variant of :class:`CircuitCache` for long running processes.
+
+    Compiled formulae are kept as objects instead of being pickled to disk.
+    A formula returned by :meth:`create_from` is shared with the cache and is updated in place \
+    when it is reused.
+
+    :param max_entries: maximal number of compiled formulae to keep (None for no limit)
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, key):
+        formula = self._entries.pop(key, None)
+        if formula is not None:
+            self._entries[key] = formula
+        return formula
+
+    def store(self, key, formula):
+        self._entries.pop(key, None)
+        self._entries[key] = formula
+        self.evict()
+
+    def evict(self):
+        if self.max_entries is not None:
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_EVIDENCE_LABELS = (LogicDAG.LABEL_EVIDENCE_POS, LogicDAG.LABEL_EVIDENCE_NEG,
+                    LogicDAG.LABEL_EVIDENCE_MAYBE)
+
+
+def _source_keys(compiled):
+    """Map the weighted atoms of a compiled formula to the ground nodes they were created from.
+
+    :param compiled: compiled formula
+    :return: dictionary {compiled key: ground key} or None if the formula type is not supported
+    """
+    if isinstance(compiled, DDNNF):
+        # Atoms of a d-DNNF are identified by their CNF variable, i.e. their key in the LogicDAG.
+        return {key: compiled.get_node(key).identifier for key in compiled.get_weights()}
+    elif isinstance(compiled, DD):
+        # Bottom-up compilation preserves the keys of the LogicDAG.
+        return {key: key for key in compiled.get_weights()}
+    else:
+        return None
@@ -1,6 +1,7 @@
 from __future__ import print_function
 
 import os
+import logging
 
 from collections import defaultdict, namedtuple
 
@@ -8,7 +9,6 @@ from .program import LogicProgram, PrologFile
 from .logic import *
 
 from .errors import GroundingError, InvalidValue
-from .util import OrderedSet
 
 
 class ClauseDB(LogicProgram):
@@ -73,6 +73,7 @@ class ClauseDB(LogicProgram):
         self.__parent = parent
         self.__node_redirect = {}
         self.__extern = defaultdict(list)
+        self.__version = 0  # number of modifications
 
         if parent is None:
             self.__offset = 0
@@ -98,6 +99,20 @@ class ClauseDB(LogicProgram):
     def extend(self):
         return ClauseDB(parent=self, builtins=self.__builtins)
 
+    def get_version(self):
+        """Get a counter that changes whenever the database (or its parent) is modified.
+
+        :return: modification counter
+        :rtype: int
+        """
+        if self.__parent is None:
+            return self.__version
+        else:
+            return self.__version + self.__parent.get_version()
+
+    def _modified(self):
+        self.__version += 1
+
     def set_data(self, key, value):
         self.data[key] = value
 
@@ -211,10 +226,12 @@ class ClauseDB(LogicProgram):
             raise IndexError('Can\'t update node in parent.')
         else:
             self.__nodes[index - self.__offset] = node
+            self._modified()
 
     def _append_node(self, node=()):
         index = len(self)
         self.__nodes.append(node)
+        self._modified()
         return index
 
     def _get_head(self, head=None):
@@ -270,6 +287,22 @@ class ClauseDB(LogicProgram):
         """
         return self._get_head(head)
 
+    def get_index_statistics(self):
+        """Get information about the clause indexes that were built for the predicates.
+
+        :return: dictionary signature => statistics (see :func:`ClauseIndex.get_statistics`)
+        :rtype: dict
+        """
+        if self.__parent is None:
+            result = {}
+        else:
+            result = self.__parent.get_index_statistics()
+        for signature, index in self.__heads.items():
+            node = self.get_node(index)
+            if type(node).__name__ == 'define':
+                result[signature] = node.children.get_statistics()
+        return result
+
     def __repr__(self):
         s = ''
         for i, n in enumerate(self.__nodes):
@@ -802,62 +835,151 @@ def intersection(l1, l2):
 
 
 class ClauseIndex(list):
+    """List of the clauses of a predicate with just-in-time argument indexing.
+
+    Indexes are not built up front.
+    The first call to :func:`find` with a given combination of bound argument positions \
+    builds a hash index on exactly those positions (a first-argument index, a second-argument \
+    index, a compound index on the first two arguments, ...).
+    Later calls with the same combination reuse it, and later clauses are added to it.
+
+    An index maps the values of the clauses' arguments on its positions to the (ordered) \
+    positions of the clauses in the list.
+    Clauses with a non-ground argument on one of the positions are kept in a separate list \
+    that is checked on each lookup.
+    Results are therefore produced in clause order without any set operations.
+
+    :param parent: database the clauses belong to
+    :param arity: arity of the predicate
+    """
+
+    # Don't build indexes for predicates with fewer clauses, a scan is cheaper.
+    min_index_size = 8
+    # Maximal number of indexes per predicate.
+    max_indexes = 8
 
     def __init__(self, parent, arity):
         list.__init__(self)
         self.__parent = parent
-        self.__basetype = OrderedSet
-        self.__index = [defaultdict(self.__basetype) for _ in range(0, arity)]
-        self.__optimized = False
+        self.__arity = arity
+        self.__indexes = {}     # positions => (table: key => clause positions, wildcard positions)
         self.__erased = set()
+        self.__lookups = 0
+        self.__scans = 0
 
-    def find(self, arguments):
-        results = None
-        for i, arg in enumerate(arguments):
-            if not is_ground(arg):
-                pass  # Variable => no restrictions
+    def _get_key(self, item):
+        """Get the ground arguments of the given clause (None for non-ground arguments)."""
+        try:
+            args = self.__parent.get_node(item).args
+        except AttributeError:
+            return (None,) * self.__arity
+        return tuple(arg if is_ground(arg) else None for arg in args)
+
+    def _add_to_index(self, positions, index, pos, key):
+        table, wildcards = index
+        subkey = tuple(key[i] for i in positions)
+        for k in subkey:
+            if k is None:
+                wildcards.append(pos)
+                break
+        else:
+            bucket = table.get(subkey)
+            if bucket is None:
+                table[subkey] = [pos]
             else:
-                curr = self.__index[i].get(arg)
-                none = self.__index[i].get(None, self.__basetype())
-                if curr is None:
-                    curr = none
-                else:
-                    curr |= none
+                bucket.append(pos)
+
+    def _build_index(self, positions):
+        index = ({}, [])
+        for pos, item in enumerate(self):
+            self._add_to_index(positions, index, pos, self._get_key(item))
+        self.__indexes[positions] = index
+        logging.getLogger('problog').debug('Built clause index on arguments %s (%s clauses, %s keys)',
+                                           positions, len(self), len(index[0]))
+        return index
 
-                if results is None:  # First argument with restriction
-                    results = curr
-                else:
-                    results = results & curr       # for some reason &= doesn't work here
-            if results is not None and not results:
-                return []
-        if results is None:
-            if self.__erased:
-                return OrderedSet(self) - self.__erased
-            else:
-                return self
+    def _matches(self, pos, positions, arguments):
+        key = self._get_key(self[pos])
+        for i in positions:
+            if key[i] is not None and key[i] != arguments[i]:
+                return False
+        return True
+
+    def _select_index(self, positions):
+        """Get the index for the given positions, building it if possible.
+
+        When no new index can be built, the existing index that covers the most of the given \
+        positions is used.
+
+        :return: tuple (positions of the index, index) or (None, None)
+        """
+        index = self.__indexes.get(positions)
+        if index is not None:
+            return positions, index
+        elif len(self) >= self.min_index_size and len(self.__indexes) < self.max_indexes:
+            return positions, self._build_index(positions)
         else:
-            if self.__erased:
-                return results - self.__erased
+            best = None
+            for ipos in self.__indexes:
+                if set(ipos) <= set(positions) and (best is None or len(ipos) > len(best)):
+                    best = ipos
+            if best is None:
+                return None, None
             else:
-                return results
+                return best, self.__indexes[best]
 
-    def _add(self, key, item):
-        for i, k in enumerate(key):
-            self.__index[i][k].add(item)
+    def find(self, arguments):
+        """Find the clauses that may match the given call arguments.
+
+        :param arguments: arguments of the call
+        :return: list of clauses in order (can contain false positives)
+        """
+        positions = tuple(i for i, arg in enumerate(arguments) if is_ground(arg))
+        if not positions:
+            result = self
+        else:
+            self.__lookups += 1
+            ipos, index = self._select_index(positions)
+            if index is None:
+                self.__scans += 1
+                matches = [pos for pos in range(0, len(self))
+                           if self._matches(pos, positions, arguments)]
+            else:
+                table, wildcards = index
+                matches = table.get(tuple(arguments[i] for i in ipos), [])
+                if len(ipos) < len(positions):
+                    matches = [pos for pos in matches if self._matches(pos, positions, arguments)]
+                if wildcards:
+                    extra = [pos for pos in wildcards if self._matches(pos, positions, arguments)]
+                    if extra:
+                        matches = sorted(matches + extra)
+            result = [self[pos] for pos in matches]
+        if self.__erased:
+            return [item for item in result if item not in self.__erased]
+        elif result is self:
+            return self
+        else:
+            return result
 
     def append(self, item):
         list.append(self, item)
-        key = []
-        try:
-            args = self.__parent.get_node(item).args
-        except AttributeError:
-            args = [None] * self.__parent.get_node(item).arity
-        for arg in args:
-            if is_ground(arg):
-                key.append(arg)
-            else:
-                key.append(None)
-        self._add(key, item)
+        if self.__indexes:
+            pos = len(self) - 1
+            key = self._get_key(item)
+            for positions, index in self.__indexes.items():
+                self._add_to_index(positions, index, pos, key)
 
     def erase(self, items):
         self.__erased |= set(items)
+        self.__parent._modified()
+
+    def get_statistics(self):
+        """Get information about the use of this index.
+
+        :return: dictionary with the built indexes (positions => number of keys), the number of \
+        lookups with bound arguments and the number of those that required a scan of all clauses
+        :rtype: dict
+        """
+        return {'indexes': {positions: len(index[0]) for positions, index in self.__indexes.items()},
+                'lookups': self.__lookups,
+                'scans': self.__scans}
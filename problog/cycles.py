@@ -36,14 +36,18 @@ import logging
 
 # noinspection PyUnusedLocal
 @transform(LogicFormula, LogicDAG)
-def break_cycles(source, target, translation=None, **kwdargs):
+def break_cycles(source, target, translation=None, cycle_breaking=None, **kwdargs):
     """Break cycles in the source logic formula.
 
     :param source: logic formula with cycles
     :param target: target logic formula without cycles
+    :param cycle_breaking: algorithm to use: 'scc' for :func:`break_cycles_scc`, \
+      otherwise recursive unfolding
     :param kwdargs: additional arguments (ignored)
     :return: target
     """
+    if cycle_breaking == 'scc':
+        return break_cycles_scc(source, target, translation)
 
     logger = logging.getLogger('problog')
     with Timer('Cycle breaking'):
@@ -145,3 +149,250 @@ def _break_cycles(source, target, nodeid, ancestors, cycles_broken, content, tra
         return target.negate(newnode)
     else:
         return newnode
+
+
+def break_cycles_scc(source, target, translation=None):
+    """Break cycles in the source logic formula using its strongly connected components.
+
+    This produces a formula that is equivalent to the one of :func:`break_cycles`, but the \
+    translation of a node only depends on its ancestors in the same strongly connected component \
+    (SCC).
+    Nodes outside of cycles are therefore translated once, and cycles are only unfolded within \
+    their SCC.
+    The formula is traversed iteratively, such that deep formulas do not exceed the recursion \
+    limit.
+
+    :param source: logic formula with cycles
+    :param target: target logic formula without cycles
+    :param translation: dictionary in which to store the translation of the query nodes
+    :return: target
+    """
+    logger = logging.getLogger('problog')
+    with Timer('Cycle breaking (SCC)'):
+        roots = [abs(n) for q, n, l in source.labeled() if source.is_probabilistic(n)]
+        roots += [abs(n) for q, n, v in source.evidence_all() if source.is_probabilistic(n)]
+        component, cyclic = _strongly_connected_components(source, roots)
+        if translation is None:
+            translation = defaultdict(list)
+
+        for q, n, l in source.labeled():
+            if source.is_probabilistic(n):
+                newnode = _translate(source, target, n, component, cyclic, translation, False)
+            else:
+                newnode = n
+            target.add_name(q, newnode, l)
+
+        translation = defaultdict(list)
+        for q, n, v in source.evidence_all():
+            if source.is_probabilistic(n):
+                newnode = _translate(source, target, abs(n), component, cyclic, translation, True)
+            else:
+                newnode = n
+            if n is not None and n < 0:
+                newnode = target.negate(newnode)
+            if v > 0:
+                target.add_name(q, newnode, target.LABEL_EVIDENCE_POS)
+            elif v < 0:
+                target.add_name(q, newnode, target.LABEL_EVIDENCE_NEG)
+            else:
+                target.add_name(q, newnode, target.LABEL_EVIDENCE_MAYBE)
+
+        logger.debug("Ground program size: %s", len(target))
+        return target
+
+
+def _children(source, nodeid):
+    node = source.get_node(nodeid)
+    if type(node).__name__ == 'atom':
+        return ()
+    return node.children
+
+
+def _strongly_connected_components(source, roots):
+    """Compute the strongly connected components of the part of the formula reachable from the \
+    given roots (iterative version of Tarjan's algorithm).
+
+    :param source: formula
+    :param roots: nodes to start from
+    :return: tuple (component, cyclic) with component a dictionary mapping each node to the \
+      identifier of its SCC, and cyclic the set of identifiers of SCCs that contain a cycle
+    """
+    index = {}
+    lowlink = {}
+    component = {}
+    cyclic = set()
+    stack = []
+    on_stack = set()
+    counter = 0
+
+    for root in roots:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(_children(source, root)))]
+        while work:
+            nodeid, children = work[-1]
+            descended = False
+            for child in children:
+                if child is None or child == 0:
+                    continue
+                child = abs(child)
+                if child not in index:
+                    index[child] = lowlink[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(_children(source, child))))
+                    descended = True
+                    break
+                elif child in on_stack:
+                    if child == nodeid:
+                        cyclic.add(nodeid)  # self-loop; the SCC is identified by its root
+                    lowlink[nodeid] = min(lowlink[nodeid], index[child])
+            if descended:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[nodeid])
+            if lowlink[nodeid] == index[nodeid]:
+                size = 0
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component[member] = nodeid
+                    size += 1
+                    if member == nodeid:
+                        break
+                if size > 1:
+                    cyclic.add(nodeid)
+    return component, cyclic
+
+
+class _Frame(object):
+    """Compound node that is being translated by :func:`_translate`."""
+
+    __slots__ = ('nodeid', 'node', 'negative', 'component', 'ancestors', 'children',
+                 'cycles_broken', 'content')
+
+    def __init__(self, nodeid, node, negative, component, ancestors):
+        self.nodeid = nodeid
+        self.node = node
+        self.negative = negative
+        self.component = component
+        self.ancestors = ancestors  # ancestors in the same SCC (None if the SCC is acyclic)
+        self.children = []
+        self.cycles_broken = set()
+        self.content = set()
+
+
+def _translate(source, target, key, component, cyclic, translation, is_evidence):
+    """Translate a node of the source formula (see :func:`break_cycles_scc`).
+
+    Ancestors, broken cycles and content are tracked as in :func:`_break_cycles`, but only for \
+    nodes in the same SCC as the node that is being translated.
+
+    :return: key of the translated node in target
+    """
+    frames = []
+    pending = key   # node that should be translated next
+    while True:
+        if pending is not None:
+            parent = frames[-1] if frames else None
+            negative_node = pending < 0
+            nodeid = abs(pending)
+            pending = None
+            result = _lookup(source, nodeid, parent, component, cyclic, translation, is_evidence)
+            if result is None:
+                node = source.get_node(nodeid)
+                comp = component[nodeid]
+                if type(node).__name__ != 'atom':
+                    if comp in cyclic:
+                        if parent is not None and parent.component == comp:
+                            ancestors = parent.ancestors
+                        else:
+                            ancestors = set()
+                        ancestors.add(nodeid)
+                    else:
+                        ancestors = None
+                    frames.append(_Frame(nodeid, node, negative_node, comp, ancestors))
+                    continue
+                newnode = target.add_atom(node.identifier, node.probability, node.group,
+                                          node.name)
+                translation[nodeid].append((newnode, set(), set()))
+            else:
+                newnode = result[0]
+            if negative_node:
+                newnode = target.negate(newnode)
+            if parent is None:
+                return newnode
+            parent.children.append(newnode)
+
+        frame = frames[-1]
+        if len(frame.children) < len(frame.node.children):
+            child = frame.node.children[len(frame.children)]
+            if child is None or child == 0:
+                frame.children.append(child)
+            else:
+                pending = child
+            continue
+
+        # All children are translated: create the node.
+        frames.pop()
+        nodeid = frame.nodeid
+        node = frame.node
+        cycles_broken = frame.cycles_broken
+        newname = node.name
+        if newname is not None and cycles_broken:
+            newfunc = '_problog_' + newname.functor + '_cb_' + str(len(translation[nodeid]))
+            newname = Term(newfunc, *newname.args)
+        if type(node).__name__ == 'conj':
+            newnode = target.add_and(frame.children, name=newname)
+        else:
+            newnode = target.add_or(frame.children, name=newname)
+        if frame.ancestors is not None:
+            frame.ancestors.discard(nodeid)
+        translation[nodeid].append((newnode, cycles_broken, frame.content - cycles_broken))
+
+        if frames and frames[-1].component == frame.component:
+            parent = frames[-1]
+            if target.is_probabilistic(newnode):
+                parent.content.add(nodeid)
+            parent.content |= frame.content
+            parent.cycles_broken |= cycles_broken
+        if frame.negative:
+            newnode = target.negate(newnode)
+        if not frames:
+            return newnode
+        frames[-1].children.append(newnode)
+
+
+def _lookup(source, nodeid, parent, component, cyclic, translation, is_evidence):
+    """Find the translation of a node that does not need to be (re)computed.
+
+    :return: tuple (translated node,) or None if the node should be translated
+    """
+    if not is_evidence and not source.is_probabilistic(source.get_evidence_value(nodeid)):
+        return source.get_evidence_value(nodeid),
+    comp = component[nodeid]
+    if comp not in cyclic:
+        # The translation does not depend on the ancestors.
+        if nodeid in translation:
+            return translation[nodeid][0][0],
+        return None
+    same = parent is not None and parent.component == comp
+    ancestors = parent.ancestors if same else ()
+    if nodeid in ancestors:
+        parent.cycles_broken.add(nodeid)
+        return None,    # cyclic node: node is False
+    for newnode, cb, cn in translation.get(nodeid, ()):
+        # Reuse the node if the same cycles would be broken (see _break_cycles).
+        if all(n == nodeid or n in ancestors for n in cb) and not any(n in ancestors for n in cn):
+            if same:
+                parent.cycles_broken |= cb
+                parent.content |= cn
+            return newnode,
+    return None
@@ -115,6 +115,22 @@ class DD(LogicFormula, EvaluatableDSP):
         else:
             return self.get_manager().constraint_dd
 
+    def _evaluate_inode(self, inode, semiring, weights, cache):
+        """Evaluate an internal node in the given semiring.
+
+        The default implementation converts the node to a :class:`LogicNNF` and evaluates it.
+
+        :param inode: internal node
+        :param semiring: semiring to use
+        :param weights: weights of the variables: dict(var: (pos, neg))
+        :param cache: values of internal nodes that were computed before
+        :type cache: InodeCache
+        :return: (unnormalized) value of the internal node
+        """
+        formula = LogicNNF()
+        i = self._to_formula(formula, inode)
+        return formula.evaluate(index=i, semiring=semiring)
+
     def _create_evaluator(self, semiring, weights, **kwargs):
         if semiring.is_nsp():
             return FormulaEvaluatorNSP(self.to_formula(), semiring, weights)
@@ -361,6 +377,56 @@ class DDManager(object):
         """
         raise NotImplementedError('abstract method')
 
+    def wmc_literals(self, node, weights, semiring, literals):
+        """Evaluate several literals in the decision diagram.
+
+        The result for a literal is the weighted model count of the node conjoined with the \
+        literal, normalized by the weighted model count of the node.
+        This default implementation evaluates each literal separately.
+
+        :param node: root of the decision diagram
+        :param weights: weights for the variables in the node
+        :param semiring: use the operations defined by this semiring
+        :param literals: literals to evaluate
+        :return: list with a value for each literal
+        """
+        total = self.wmc(node, weights, semiring)
+        result = []
+        for literal in literals:
+            if literal < 0:
+                literal_node = self.negate(self.literal(-literal))
+            else:
+                literal_node = self.literal(literal)
+            query_node = self.conjoin(node, literal_node)
+            result.append(semiring.normalize(self.wmc(query_node, weights, semiring), total))
+            self.deref(query_node)
+            if literal < 0:
+                self.deref(literal_node)
+        return result
+
+    def wmc_updates(self, node, weights, semiring, updates, literal=None):
+        """Perform Weighted Model Count on the given node for a sequence of weight updates.
+
+        Each update is applied on top of the previous ones.
+        This default implementation evaluates each set of weights separately.
+
+        :param node: node to evaluate
+        :param weights: initial weights for the variables in the node
+        :param semiring: use the operations defined by this semiring
+        :param updates: sequence of dictionaries with the weights that change: dict(var: (pos, neg))
+        :param literal: evaluate this literal instead of the node itself (see :meth:`wmc_literal`)
+        :return: list with the result after each update
+        """
+        weights = dict(weights)
+        result = []
+        for update in updates:
+            weights.update(update)
+            if literal is None:
+                result.append(self.wmc(node, weights, semiring))
+            else:
+                result.append(self.wmc_literal(node, weights, semiring, literal))
+        return result
+
     def wmc_true(self, weights, semiring):
         """Perform weighted model count on a true node.
         This can be used to obtain a normalization constant.
@@ -376,23 +442,73 @@ class DDManager(object):
         raise NotImplementedError('abstract method')
 
 
+class InodeCache(object):
+    """Values of internal nodes of a decision diagram in a custom semiring.
+
+    The cache is shared by the evaluation of all queries and of the evidence, and is only valid \
+    for a fixed semiring and fixed weights.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def clear(self):
+        """Remove all values (e.g. after a change of the weights)."""
+        self.values.clear()
+
+    def get_statistics(self):
+        """Get information about the use of the cache.
+
+        :return: dictionary with the number of entries, hits and misses
+        :rtype: dict
+        """
+        return {'entries': len(self.values), 'hits': self.hits, 'misses': self.misses}
+
+
 class DDEvaluator(Evaluator):
     """Generic evaluator for bottom-up compiled decision diagrams.
 
+    For the probability semirings, all atom queries are evaluated together by default \
+    (see :meth:`evaluate_queries`).
+
     :param formula:
     :type: DD
     :param semiring:
     :param weights:
+    :param all_marginals: evaluate all atom queries in a single pass over the decision diagram
+    :param query_indicators: also evaluate the other queries in this pass by means of indicator \
+      variables (this can make the decision diagram much larger)
     :return:
 
     """
 
-    def __init__(self, formula, semiring, weights=None, **kwargs):
+    def __init__(self, formula, semiring, weights=None, all_marginals=True, query_indicators=False,
+                 **kwargs):
         Evaluator.__init__(self, formula, semiring, weights, **kwargs)
         self.formula = formula
         self.normalization = None
         self._evidence_weight = None
         self.evidence_inode = None
+        self.all_marginals = all_marginals
+        self.query_indicators = query_indicators
+
+        self._results = {}              # Query results for the current evidence: dict(key: value)
+        self._weights_changed = False   # Weights were set since the evidence was evaluated
+        self._supports = {}             # Atoms on which a node depends: dict(key: frozenset)
+        self._evidence_support = None   # Atoms on which the evidence depends
+
+        self._indicators = {}           # Indicator variables of compound nodes: dict(key: var)
+        self._indicator_inode = None    # Evidence conjoined with the indicator definitions
+        self._indicator_evidence = None     # Evidence node used in _indicator_inode
+        self._indicated = set()         # Nodes whose indicator is defined in _indicator_inode
+
+        # Values of internal nodes for the custom semirings
+        self.inode_cache = InodeCache()
 
     def _get_manager(self):
         return self.formula.get_manager()
@@ -402,6 +518,7 @@ class DDEvaluator(Evaluator):
 
     def _initialize(self, with_evidence=True):
         self.weights.clear()
+        self.inode_cache.clear()
 
         weights = self.formula.extract_weights(self.semiring, self.given_weights)
         for atom, weight in weights.items():
@@ -413,43 +530,236 @@ class DDEvaluator(Evaluator):
             for ev in self.evidence():
                 if ev in self.formula.atom2var:
                     # Only for atoms
-                    self.set_evidence(self.formula.atom2var[ev], ev > 0)
+                    self._set_evidence(self.formula.atom2var[ev], ev > 0)
 
     def propagate(self):
         self._initialize()
+        self._update_normalization()
+        self._results.clear()
+        self.evaluate_evidence()
+
+    def _update_normalization(self):
         if isinstance(self.semiring, SemiringLogProbability) or isinstance(self.semiring, SemiringProbability):
             self.normalization = self._get_manager().wmc_true(self.weights, self.semiring)
-
         else:
             self.normalization = None
-        self.evaluate_evidence()
 
     def _evaluate_evidence(self, recompute=False):
+        if self._weights_changed:
+            # Weights were changed with set_weight or set_evidence.
+            self._weights_changed = False
+            self._update_normalization()
+            if self.evidence_inode is not None and not recompute:
+                self._evidence_weight = self._compute_evidence_weight()
         if self._evidence_weight is None or recompute:
+            self._results.clear()
+            self._evidence_support = None
+
             constraint_inode = self.formula.get_constraint_inode()
             evidence_nodes = [self.formula.get_inode(ev) for ev in self.evidence()]
             self.evidence_inode = self._get_manager().conjoin(constraint_inode, *evidence_nodes)
-
-            if isinstance(self.semiring, SemiringLogProbability) or isinstance(self.semiring, SemiringProbability):
-                result = self._get_manager().wmc(self.evidence_inode, self.weights, self.semiring)
-                if result == self.semiring.zero():
-                    raise InconsistentEvidenceError(context=' during compilation')
-                self._evidence_weight = self.semiring.normalize(result, self.normalization)
-            else:
-                formula = LogicNNF()
-                i = self.formula._to_formula(formula, self.evidence_inode)
-                self._evidence_weight = formula.evaluate(index=i, semiring=self.semiring)
+            self._evidence_weight = self._compute_evidence_weight()
 
         return self._evidence_weight
 
+    def _compute_evidence_weight(self):
+        if isinstance(self.semiring, SemiringLogProbability) or isinstance(self.semiring, SemiringProbability):
+            result = self._get_manager().wmc(self.evidence_inode, self.weights, self.semiring)
+            if result == self.semiring.zero():
+                raise InconsistentEvidenceError(context=' during compilation')
+            return self.semiring.normalize(result, self.normalization)
+        else:
+            return self.formula._evaluate_inode(self.evidence_inode, self.semiring, self.weights,
+                                                self.inode_cache)
+
+    def update_evidence(self, index, value=True):
+        """Add evidence to an evaluator that has already been propagated.
+
+        The new evidence is conjoined with the current evidence node and only the cached query \
+        results that may depend on it are discarded.
+        A cached result can be kept if the query and the previous evidence do not share any \
+        atoms with the new evidence.
+
+        :param index: key of the evidence node
+        :param value: observed value of the node
+        """
+        if not value:
+            index = self.formula.negate(index)
+        self.add_evidence(index)
+        if self.evidence_inode is None:
+            # Not propagated yet: the evidence is used by propagate().
+            return
+
+        if index in self.formula.atom2var:
+            self._set_evidence(self.formula.atom2var[index], index > 0)
+            self._update_normalization()
+
+        manager = self._get_manager()
+        old_inode = self.evidence_inode
+        self.evidence_inode = manager.conjoin(old_inode, self.formula.get_inode(index))
+        manager.deref(old_inode)
+        self._evidence_weight = self._compute_evidence_weight()
+
+        support = self._get_support(index)
+        if self._evidence_support is None:
+            self._evidence_support = frozenset()
+            for ev in self.evidence():
+                if ev != index:
+                    self._evidence_support |= self._get_support(ev)
+            for c in self.formula.constraints():
+                for n in c.get_nodes():
+                    self._evidence_support |= self._get_support(n)
+        if self._evidence_support & support:
+            self._results.clear()
+        else:
+            for node in list(self._results):
+                if self._get_support(node) & support:
+                    del self._results[node]
+        self._evidence_support |= support
+
+    def _get_support(self, index):
+        """Get the atoms on which the given node depends.
+
+        :param index: key of a node
+        :return: set of atom keys
+        :rtype: frozenset
+        """
+        if index is None or index == 0:
+            return frozenset()
+        index = abs(index)
+        support = self._supports.get(index)
+        if support is None:
+            atoms = set()
+            visited = set()
+            queue = [index]
+            while queue:
+                key = queue.pop()
+                if key not in visited:
+                    visited.add(key)
+                    node = self.formula.get_node(key)
+                    if type(node).__name__ == 'atom':
+                        atoms.add(key)
+                    else:
+                        queue.extend(abs(c) for c in node.children if c is not None and c != 0)
+            support = frozenset(atoms)
+            self._supports[index] = support
+        return support
+
     def evaluate_evidence(self, recompute=False):
         return self.semiring.result(self._evaluate_evidence(recompute=recompute), self.formula)
 
     def evaluate(self, node):
-        if isinstance(self.semiring, SemiringLogProbability) or isinstance(self.semiring, SemiringProbability):
-            return self.evaluate_standard(node)
-        else:
-            return self.evaluate_custom(node)
+        if self._weights_changed:
+            self._evaluate_evidence()
+        result = self._results.get(node)
+        if result is None:
+            if isinstance(self.semiring, SemiringLogProbability) or isinstance(self.semiring, SemiringProbability):
+                if self.all_marginals:
+                    # Evaluate the remaining queries in the same pass, as far as this does not
+                    # require a separate evaluation of each of them.
+                    nodes = [node] + [n for q, n, l in self.formula.labeled()
+                                      if n and n not in self._results and
+                                      (self.query_indicators or self._is_atom(n))]
+                    result = self.evaluate_queries(nodes)[0]
+                else:
+                    result = self.evaluate_standard(node)
+            else:
+                result = self.evaluate_custom(node)
+            self._results[node] = result
+        return result
+
+    def _is_atom(self, node):
+        return type(self.formula.get_node(abs(node))).__name__ == 'atom'
+
+    def evaluate_queries(self, nodes):
+        """Evaluate several nodes with a single pass over the evidence-conditioned diagram.
+
+        The probabilities of atoms are read off directly.
+        If query_indicators is set, an indicator variable is added to the manager for each other \
+        node and made equivalent to it; the definitions of these indicators are conjoined with \
+        the evidence once and reused as long as the evidence does not change.
+        Otherwise, these nodes are evaluated separately.
+        Only supported for the probability semirings.
+
+        :param nodes: keys of the nodes to evaluate
+        :return: list with the value of each node
+        """
+        semiring = self.semiring
+        values = {}
+        literals = []
+        for node in nodes:
+            if node in values:
+                continue
+            elif node in self._results:
+                values[node] = self._results[node]
+            elif node == self.formula.TRUE:
+                values[node] = semiring.result(semiring.one(), self.formula)
+            elif node is self.formula.FALSE:
+                values[node] = semiring.result(semiring.zero(), self.formula)
+            else:
+                values[node] = None
+                if not self._is_atom(node):
+                    if not self.query_indicators:
+                        values[node] = self._results[node] = self.evaluate_standard(node)
+                        continue
+                    literals.append(self._get_indicator(node))
+                elif node < 0:
+                    literals.append(-self.formula.atom2var[-node])
+                else:
+                    literals.append(self.formula.atom2var[node])
+
+        if literals:
+            inode = self._get_indicator_inode([n for n, v in values.items() if v is None])
+            weights = dict(self.weights)
+            for var in self._indicators.values():
+                weights[var] = (semiring.one(), semiring.one())
+            results = self._get_manager().wmc_literals(inode, weights, semiring, literals)
+            i = 0
+            for node in nodes:
+                if values[node] is None:
+                    values[node] = semiring.result(results[i], self.formula)
+                    self._results[node] = values[node]
+                    i += 1
+        return [values[node] for node in nodes]
+
+    def _get_indicator(self, node):
+        """Get the indicator variable for the given (compound) node."""
+        var = self._indicators.get(node)
+        if var is None:
+            var = self._get_manager().add_variable()
+            self._indicators[node] = var
+        return var
+
+    def _get_indicator_inode(self, nodes):
+        """Get the evidence node conjoined with the definitions of the indicator variables \
+        of the given nodes.
+
+        :param nodes: keys of the nodes that are evaluated
+        :return: internal node
+        """
+        manager = self._get_manager()
+        if self._indicator_inode is not None and \
+                not manager.same(self._indicator_evidence, self.evidence_inode):
+            manager.deref(self._indicator_inode)
+            self._indicator_inode = None
+        if self._indicator_inode is None:
+            self._indicator_inode = self.evidence_inode
+            self._indicator_evidence = self.evidence_inode
+            self._indicated = set()
+            manager.ref(self._indicator_inode)
+
+        for node in nodes:
+            if node in self._indicators and node not in self._indicated:
+                indicator = manager.literal(self._indicators[node])
+                node_inode = self.formula.get_inode(node)
+                definition = manager.equiv(indicator, node_inode)
+                if node < 0:
+                    manager.deref(node_inode)
+                inode = manager.conjoin(self._indicator_inode, definition)
+                manager.deref(self._indicator_inode, definition)
+                self._indicator_inode = inode
+                self._indicated.add(node)
+        return self._indicator_inode
 
     def evaluate_standard(self, node):
         # Trivial case: node is deterministically True or False
@@ -483,23 +793,18 @@ class DDEvaluator(Evaluator):
             query_def_inode = self.formula.get_inode(node)
             evidence_inode = self.evidence_inode
             query_sdd = self._get_manager().conjoin(query_def_inode, evidence_inode)
-
-
-
-            formula = LogicNNF()
-            i = self.formula._to_formula(formula, query_sdd)
-            result = formula.evaluate(index=i, semiring=self.semiring)
-
+            result = self.formula._evaluate_inode(query_sdd, self.semiring, self.weights,
+                                                  self.inode_cache)
             self._get_manager().deref(query_sdd)
 
-
-
             # TODO only normalize when there are evidence or constraints.
 #            result = self.semiring.normalize(result, self.normalization)
             result = self.semiring.normalize(result, self._evidence_weight)
         return self.semiring.result(result, self.formula)
 
     def evaluate_fact(self, node):
+        if self._weights_changed:
+            self._evaluate_evidence()
         if node == self.formula.TRUE:
             return self.semiring.one()
         elif node is self.formula.FALSE:
@@ -513,6 +818,22 @@ class DDEvaluator(Evaluator):
         return result
 
     def set_evidence(self, index, value):
+        self._set_evidence(index, value)
+        self._invalidate_results()
+
+    def set_weight(self, index, pos, neg):
+        self._set_weight(index, pos, neg)
+        self._invalidate_results()
+
+    def _invalidate_results(self):
+        """Discard all results after a change of the weights.
+
+        The normalization and the weight of the evidence are recomputed on the next evaluation.
+        """
+        self._results.clear()
+        self._weights_changed = True
+
+    def _set_evidence(self, index, value):
         pos = self.semiring.one()
         neg = self.semiring.zero()
 
@@ -520,14 +841,15 @@ class DDEvaluator(Evaluator):
         if value:
             if current_weight and self.semiring.is_zero(current_weight[0]):
                 raise InconsistentEvidenceError(self._deref_node(index))
-            self.set_weight(index, pos, neg)
+            self._set_weight(index, pos, neg)
         else:
             if current_weight and self.semiring.is_one(current_weight[0]):
                 raise InconsistentEvidenceError(self._deref_node(index))
-            self.set_weight(index, neg, pos)
+            self._set_weight(index, neg, pos)
 
-    def set_weight(self, index, pos, neg):
+    def _set_weight(self, index, pos, neg):
         self.weights[index] = (pos, neg)
+        self.inode_cache.clear()
 
     def _deref_node(self, index):
         term = self.formula.get_node(self.formula.var2atom[index]).name
@@ -536,6 +858,8 @@ class DDEvaluator(Evaluator):
     def __del__(self):
         if self.evidence_inode is not None:
             self._get_manager().deref(self.evidence_inode)
+        if self._indicator_inode is not None:
+            self._get_manager().deref(self._indicator_inode)
 
 
 # noinspection PyUnusedLocal
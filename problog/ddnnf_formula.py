@@ -36,6 +36,7 @@ from .cnf_formula import CNF
 from .core import transform
 from .errors import CompilationError
 from .util import Timer, subprocess_check_call
+from .batch import BatchEvaluator, batch_weights, evidence_literals
 
 
 class DSharpError(CompilationError):
@@ -60,6 +61,22 @@ class DDNNF(LogicDAG, EvaluatableDSP):
     def _create_evaluator(self, semiring, weights, **kwargs):
         return SimpleDDNNFEvaluator(self, semiring, weights)
 
+    def _create_batch_evaluator(self, weights=None):
+        weights, facts, constraints = batch_weights(self, weights)
+        evidence = evidence_literals(self)
+        root = len(self)
+        queries = []
+        for name, node, label in self.labeled():
+            if node is self.FALSE:
+                queries.append((name, self.FALSE, ()))
+            elif node == self.TRUE:
+                queries.append((name, root, evidence))
+            else:
+                # Same as SimpleDDNNFEvaluator: fix the query literal to true.
+                queries.append((name, root, evidence + [node]))
+        slots = {key: key for key in weights}
+        return BatchEvaluator(self, slots, weights, facts, constraints, queries, (root, evidence))
+
 
 class SimpleDDNNFEvaluator(Evaluator):
     """Evaluator for d-DNNFs."""
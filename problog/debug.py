@@ -18,6 +18,7 @@ limitations under the License.
 from __future__ import print_function
 
 from .logic import Term
+from array import array
 from collections import defaultdict
 import time
 import sys
@@ -104,6 +105,9 @@ class EngineTracer(object):
         self.call_results[(node_id, term)] += 1
         self.interact(record)
 
+    def call_cached(self, functor, context):
+        pass
+
     def call_return(self, node_id, functor, context, location=None):
         term = Term(functor, *context, location=location)
         self.level -= 1
@@ -187,6 +191,203 @@ class EngineTracer(object):
         return s
 
 
+class EngineProfiler(object):
+    """Low-overhead profiler for the grounding engine.
+
+    Calls, answers, exits and cache hits are recorded as events in preallocated arrays, \
+    keyed by the id of the predicate signature.
+    No terms are constructed during grounding; the events are only aggregated when a report \
+    is requested.
+    Like :class:`EngineTracer`, the caller of a call is approximated by the most recent call \
+    that has not exited yet.
+
+    :param capacity: initial number of events (the arrays grow when needed)
+    """
+
+    CALL = 0
+    ANSWER = 1
+    EXIT = 2
+    CACHE_HIT = 3
+
+    def __init__(self, capacity=65536):
+        self.interactive = False
+        self.signatures = []  # signature of each id
+        self._ids = {}  # (functor, arity) => id
+        self._kinds = array('b', [0]) * capacity
+        self._targets = array('i', [0]) * capacity  # signature id (call, answer, cache hit) or call
+        self._times = array('d', [0.0]) * capacity
+        self._count = 0
+        self._calls = 0
+        self._redirect = {}  # parent pointer => call number
+        self._timer = getattr(time, 'perf_counter', time.time)
+        self._report = None
+
+    def _signature_id(self, functor, arity):
+        key = (functor, arity)
+        sig = self._ids.get(key)
+        if sig is None:
+            sig = len(self.signatures)
+            self._ids[key] = sig
+            self.signatures.append('%s/%s' % key)
+        return sig
+
+    def _record(self, kind, target):
+        i = self._count
+        if i == len(self._kinds):
+            self._kinds.extend(array('b', [0]) * i)
+            self._targets.extend(array('i', [0]) * i)
+            self._times.extend(array('d', [0.0]) * i)
+        self._kinds[i] = kind
+        self._targets[i] = target
+        self._times[i] = self._timer()
+        self._count = i + 1
+
+    def call_create(self, node_id, functor, context, parent, location=None):
+        self._record(self.CALL, self._signature_id(functor, len(context)))
+        self._redirect[parent] = self._calls
+        self._calls += 1
+
+    def call_result(self, node_id, functor, context, result=None, location=None):
+        self._record(self.ANSWER, self._signature_id(functor, len(context)))
+
+    def call_cached(self, functor, context):
+        self._record(self.CACHE_HIT, self._signature_id(functor, len(context)))
+
+    def process_message(self, msgtype, msgtarget, msgargs, context):
+        if msgtarget in self._redirect and (msgtype == 'c' or msgtype == 'r' and msgargs[3]):
+            self._record(self.EXIT, self._redirect.pop(msgtarget))
+
+    def _aggregate(self):
+        """Replay the events.
+
+        :return: tuple (statistics, stacks) where statistics is a list with for each signature \
+        [calls, answers, cache hits, inclusive time, exclusive time] and stacks is a dictionary \
+        {call stack (tuple of signature ids): exclusive time}
+        """
+        if self._report is not None and self._report[0] == self._count:
+            return self._report[1:]
+        statistics = [[0, 0, 0, 0.0, 0.0] for _ in self.signatures]
+        paths = {}  # (caller path id, signature id) => path id
+        path_keys = []  # (caller path id, signature id) of each path id
+        path_times = []  # exclusive time of each path id
+        signature = []  # signature of each call
+        start = []  # start time of each call
+        path = []  # path id of each call
+        children = []  # time spent in the direct callees of each call
+        active = []  # calls that have not exited
+        depth = defaultdict(int)  # number of active calls of each signature
+        closed = set()
+
+        def close(call, now):
+            sig = signature[call]
+            elapsed = now - start[call]
+            depth[sig] -= 1
+            if depth[sig] == 0:
+                # Only count the outermost call of a recursive predicate.
+                statistics[sig][3] += elapsed
+            exclusive = max(0.0, elapsed - children[call])
+            statistics[sig][4] += exclusive
+            path_times[path[call]] += exclusive
+            if active:
+                children[active[-1]] += elapsed
+
+        for i in range(self._count):
+            kind, target, now = self._kinds[i], self._targets[i], self._times[i]
+            if kind == self.CALL:
+                key = (path[active[-1]] if active else -1, target)
+                path_id = paths.get(key)
+                if path_id is None:
+                    path_id = len(path_keys)
+                    paths[key] = path_id
+                    path_keys.append(key)
+                    path_times.append(0.0)
+                signature.append(target)
+                start.append(now)
+                path.append(path_id)
+                children.append(0.0)
+                active.append(len(signature) - 1)
+                depth[target] += 1
+                statistics[target][0] += 1
+            elif kind == self.EXIT:
+                closed.add(target)
+                while active and active[-1] in closed:
+                    close(active.pop(), now)
+            elif kind == self.ANSWER:
+                statistics[target][1] += 1
+            else:
+                statistics[target][2] += 1
+        # Calls that did not exit (e.g. after an error) end at the last event.
+        while active:
+            close(active.pop(), self._times[self._count - 1])
+
+        stacks = {}
+        for path_id, exclusive in enumerate(path_times):
+            stack = []
+            while path_id >= 0:
+                path_id, sig = path_keys[path_id]
+                stack.append(sig)
+            stacks[tuple(reversed(stack))] = exclusive
+        self._report = self._count, statistics, stacks
+        return statistics, stacks
+
+    def get_statistics(self):
+        """Get the statistics per predicate, sorted by exclusive time.
+
+        :return: list of dictionaries with keys predicate, calls, answers, cache_hits, \
+        inclusive and exclusive (times in seconds)
+        :rtype: list[dict]
+        """
+        statistics, stacks = self._aggregate()
+        result = []
+        for sig, (calls, answers, hits, inclusive, exclusive) in enumerate(statistics):
+            result.append({'predicate': self.signatures[sig], 'calls': calls, 'answers': answers,
+                           'cache_hits': hits, 'inclusive': inclusive, 'exclusive': exclusive})
+        result.sort(key=lambda x: -x['exclusive'])
+        return result
+
+    def show_profile(self, aggregate=None):
+        """Creates a table with profile information per predicate.
+
+        :param aggregate: ignored (always aggregated per predicate)
+        :return: string
+        """
+        s = '%30s\t %9s \t %9s \t %6s \t %6s \t %6s\n' % \
+            ('predicate', 'inclusive', 'exclusive', '#call', '#sol', '#cache')
+        s += '-' * 100 + '\n'
+        for stats in self.get_statistics():
+            s += '%30s\t %.5f \t %.5f \t %6d \t %6d \t %6d\n' % \
+                (stats['predicate'], stats['inclusive'], stats['exclusive'], stats['calls'],
+                 stats['answers'], stats['cache_hits'])
+        return s
+
+    def show_trace(self):
+        return ''
+
+    def to_folded(self):
+        """Export the exclusive time of each call stack in the folded format used by \
+        flamegraph tools (e.g. flamegraph.pl or speedscope).
+
+        :return: one line per call stack with the semicolon separated predicates and the time \
+        in microseconds
+        :rtype: str
+        """
+        statistics, stacks = self._aggregate()
+        lines = []
+        for path, exclusive in sorted(stacks.items()):
+            value = int(round(exclusive * 1e6))
+            if value > 0:
+                lines.append('%s %d' % (';'.join(self.signatures[s] for s in path), value))
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self):
+        """Export the statistics per predicate as JSON.
+
+        :rtype: str
+        """
+        import json
+        return json.dumps({'predicates': self.get_statistics(), 'events': self._count})
+
+
 def location_string(location):
     if location is None:
         return ''
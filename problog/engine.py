@@ -24,6 +24,7 @@ Grounding engine to transform a ProbLog program into a propositional formula.
 from __future__ import print_function
 
 import logging
+import weakref
 
 from collections import defaultdict
 
@@ -140,6 +141,16 @@ class ClauseDBEngine(GenericEngine):
         self.functions = {}
         self.args = kwdargs.get('args')
 
+        # Keep the tables of calls to query() for each database, such that repeated queries reuse
+        # earlier results.
+        # This only applies to query(): ground() and ground_all() always use the given target (or
+        # a new one).
+        # The ground program that holds them grows with each new query; it is started over when it
+        # has more than persistent_max_nodes nodes.
+        self.persistent_tables = kwdargs.get('persistent_tables', False)
+        self.persistent_max_nodes = kwdargs.get('persistent_max_nodes')
+        self.__query_targets = weakref.WeakKeyDictionary()
+
     def load_builtins(self):
         """Load default builtins."""
         raise NotImplementedError("ClauseDBEngine.loadBuiltIns is an abstract function.")
@@ -259,7 +270,7 @@ class ClauseDBEngine(GenericEngine):
 
             return [Term.from_string(line).args for line in output.split('\n') if line.strip()]
         else:
-            gp = LogicFormula()
+            gp = self._get_query_target(db)
             if term.is_negated():
                 term = -term
                 negative = True
@@ -274,6 +285,31 @@ class ClauseDBEngine(GenericEngine):
             else:
                 return [x for x, y in result]
 
+    def _get_query_target(self, db):
+        """Get the ground program to use for a call to :func:`query` on the given database.
+
+        With ``persistent_tables``, the ground program (and the table of evaluated goals it \
+        holds) is kept for as long as the database is not modified.
+        This is not the case for :func:`ground` and :func:`ground_all`, which ground into the \
+        target they are given.
+        This ground program accumulates the nodes of all queries: the bounds on the table \
+        (``cache_max_entries`` and ``cache_max_size``) do not remove nodes from it.
+        It is only replaced by an empty one (with an empty table) when it has more than \
+        ``persistent_max_nodes`` nodes (default: no limit).
+
+        :param db: database that is queried
+        :return: ground program
+        :rtype: LogicFormula
+        """
+        if not self.persistent_tables or not isinstance(db, ClauseDB):
+            return LogicFormula()
+        version, gp = self.__query_targets.get(db, (None, None))
+        if gp is None or version != db.get_version() or \
+                (self.persistent_max_nodes is not None and len(gp) > self.persistent_max_nodes):
+            gp = LogicFormula()
+            self.__query_targets[db] = (db.get_version(), gp)
+        return gp
+
     def ground(self, db, term, target=None, label=None, **kwdargs):
         """Ground a query on the given database.
 
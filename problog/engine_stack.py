@@ -33,7 +33,7 @@ from .errors import GroundingError
 from .engine import ClauseDBEngine, substitute_head_args, substitute_call_args, unify_call_head, \
     unify_call_return, OccursCheck, substitute_simple
 from .engine_builtin import add_standard_builtins, IndirectCallCycleError
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 
 class NegativeCycle(GroundingError):
@@ -149,6 +149,21 @@ class StackBasedEngine(ClauseDBEngine):
 
         self.ignoring = set()
 
+        # Bounds on the table of evaluated goals (see DefineCache).
+        self.cache_max_entries = kwdargs.get('cache_max_entries')
+        self.cache_max_size = kwdargs.get('cache_max_size')
+        self.cache_policy = kwdargs.get('cache_policy') or 'lru'
+
+    def create_cache(self, database):
+        """Create the table for storing evaluated goals.
+
+        :param database: database that is being evaluated
+        :return: new table
+        :rtype: DefineCache
+        """
+        return DefineCache(database.dont_cache, max_entries=self.cache_max_entries,
+                           max_size=self.cache_max_size, policy=self.cache_policy)
+
     def eval(self, node_id, **kwdargs):
         # print (kwdargs.get('parent'))
         database = kwdargs['database']
@@ -330,7 +345,7 @@ class StackBasedEngine(ClauseDBEngine):
         # This is stored in the target ground program because
         # node ids are only valid in that context.
         if not hasattr(target, '_cache'):
-            target._cache = DefineCache(database.dont_cache)
+            target._cache = self.create_cache(database)
 
         # Retrieve the list of actions needed to evaluate the top-level node.
         # parent = kwdargs.get('parent')
@@ -511,7 +526,7 @@ class StackBasedEngine(ClauseDBEngine):
         # This is stored in the target ground program because
         # node ids are only valid in that context.
         if not hasattr(target, '_cache'):
-            target._cache = DefineCache(database.dont_cache)
+            target._cache = self.create_cache(database)
 
         # Retrieve the list of actions needed to evaluate the top-level node.
         # parent = kwdargs.get('parent')
@@ -802,6 +817,8 @@ class StackBasedEngine(ClauseDBEngine):
         if results is not None:
             # We have results for this goal, i.e. it has been fully evaluated before.
             # Transform the results to actions and return.
+            if self.debugger:
+                self.debugger.call_cached(functor, context)
             return results_to_actions(results, self, node, context, target, parent, identifier, transform, is_root, **kwdargs)
         else:
             # Look up the results in the currently active nodes.
@@ -810,6 +827,8 @@ class StackBasedEngine(ClauseDBEngine):
                 # There is an active node.
                 if active_node.is_ground and active_node.results:
                     # If the node is ground, we can simply return the current result node.
+                    if self.debugger:
+                        self.debugger.call_cached(functor, context)
                     active_node.flushBuffer(True)
                     active_node.is_cycle_parent = True  # Notify it that it's buffer was flushed
                     queue = results_to_actions(active_node.results, self, node, context, target, parent, identifier, transform, is_root, **kwdargs)
@@ -1557,15 +1576,127 @@ class VarReindex(object):
 
 
 class DefineCache(object):
-    def __init__(self, dont_cache):
+    """Table of evaluated goals.
+
+    Completed tables can be bounded in number and in (estimated) size.
+    When a bound is exceeded, completed tables are evicted according to the given policy:
+
+        - ``lru``: least recently used tables first
+        - ``lfu``: least frequently used tables first
+
+    Active tables (goals that are still being evaluated) are never evicted.
+    An evicted goal is simply evaluated again when it is called the next time.
+
+    :param dont_cache: signatures of predicates that should not be cached
+    :param max_entries: maximal number of completed tables (default: no limit)
+    :param max_size: maximal estimated size of the completed tables in bytes (default: no limit)
+    :param policy: eviction policy (``lru`` or ``lfu``)
+    """
+
+    # Estimated memory use (in bytes) of a table and of each result in a table.
+    TABLE_SIZE = 400
+    RESULT_SIZE = 150
+
+    def __init__(self, dont_cache, max_entries=None, max_size=None, policy='lru'):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError("Unknown cache eviction policy: '%s'" % policy)
         self.__non_ground = NestedDict()
         self.__ground = NestedDict()
         self.__active = NestedDict()
         self.__dont_cache = dont_cache
 
+        self.__max_entries = max_entries
+        self.__max_size = max_size
+        self.__policy = policy
+        # Completed tables in order of last use: key => [goal, is_ground, size, uses]
+        self.__entries = OrderedDict()
+        self.__count = 0
+        self.__size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
     def reset(self):
         self.__non_ground = NestedDict()
         self.__ground = NestedDict()
+        self.__entries = OrderedDict()
+        self.__count = 0
+        self.__size = 0
+
+    def get_statistics(self):
+        """Get information about the use of the table.
+
+        Without bounds, the completed tables are not tracked individually: the number of tables \
+        and their size then also count tables that were stored again.
+
+        :return: dictionary with number of tables, their estimated size, and the number of \
+        hits, misses and evictions
+        :rtype: dict
+        """
+        return {'entries': self.__count,
+                'size': self.__size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+    def _entry_key(self, goal, ground):
+        functor, args = goal
+        return ground, functor, tuple(args), get_state(args)
+
+    def _store(self, goal, ground, nresults):
+        """Register a completed table and evict tables if the bounds are exceeded."""
+        size = self.TABLE_SIZE + self.RESULT_SIZE * nresults
+        self.__count += 1
+        self.__size += size
+        if self.__max_entries is None and self.__max_size is None:
+            return
+        key = self._entry_key(goal, ground)
+        old = self.__entries.pop(key, None)
+        if old is not None:
+            self.__count -= 1
+            self.__size -= old[2]
+        self.__entries[key] = [goal, ground, size, 1]
+        self._evict()
+
+    def _touch(self, goal, ground):
+        """Register the use of a completed table."""
+        if self.__max_entries is None and self.__max_size is None:
+            return
+        key = self._entry_key(goal, ground)
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            entry[3] += 1
+            self.__entries[key] = entry
+
+    def _is_full(self, fraction=1.0):
+        return (self.__max_entries is not None and
+                self.__count > self.__max_entries * fraction) or \
+               (self.__max_size is not None and self.__size > self.__max_size * fraction)
+
+    def _evict(self):
+        if not self._is_full():
+            return
+        if self.__policy == 'lru':
+            while self._is_full():
+                self._remove(self.__entries.popitem(last=False)[1])
+        else:
+            # Sort once and evict a batch, such that we don't have to sort on every insert.
+            order = sorted(enumerate(self.__entries.items()), key=lambda x: (x[1][1][3], x[0]))
+            victims = iter([k for _, (k, _) in order])
+            while self._is_full(0.9):
+                self._remove(self.__entries.pop(next(victims)))
+
+    def _remove(self, entry):
+        """Remove the table of an evicted entry."""
+        goal, ground, size, uses = entry
+        self.__count -= 1
+        self.__size -= size
+        self.evictions += 1
+        if ground:
+            del self.__ground[goal]
+        else:
+            del self.__non_ground[goal]
 
     def _reindex_vars(self, goal):
         ri = VarReindex()
@@ -1597,10 +1728,12 @@ class DefineCache(object):
             else:
                 key = (functor, args)
                 self.__ground[key] = NODE_FALSE  # Goal failed
+            self._store(key, True, 1)
         else:
             goal = self._reindex_vars(goal)
             res_keys = list(results.keys())
             self.__non_ground[goal] = results
+            self._store(goal, False, len(res_keys))
             all_ground = True
             for res_key in res_keys:
                 key = (functor, res_key)
@@ -1613,6 +1746,7 @@ class DefineCache(object):
                 for res_key in res_keys:
                     key = (functor, res_key)
                     self.__ground[key] = results[res_key]
+                    self._store(key, True, 1)
 
     def get(self, key, default=None):
         try:
@@ -1622,28 +1756,50 @@ class DefineCache(object):
 
     def __getitem__(self, goal):
         functor, args = goal
-        if is_ground(*args):
-            return [(args, self.__ground[goal])]
-        else:
-            goal = self._reindex_vars(goal)
-            # res_keys = self.__non_ground[goal]
-            return self.__non_ground[goal].items()
+        try:
+            if is_ground(*args):
+                result = [(args, self.__ground[goal])]
+                self._touch(goal, True)
+            else:
+                goal = self._reindex_vars(goal)
+                # res_keys = self.__non_ground[goal]
+                result = self.__non_ground[goal].items()
+                self._touch(goal, False)
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        return result
 
     def __delitem__(self, goal):
         functor, args = goal
         if is_ground(*args):
             del self.__ground[goal]
+            ground = True
+            nresults = 1
         else:
             goal = self._reindex_vars(goal)
+            nresults = len(self.__non_ground[goal])
             del self.__non_ground[goal]
+            ground = False
+        self.__count -= 1
+        if self.__max_entries is None and self.__max_size is None:
+            self.__size -= self.TABLE_SIZE + self.RESULT_SIZE * nresults
+        else:
+            entry = self.__entries.pop(self._entry_key(goal, ground), None)
+            if entry is not None:
+                self.__size -= entry[2]
 
     def __contains__(self, goal):
         functor, args = goal
         if is_ground(*args):
-            return goal in self.__ground
+            found = goal in self.__ground
         else:
             goal = self._reindex_vars(goal)
-            return goal in self.__non_ground
+            found = goal in self.__non_ground
+        if not found:
+            self.misses += 1
+        return found
 
     def __str__(self):  # pragma: no cover
         return '%s\n%s' % (self.__non_ground, self.__ground)
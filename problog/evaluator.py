@@ -382,6 +382,38 @@ class Evaluatable(ProbLogObject):
         else:
             return evaluator.evaluate(index)
 
+    def _create_batch_evaluator(self, weights=None):
+        """Create a new batch evaluator.
+
+        :param weights: dictionary of { node name : weight } that overrides the builtin weights
+        :return: batch evaluator
+        :rtype: problog.batch.BatchEvaluator
+        """
+        raise ProbLogError('Batch evaluation is not supported by %s.' % self.__class__.__name__)
+
+    def get_batch_evaluator(self, weights=None):
+        """Get an evaluator that computes all queries for many weight assignments at once.
+        The evaluator can be reused for any number of batches.
+
+        :param weights: dictionary of { node name : weight } that overrides the builtin weights \
+         (e.g. to give a value to facts without a numeric probability)
+        :return: batch evaluator for this formula (requires NumPy)
+        :rtype: problog.batch.BatchEvaluator
+        """
+        return self._create_batch_evaluator(weights)
+
+    def evaluate_batch(self, weights, facts=None):
+        """Evaluate all queries for a batch of weight assignments in the probability semiring.
+
+        :param weights: probabilities of the facts, one row per assignment
+        :type weights: array of shape (n_assignments, n_facts)
+        :param facts: names of the facts corresponding to the columns \
+         (default: ``get_batch_evaluator().facts``)
+        :return: probabilities of the queries, in the order of ``labeled()``
+        :rtype: numpy.ndarray of shape (n_assignments, n_queries)
+        """
+        return self.get_batch_evaluator().evaluate(weights, facts)
+
 
 @transform_allow_subclass
 class EvaluatableDSP(Evaluatable):
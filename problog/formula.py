@@ -24,11 +24,17 @@ Data structures for propositional logic.
 from __future__ import print_function
 
 from collections import namedtuple, defaultdict, OrderedDict
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from .core import ProbLogObject
 from .errors import InconsistentEvidenceError
 
-from .util import OrderedSet
+from .util import OrderedSet, Bitset
 from .logic import Term, Or, Clause, And, is_ground
 
 from .evaluator import Evaluatable, FormulaEvaluator, FormulaEvaluatorNSP
@@ -368,6 +374,201 @@ conj = namedtuple('conj', ('children', 'name'))
 disj = namedtuple('disj', ('children', 'name'))
 
 
+_HASH_MASK = (1 << 64) - 1
+_HASH_SEED = 0xcbf29ce484222325     # FNV-1a offset basis
+_HASH_PRIME = 0x100000001b3         # FNV-1a prime
+_HASH_FALSE = 1 << 63               # stands for FALSE (None) as a child
+
+
+def hash_children(children, start=_HASH_SEED):
+    """Compute the 64-bit structural hash of a sequence of node keys.
+
+    The hash can be extended incrementally: ``hash_children(a + b)`` equals \
+    ``hash_children(b, hash_children(a))``.
+
+    :param children: sequence of node keys
+    :param start: hash of the preceding keys
+    :return: hash value
+    :rtype: int
+    """
+    h = start
+    for c in children:
+        if c is None:
+            c = _HASH_FALSE
+        h = ((h ^ (c & _HASH_MASK)) * _HASH_PRIME) & _HASH_MASK
+    return h
+
+
+class CompactNodeStore(object):
+    """Columnar storage for the nodes of a :class:`LogicFormula`.
+
+    The store behaves like the list of node tuples it replaces (``append``, item access and \
+    assignment, ``len`` and iteration), but it keeps the node types and the children of all \
+    compound nodes in typed arrays.
+    Atom fields and node names are kept in side tables.
+    Node tuples are only created when a node is accessed.
+
+    Children of a compound node are stored consecutively in one flat ``int32`` array.
+    When a node is updated with more children than it has room for (e.g. by \
+    :func:`LogicFormula.add_disjunct`), it is moved to the end of that array with twice the \
+    required capacity, such that repeated updates of the same node are amortized.
+    """
+
+    _ATOM = 0
+    _CONJ = 1
+    _DISJ = 2
+
+    # Encoding of FALSE (None) in the child array (only occurs in non-compacted formulas).
+    _FALSE = -2 ** 31
+
+    def __init__(self):
+        self._type = array('b')         # node type (_ATOM, _CONJ or _DISJ)
+        self._offset = array('l')       # atom: index in atom tables, compound: offset in children
+        self._size = array('i')         # number of children
+        self._capacity = array('i')     # number of slots reserved in children
+        self._children = array('i')     # children of all compound nodes
+        self._names = []                # node names
+
+        self._atom_identifier = []
+        self._atom_probability = []
+        self._atom_group = []
+        self._atom_source = []
+
+        self._garbage = 0   # number of unused slots in children
+
+    def __len__(self):
+        return len(self._type)
+
+    def _encode(self, children):
+        false = self._FALSE
+        return [false if c is None else c for c in children]
+
+    def _get_children(self, index):
+        offset = self._offset[index]
+        false = self._FALSE
+        return tuple(None if c == false else c
+                     for c in self._children[offset:offset + self._size[index]])
+
+    def _make(self, index):
+        t = self._type[index]
+        if t == self._ATOM:
+            a = self._offset[index]
+            return atom(self._atom_identifier[a], self._atom_probability[a], self._atom_group[a],
+                        self._names[index], self._atom_source[a])
+        elif t == self._CONJ:
+            return conj(self._get_children(index), self._names[index])
+        else:
+            return disj(self._get_children(index), self._names[index])
+
+    def _store_atom(self, node):
+        self._atom_identifier.append(node.identifier)
+        self._atom_probability.append(node.probability)
+        self._atom_group.append(node.group)
+        self._atom_source.append(node.source)
+        return len(self._atom_identifier) - 1
+
+    def _store_children(self, children, capacity):
+        offset = len(self._children)
+        self._children.extend(self._encode(children))
+        if capacity > len(children):
+            self._children.extend([0] * (capacity - len(children)))
+        return offset
+
+    def append(self, node):
+        """Add a node at the end of the store.
+
+        :param node: node to add (atom, conj or disj)
+        """
+        ntype = type(node).__name__
+        if ntype == 'atom':
+            self._type.append(self._ATOM)
+            self._offset.append(self._store_atom(node))
+            self._size.append(0)
+            self._capacity.append(0)
+        elif ntype == 'conj' or ntype == 'disj':
+            self._type.append(self._CONJ if ntype == 'conj' else self._DISJ)
+            self._offset.append(self._store_children(node.children, len(node.children)))
+            self._size.append(len(node.children))
+            self._capacity.append(len(node.children))
+        else:
+            raise TypeError("Unexpected node type: '%s'." % ntype)
+        self._names.append(node.name)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        return self._make(index)
+
+    def __setitem__(self, index, node):
+        if index < 0:
+            index += len(self)
+        ntype = type(node).__name__
+        if ntype == 'atom':
+            if self._type[index] == self._ATOM:
+                a = self._offset[index]
+                self._atom_identifier[a] = node.identifier
+                self._atom_probability[a] = node.probability
+                self._atom_group[a] = node.group
+                self._atom_source[a] = node.source
+            else:
+                self._garbage += self._capacity[index]
+                self._type[index] = self._ATOM
+                self._offset[index] = self._store_atom(node)
+                self._size[index] = 0
+                self._capacity[index] = 0
+        elif ntype == 'conj' or ntype == 'disj':
+            children = node.children
+            size = len(children)
+            if self._type[index] != self._ATOM and size <= self._capacity[index]:
+                # Fits in the current slots: overwrite.
+                offset = self._offset[index]
+                self._children[offset:offset + size] = array('i', self._encode(children))
+            else:
+                # Move to the end of the child array with room to grow.
+                self._garbage += self._capacity[index]
+                capacity = max(2 * size, 4)
+                self._offset[index] = self._store_children(children, capacity)
+                self._capacity[index] = capacity
+            self._type[index] = self._CONJ if ntype == 'conj' else self._DISJ
+            self._size[index] = size
+            if self._garbage > len(self._children) // 2 > 4096:
+                self._compact()
+        else:
+            raise TypeError("Unexpected node type: '%s'." % ntype)
+        self._names[index] = node.name
+
+    def _compact(self):
+        """Remove unused slots from the child array."""
+        children = array('i')
+        source = self._children
+        for index, t in enumerate(self._type):
+            if t != self._ATOM:
+                offset = self._offset[index]
+                size = self._size[index]
+                self._offset[index] = len(children)
+                self._capacity[index] = size
+                children.extend(source[offset:offset + size])
+        self._children = children
+        self._garbage = 0
+
+    def __iter__(self):
+        make = self._make
+        for index in range(0, len(self)):
+            yield make(index)
+
+    def child_arrays(self):
+        """Get the children of all nodes as NumPy arrays (without creating node tuples).
+
+        :return: tuple (offsets, sizes, children) where the children of node i are \
+          ``children[offsets[i]:offsets[i] + sizes[i]]``; FALSE children are encoded as 0
+        """
+        offsets = numpy.array(self._offset, dtype=numpy.int64)
+        sizes = numpy.array(self._size, dtype=numpy.int64)
+        children = numpy.array(self._children, dtype=numpy.int64)
+        children[children == self._FALSE] = 0
+        return offsets, sizes, children
+
+
 class LogicFormula(BaseFormula):
     """A logic formula is a data structure that is used to represent generic And-Or graphs.
     It can typically contain three types of nodes:
@@ -385,6 +586,10 @@ class LogicFormula(BaseFormula):
 
     Upon addition of new nodes, the logic formula can perform certain optimizations, for example,
     by simplifying nodes or by reusing existing nodes.
+
+    By default, the nodes are stored in a list of tuples.
+    For large ground programs, ``compact_nodes=True`` stores them in a :class:`CompactNodeStore` \
+    instead, which uses much less memory.
     """
 
     # negation is encoded by using a negative number for the key
@@ -402,17 +607,22 @@ class LogicFormula(BaseFormula):
     def __init__(self, auto_compact=True, avoid_name_clash=False, keep_order=False,
                  use_string_names=False, keep_all=False, propagate_weights=None,
                  max_arity=0, keep_duplicates=False, keep_builtins=False, hide_builtins=False, database=None,
-                 **kwdargs):
+                 compact_nodes=False, **kwdargs):
         BaseFormula.__init__(self)
 
         # List of nodes
-        self._nodes = []
+        if compact_nodes:
+            self._nodes = CompactNodeStore()
+        else:
+            self._nodes = []
         # Lookup index for 'atom' nodes, key is identifier passed to addAtom()
         self._index_atom = {}
-        # Lookup index for 'and' nodes, key is tuple of sorted children
+        # Lookup index for 'and' nodes, key is structural hash of children (see hash_children)
         self._index_conj = {}
-        # Lookup index for 'or' nodes, key is tuple of sorted children
+        # Lookup index for 'or' nodes, key is structural hash of children (see hash_children)
         self._index_disj = {}
+        # Structural hash of the 'or' nodes in the index, used to update it in add_disjunct
+        self._hash_disj = {}
 
         self._atomcount = 0
 
@@ -436,6 +646,12 @@ class LogicFormula(BaseFormula):
     def database(self):
         return self._database
 
+    def __getstate__(self):
+        # The database is only needed during grounding and can not be pickled.
+        state = self.__dict__.copy()
+        state['_database'] = None
+        return state
+
     # ====================================================================================== #
     # ==========                         MANAGE LABELS                           =========== #
     # ====================================================================================== #
@@ -493,25 +709,32 @@ class LogicFormula(BaseFormula):
             if ntype == 'atom':
                 key = node.identifier
                 collection = self._index_atom
-            elif ntype == 'conj':
-                key = node.children
-                collection = self._index_conj
-            elif ntype == 'disj':
-                key = node.children
-                collection = self._index_disj
-            else:
-                raise TypeError("Unexpected node type: '%s'." % ntype)
 
-            if key not in collection:
-                # Create a new entry, starting from 1
-                index = len(self._nodes) + 1
-                # Add the entry to the collection
-                collection[key] = index
-                # Add entry to the set of nodes
-                self._nodes.append(node)
+                if key not in collection:
+                    # Create a new entry, starting from 1
+                    index = len(self._nodes) + 1
+                    # Add the entry to the collection
+                    collection[key] = index
+                    # Add entry to the set of nodes
+                    self._nodes.append(node)
+                else:
+                    # Retrieve the entry from collection
+                    index = collection[key]
+            elif ntype == 'conj' or ntype == 'disj':
+                if ntype == 'conj':
+                    collection = self._index_conj
+                else:
+                    collection = self._index_disj
+                key = hash_children(node.children)
+                index = self._find_compound(collection, key, node.children)
+                if index is None:
+                    index = len(self._nodes) + 1
+                    self._nodes.append(node)
+                    self._index_compound(collection, key, index)
+                    if ntype == 'disj':
+                        self._hash_disj[index] = key
             else:
-                # Retrieve the entry from collection
-                index = collection[key]
+                raise TypeError("Unexpected node type: '%s'." % ntype)
         else:
             # Don't reuse, just add node.
             index = len(self._nodes) + 1
@@ -520,6 +743,48 @@ class LogicFormula(BaseFormula):
         # Return the entry
         return index
 
+    def _find_compound(self, collection, key, children):
+        """Find an existing compound node with the given children.
+
+        :param collection: index to search (``_index_conj`` or ``_index_disj``)
+        :param key: structural hash of the children
+        :param children: children of the node
+        :return: key of the existing node, or None if there is no such node
+        """
+        entry = collection.get(key)
+        if entry is None:
+            return None
+        elif isinstance(entry, list):
+            # Hash collision: check all candidates.
+            for index in entry:
+                if self._nodes[index - 1].children == children:
+                    return index
+            return None
+        elif self._nodes[entry - 1].children == children:
+            return entry
+        else:
+            return None
+
+    def _index_compound(self, collection, key, index):
+        """Add a compound node to the given index."""
+        entry = collection.get(key)
+        if entry is None:
+            collection[key] = index
+        elif isinstance(entry, list):
+            entry.append(index)
+        else:
+            collection[key] = [entry, index]
+
+    def _unindex_compound(self, collection, key, index):
+        """Remove a compound node from the given index."""
+        entry = collection.get(key)
+        if entry == index:
+            del collection[key]
+        elif isinstance(entry, list) and index in entry:
+            entry.remove(index)
+            if len(entry) == 1:
+                collection[key] = entry[0]
+
     def _update(self, key, value):
         """Replace the node with the given content.
 
@@ -650,18 +915,40 @@ class LogicFormula(BaseFormula):
                 # Don't do anything
                 pass
             elif component == 0:
+                self._rehash_disj(key, (0,))
                 return self._update(key, self._create_disj((0,), name=node.name))
             elif component in node.children and not self._keep_duplicates:
                 pass    # already there
             else:
                 if 0 < self._max_arity == len(node.children):
                     child = self.add_or(node.children)
+                    self._rehash_disj(key, (child, component))
                     return self._update(key, self._create_disj((child, component), name=node.name))
                 else:
+                    self._rehash_disj(key, (component,), extend=True)
                     return self._update(key, self._create_disj(node.children + (component,),
                                                                name=node.name))
             return key
 
+    def _rehash_disj(self, key, children, extend=False):
+        """Update the index entry of a disjunction whose children are about to change.
+
+        Disjunctions that are not in the index (e.g. modifiable nodes) are left alone.
+
+        :param key: key of the disjunction
+        :param children: new children, or the children that will be appended if ``extend``
+        :param extend: the children are appended to the existing ones
+        """
+        old_hash = self._hash_disj.get(key)
+        if old_hash is not None:
+            if extend:
+                new_hash = hash_children(children, old_hash)
+            else:
+                new_hash = hash_children(children)
+            self._unindex_compound(self._index_disj, old_hash, key)
+            self._index_compound(self._index_disj, new_hash, key)
+            self._hash_disj[key] = new_hash
+
     def add_not(self, component):
         """Returns the key to the negation of the node.
 
@@ -699,18 +986,21 @@ class LogicFormula(BaseFormula):
             # Put into fixed order and eliminate duplicate nodes
             if self._keep_duplicates:
                 content = tuple(content)
+                unique = len(set(content))
             elif self._keep_order:
                 content = tuple(OrderedSet(content))
+                unique = len(content)
             else:  # any_order
                 # can also merge (a, b) and (b, a)
                 content = tuple(set(content))
+                unique = len(content)
 
             # Empty OR node fails, AND node is true
             if not content and not placeholder:
                 return f
 
             # Contains opposites: return 'TRUE' for or, 'FALSE' for and
-            if len(set(content)) > len(set(map(abs, content))):
+            if unique > len(set(map(abs, content))):
                 return t
 
             # If node has only one child, just return the child.
@@ -1289,20 +1579,92 @@ label_all=True)
                     yield Clause(n.name, self.get_body(i, parent_name=n.name))
 
     def extract_relevant(self, roots=None):
-        relevant = [False] * (len(self)+1)
+        """Determine which nodes are reachable from the given roots.
+
+        :param roots: nodes to start from (default: queries and evidence, see :meth:`get_roots`)
+        :return: list of booleans indexed by node key
+        """
+        if roots is None:
+            roots = self.get_roots()
+        roots = [abs(r) for r in roots if r]
+        if numpy is None or not isinstance(self._nodes, CompactNodeStore):
+            return self._relevant_python(roots)[0]
+        return self.relevant_nodes(roots).to_list(len(self) + 1)
+
+    def relevant_nodes(self, roots=None):
+        """Determine the set of nodes that are reachable from the given roots.
+
+        For a compact node store (see ``compact_nodes``) and with NumPy, the formula is \
+        traversed breadth-first over arrays of children, one level at a time.
+        Otherwise, only the reachable nodes are visited.
+
+        :param roots: nodes to start from (default: queries and evidence, see :meth:`get_roots`)
+        :return: set of node keys
+        :rtype: Bitset
+        """
         if roots is None:
-            roots = {abs(r) for r in self.get_roots()}
+            roots = self.get_roots()
+        roots = [abs(r) for r in roots if r]
+        if numpy is None or not isinstance(self._nodes, CompactNodeStore):
+            # Flattening a list of nodes would cost more than a traversal of the reachable part.
+            return Bitset.from_indices(self._relevant_python(roots)[1])
+
+        offsets, sizes, children = self._child_arrays()
+        visited = numpy.zeros(len(self) + 1, dtype=bool)
+        visited[0] = True   # TRUE and FALSE are not nodes
+        position = numpy.zeros(len(self) + 1, dtype=numpy.int64)
+        frontier = numpy.unique(numpy.array(roots, dtype=numpy.int64))
+        visited[frontier] = True
+        while len(frontier):
+            counts = sizes[frontier]
+            total = int(counts.sum())
+            if total == 0:
+                break
+            ends = numpy.cumsum(counts)
+            index = numpy.arange(total) + numpy.repeat(offsets[frontier] - (ends - counts), counts)
+            reached = children[index]
+            reached = reached[~visited[reached]]
+            # Remove duplicates: keep each node at the last position where it occurs.
+            order = numpy.arange(len(reached))
+            position[reached] = order
+            frontier = reached[position[reached] == order]
+            visited[frontier] = True
+        visited[0] = False
+        return Bitset.from_mask(visited)
+
+    def _relevant_python(self, roots):
+        """Determine the nodes that are reachable from the given roots by visiting them one by one.
+
+        :param roots: (positive) keys of the nodes to start from
+        :return: tuple (list of booleans indexed by node key, list of reachable node keys)
+        """
+        relevant = [False] * (len(self) + 1)
+        reached = []
+        roots = set(roots)
         while roots:
             root = roots.pop()
             if not relevant[root]:
                 relevant[root] = True
+                reached.append(root)
                 node = self.get_node(root)
                 ntype = type(node).__name__
                 if ntype != 'atom':
                     for c in node.children:
-                        if not relevant[abs(c)]:
+                        if c and not relevant[abs(c)]:
                             roots.add(abs(c))
-        return relevant
+        return relevant, reached
+
+    def _child_arrays(self):
+        """Get the (absolute) children of all nodes of a compact node store as NumPy arrays \
+        indexed by node key.
+
+        :return: tuple (offsets, sizes, children) where the children of node i are \
+          ``children[offsets[i]:offsets[i] + sizes[i]]``
+        """
+        offsets, sizes, children = self._nodes.child_arrays()
+        offsets = numpy.concatenate(([0], offsets))
+        sizes = numpy.concatenate(([0], sizes))
+        return offsets, sizes, numpy.abs(children)
 
     def get_roots(self):
         roots = set(n for q, n in self.queries() if self.is_probabilistic(n))
@@ -35,9 +35,11 @@ from .evaluator import Evaluator, Evaluatable
 from .logic import Term
 
 from copy import deepcopy
+from multiprocessing.pool import ThreadPool
 
 import warnings
 import logging
+import time
 
 from functools import total_ordering
 
@@ -63,9 +65,28 @@ transform(LogicDAG, KBestFormula, clarks_completion)
 
 
 class KBestEvaluator(Evaluator):
+    """Anytime evaluator that computes bounds on the probability of a query from its best proofs \
+    (lower bound) and the best proofs of its negation (upper bound).
+
+    Without explanation, all queries are refined together: in each round the queries whose \
+    bounds improve most are refined, possibly in parallel, and each proof that is found is also \
+    added to the bounds of the other queries it proves.
+    When the time or iteration budget is exhausted, the current bounds are returned.
+
+    :param formula: formula to evaluate
+    :param semiring: semiring
+    :param weights: weights to use
+    :param lower_only: only compute the lower bound
+    :param convergence: stop refining a query when its bounds are within this distance
+    :param explain: list to which the proofs are added (disables joint evaluation of queries)
+    :param time_budget: stop refining after this number of seconds (default: no limit)
+    :param max_iterations: stop refining after this number of solver calls (default: no limit)
+    :param processes: number of solver calls to run concurrently
+    """
 
     def __init__(self, formula, semiring, weights=None, lower_only=False,
-                 verbose=None, convergence=1e-9, explain=None, **kwargs):
+                 verbose=None, convergence=1e-9, explain=None, time_budget=None,
+                 max_iterations=None, processes=1, **kwargs):
         Evaluator.__init__(self, formula, semiring, weights, **kwargs)
 
         self.sdd_manager = None
@@ -85,6 +106,16 @@ class KBestEvaluator(Evaluator):
         self._reverse_names = {index: name for name, index in self.formula.get_names()}
 
         self._convergence = convergence
+        self._time_budget = time_budget
+        self._max_iterations = max_iterations
+        self._processes = max(1, processes)
+        self._clauses = [list(c[1:]) if c[0] is None or type(c[0]) == bool else list(c)
+                         for c in self.formula.clauses]
+
+        self._results = {}
+        self._start = time.time()
+        self._iterations = 0
+        self.history = []   # (time, query, lower bound, upper bound)
 
     def initialize(self):
         raise NotImplementedError('Evaluator.initialize() is an abstract method.')
@@ -93,6 +124,21 @@ class KBestEvaluator(Evaluator):
         self._weights = self.formula.extract_weights(self.semiring, self._given_weights)
         self._z = self.semiring.one()
         # self._z = self.sdd_manager.wmc_true(self._weights, self.semiring)
+        self._results = {}
+        self._start = time.time()
+        self._iterations = 0
+        self.history = []
+
+    def budget_exhausted(self):
+        """Check whether the time or iteration budget is used up.
+
+        :return: True if no more solver calls should be made
+        """
+        if self._max_iterations is not None and self._iterations >= self._max_iterations:
+            return True
+        if self._time_budget is not None and time.time() - self._start >= self._time_budget:
+            return True
+        return False
 
     def evaluate(self, index):
         """Compute the value of the given node."""
@@ -114,6 +160,14 @@ class KBestEvaluator(Evaluator):
             if self._explain is not None:
                 self._explain.append('%s :- true.' % name)
             return 1.0
+        elif self._explain is None:
+            if index not in self._results:
+                indices = [index]
+                for n, i, l in self.formula.labeled():
+                    if i is not None and i != 0 and i not in self._results and i not in indices:
+                        indices.append(i)
+                self._evaluate_queries(indices)
+            return self._results[index]
         else:
             lb = Border(self.formula, self.sdd_manager, self.semiring, index, 'lower')
             ub = Border(self.formula, self.sdd_manager, self.semiring, -index, 'upper')
@@ -126,8 +180,9 @@ class KBestEvaluator(Evaluator):
                 nborder = max(lb, ub)
 
             try:
-                while not nborder.is_complete():
+                while not nborder.is_complete() and not self.budget_exhausted():
                     solution = nborder.update()
+                    self._iterations += 1
                     logger.debug('  update: %s %s < p < %s ' %
                                  (nborder.name, lb.value, 1.0 - ub.value))
                     if self._explain is not None and solution is not None:
@@ -170,6 +225,110 @@ class KBestEvaluator(Evaluator):
 
             return lb.value, 1.0 - ub.value
 
+    def _evaluate_queries(self, indices):
+        """Refine the bounds of the given queries together until they converge or the budget is \
+        exhausted.
+        The results are stored in ``self._results``.
+
+        :param indices: nodes to evaluate
+        """
+        logger = logging.getLogger('problog')
+
+        borders = {}
+        for index in indices:
+            lb = Border(self.formula, self.sdd_manager, self.semiring, index, 'lower')
+            if self._lower_only:
+                ub = None
+            else:
+                ub = Border(self.formula, self.sdd_manager, self.semiring, -index, 'upper')
+            borders[index] = lb, ub
+
+        active = list(indices)
+        pool = None
+        if self._processes > 1 and len(indices) > 1:
+            pool = ThreadPool(self._processes)
+        try:
+            while active and not self.budget_exhausted():
+                # Select the border with most improvement for each query, and refine the best ones.
+                selected = []
+                for index in active:
+                    lb, ub = borders[index]
+                    if ub is None:
+                        selected.append((lb, index))
+                    else:
+                        selected.append((max(lb, ub), index))
+                selected.sort(key=lambda x: x[0], reverse=True)
+                n = self._processes
+                if self._max_iterations is not None:
+                    n = min(n, self._max_iterations - self._iterations)
+                selected = selected[:n]
+
+                if pool is None:
+                    solutions = [border.update() for border, index in selected]
+                else:
+                    solutions = pool.map(Border.update, [border for border, index in selected])
+                self._iterations += len(selected)
+
+                for (border, index), solution in zip(selected, solutions):
+                    if solution is not None:
+                        others = [b for i in active for b in borders[i]
+                                  if b is not None and b is not border]
+                        self._share_proof(solution, border.improvement, others)
+
+                remaining = []
+                for index in active:
+                    lb, ub = borders[index]
+                    if lb.is_complete():
+                        self._results[index] = lb.value
+                    elif ub is not None and ub.is_complete():
+                        self._results[index] = 1.0 - ub.value
+                    elif ub is not None and ub.value + lb.value > 1.0 - self._convergence:
+                        self._results[index] = lb.value, 1.0 - ub.value
+                    else:
+                        remaining.append(index)
+                active = remaining
+                self._report(borders, [index for border, index in selected])
+        except KeyboardInterrupt:
+            pass
+        except SystemError:
+            pass
+        finally:
+            if pool is not None:
+                pool.close()
+
+        for index in indices:
+            if index not in self._results:
+                lb, ub = borders[index]
+                self._results[index] = lb.value, 1.0 - (0.0 if ub is None else ub.value)
+        if active:
+            logger.debug('  budget exhausted after %d solver calls' % self._iterations)
+
+    def _share_proof(self, solution, probability, borders):
+        """Add a proof to the given borders whose query it proves.
+
+        :param solution: proof as a list of fact literals
+        :param probability: probability of the proof
+        :param borders: borders to which the proof is offered
+        """
+        derived = unit_propagate(self._clauses, solution)
+        if derived is None:
+            return
+        for border in borders:
+            if not border.is_complete() and border.query in derived:
+                border.add_proof(solution, probability)
+
+    def _report(self, borders, updated):
+        logger = logging.getLogger('problog')
+        elapsed = time.time() - self._start
+        width = 0.0
+        for index in updated:
+            lb, ub = borders[index]
+            upper = 1.0 - (0.0 if ub is None else ub.value)
+            self.history.append((elapsed, self._reverse_names.get(index, index), lb.value, upper))
+            width = max(width, upper - lb.value)
+        logger.debug('  %.3fs, %d solver calls: maximal bound width %.6g'
+                     % (elapsed, self._iterations, width))
+
     def evaluate_evidence(self):
         raise NotImplementedError('Evaluator.evaluate_evidence is an abstract method.')
 
@@ -195,6 +354,8 @@ class Border(object):
         self.wcnf.add_constraint(TrueConstraint(query), True)
 
         self.name = name
+        self.query = query
+        self.proofs = []
 
         self.manager = manager
         self.semiring = semiring
@@ -234,6 +395,7 @@ class Border(object):
 
             constraint = ClauseConstraint(list(map(lambda x: -x, solution)))
             self.wcnf.add_constraint(constraint, True)
+            self.proofs.append(set(solution))
             # literals = list(map(m.literal, solution))
 
             # proof_sdd = m.conjoin(*literals)
@@ -257,6 +419,22 @@ class Border(object):
 
             return solution
 
+    def add_proof(self, solution, probability):
+        """Add a proof that was found for another query.
+        The proof is only used if it is disjoint with the proofs that were already found.
+
+        :param solution: proof as a list of fact literals
+        :param probability: probability of the proof
+        :return: True if the proof was added
+        """
+        for proof in self.proofs:
+            if not any(-s in proof for s in solution):
+                return False
+        self.wcnf.add_constraint(ClauseConstraint(list(map(lambda x: -x, solution))), True)
+        self.proofs.append(set(solution))
+        self.value = self.value + probability
+        return True
+
     def is_complete(self):
         return self.improvement is None
 
@@ -272,3 +450,32 @@ class Border(object):
         return self.improvement == other.improvement
 
 
+
+
+def unit_propagate(clauses, literals):
+    """Derive the literals that follow from the given literals by unit propagation.
+
+    :param clauses: list of clauses (lists of literals)
+    :param literals: literals that are true
+    :return: set of true literals, or None if the literals are inconsistent with the clauses
+    """
+    values = set(literals)
+    changed = True
+    while changed:
+        changed = False
+        for clause in clauses:
+            unassigned = None
+            count = 0
+            for lit in clause:
+                if lit in values:
+                    break
+                elif -lit not in values:
+                    count += 1
+                    unassigned = lit
+            else:
+                if count == 0:
+                    return None
+                elif count == 1:
+                    values.add(unassigned)
+                    changed = True
+    return values
@@ -47,6 +47,7 @@ import sys
 import random
 import math
 import logging
+import itertools
 
 from collections import defaultdict
 
@@ -57,6 +58,7 @@ from problog.logic import Term, Constant, Clause, AnnotatedDisjunction, Or, Var,
 from problog.program import PrologString, PrologFile, LogicProgram
 from problog.core import ProbLogError
 from problog.errors import process_error, InconsistentEvidenceError
+from problog.util import fork_context
 
 
 from problog import get_evaluatable, get_evaluatables
@@ -75,7 +77,8 @@ def str2bool(s):
 class LFIProblem(SemiringProbability, LogicProgram):
 
     def __init__(self, source, examples, max_iter=10000, min_improv=1e-10, verbose=0, knowledge=None,
-                 leakprob=None, propagate_evidence=True, normalize=False, **extra):
+                 leakprob=None, propagate_evidence=True, normalize=False, processes=1,
+                 batch_size=None, step_decay=0.7, **extra):
         """
         :param source: filename of file containing input model
         :type source: str
@@ -95,6 +98,16 @@ class LFIProblem(SemiringProbability, LogicProgram):
                          retrieve the constants from the evidence file.
                          (default: None)
         :type leakprob: float or None
+        :param processes: number of worker processes that compile and evaluate the examples
+                          (default: 1, evaluate in the current process)
+        :type processes: int
+        :param batch_size: use stepwise EM with mini-batches of the given number of examples;
+                           examples are then read lazily (once per pass) and are only compiled
+                           for the batch they belong to (default: None, full-batch EM)
+        :type batch_size: int or None
+        :param step_decay: decay rate of the step size of stepwise EM, i.e. the step size of the
+                           k-th batch is (k + 2) ** -step_decay (between 0.5 and 1)
+        :type step_decay: float
         :param extra: catch all for additional parameters (not used)
         """
         SemiringProbability.__init__(self)
@@ -115,7 +128,13 @@ class LFIProblem(SemiringProbability, LogicProgram):
         self.leakprobatoms = None
         self.propagate_evidence = propagate_evidence
         self._compiled_examples = None
-        
+        self.processes = processes
+        self._workers = None
+        self.batch_size = batch_size
+        self.step_decay = step_decay
+        self._baseprogram = None
+        self._stats = None
+
         self.max_iter = max_iter
         self.min_improv = min_improv
         self.verbose = verbose
@@ -154,7 +173,10 @@ class LFIProblem(SemiringProbability, LogicProgram):
     
     def prepare(self):
         """Prepare for learning."""
-        self._compile_examples()
+        if self.batch_size:
+            self._baseprogram = DefaultEngine(**self.extra).prepare(self)
+        else:
+            self._compile_examples()
 
     def _get_weight(self, index, args, strict=True):
         index = int(index)
@@ -194,9 +216,11 @@ class LFIProblem(SemiringProbability, LogicProgram):
     def _add_weight(self, weight):
         self._weights.append(weight)
 
-    def _process_examples(self):
+    def _process_examples(self, examples=None, start=0):
         """Process examples by grouping together examples with similar structure.
-    
+
+        :param examples: examples to process (default: all examples)
+        :param start: index of the first example
         :return: example groups based on evidence atoms
         :rtype: dict of atoms : values for examples
         """
@@ -206,16 +230,19 @@ class LFIProblem(SemiringProbability, LogicProgram):
 
         # Simple implementation: don't add neutral evidence.
 
+        if examples is None:
+            examples = self.examples
+
         if self.propagate_evidence:
             result = ExampleSet()
-            for index, example in enumerate(self.examples):
+            for index, example in enumerate(examples, start):
                 atoms, values = zip(*example)
                 result.add(index, atoms, values)
             return result
         else:
             # smarter: compile-once all examples with same atoms
             result = ExampleSet()
-            for index, example in enumerate(self.examples):
+            for index, example in enumerate(examples, start):
                 atoms, values = zip(*example)
                 result.add(index, atoms, values)
             return result
@@ -229,9 +256,18 @@ class LFIProblem(SemiringProbability, LogicProgram):
 
         baseprogram = DefaultEngine(**self.extra).prepare(self)
         examples = self._process_examples()
-        result = []
-        for example in examples:
-            example.compile(self, baseprogram)
+        workers = self.processes is not None and self.processes > 1
+        if workers and fork_context() is None:
+            logger.warning('Worker processes are not available on this platform: '
+                           'examples are compiled in the current process.')
+            workers = False
+        if workers:
+            examples = list(examples)
+            logger.debug('Compiling examples in %s worker processes ...' % self.processes)
+            self._workers = ExampleWorkerPool(self, baseprogram, examples, self.processes)
+        else:
+            for example in examples:
+                example.compile(self, baseprogram)
         self._compiled_examples = examples
 
     def _process_atom(self, atom, body):
@@ -502,20 +538,10 @@ class LFIProblem(SemiringProbability, LogicProgram):
     
     def _update(self, results):
         """Update the current estimates based on the latest evaluation results."""
-        
-        fact_marg = defaultdict(float)
-        fact_count = defaultdict(int)
-        score = 0.0
-        for m, pEvidence, result in results:
-            for fact, value in result.items():
-                index = fact.args[0:2]
-                fact_marg[index] += value * m
-                fact_count[index] += m
-            try:
-                score += math.log(pEvidence)
-            except ValueError:
-                raise ProbLogError('Inconsistent evidence.')
+        return self._update_weights(*collect_statistics(results))
 
+    def _update_weights(self, fact_marg, fact_count, score):
+        """Update the current estimates based on the expected counts of the facts."""
         for index in fact_marg:
             if fact_count[index] > 0:
                 self._set_weight(index[0], index[1], fact_marg[index] / fact_count[index])
@@ -544,9 +570,97 @@ class LFIProblem(SemiringProbability, LogicProgram):
         
     def step(self):
         self.iteration += 1
+        if self._workers is not None:
+            return self._update_weights(*self._workers.evaluate(self._weights))
         results = self._evaluate_examples()
         return self._update(results)
 
+    def step_batch(self, examples, start=0):
+        """Perform one step of stepwise EM on a mini-batch of examples.
+
+        The expected counts of the batch are interpolated with the running expected counts \
+        using a decaying step size, and the weights are set to their ratio.
+
+        :param examples: examples in the batch
+        :param start: index of the first example of the batch (used in error messages)
+        :return: average log-likelihood of the examples in the batch
+        """
+        if self._baseprogram is None:
+            self._baseprogram = DefaultEngine(**self.extra).prepare(self)
+        batch = self._process_examples(examples, start)
+        size = 0
+        for example in batch:
+            example.compile(self, self._baseprogram)
+            size += len(example.n)
+        fact_marg, fact_count, score = collect_statistics(map(ExampleEvaluator(self._weights), batch))
+
+        step = (self.iteration + 2) ** -self.step_decay
+        self.iteration += 1
+        if self._stats is None:
+            self._stats = defaultdict(float), defaultdict(float)
+        stats_marg, stats_count = self._stats
+        # Scale by the nominal batch size such that a smaller last batch gets less weight.
+        scale = float(self.batch_size or size)
+        for index in fact_count:
+            if index not in stats_count:
+                # Start from the current weight, as if it was estimated on a batch like this one.
+                stats_count[index] = fact_count[index] / scale
+                stats_marg[index] = stats_count[index] * self._get_weight(index[0], index[1],
+                                                                          strict=False)
+        for index in stats_count:
+            stats_marg[index] = (1 - step) * stats_marg[index] + step * fact_marg[index] / scale
+            stats_count[index] = (1 - step) * stats_count[index] + step * fact_count[index] / scale
+        self._update_weights(stats_marg, stats_count, score)
+        return score / size
+
+    def run_batches(self):
+        """Run stepwise EM over mini-batches of ``batch_size`` examples.
+        Each pass reads the examples again, so ``examples`` should be re-iterable \
+        (see :class:`ExampleStream`); with a one-shot iterator only one pass is made.
+        Learning stops after ``max_iter`` passes or when the log-likelihood of a pass improves \
+        by less than ``min_improv``.
+
+        :return: log-likelihood of the last pass
+        """
+        logger = logging.getLogger('problog_lfi')
+        self.prepare()
+        logger.info('Weights to learn: %s' % self.names)
+        logger.info('Initial weights: %s' % self._weights)
+        if self.processes is not None and self.processes > 1:
+            logger.warning('Worker processes are not used in mini-batch mode.')
+        delta = 1000
+        prev_score = -1e10
+        passes = 0
+        while passes < self.max_iter and (delta < 0 or delta > self.min_improv):
+            examples = iter(self.examples)
+            score = 0.0
+            start = 0
+            while True:
+                batch = list(itertools.islice(examples, self.batch_size))
+                if not batch:
+                    break
+                batch_score = self.step_batch(batch, start)
+                start += len(batch)
+                score += batch_score * len(batch)
+                logger.info('Score after batch %s (%s examples): %s'
+                            % (self.iteration, start, batch_score))
+                logger.debug('Weights after batch %s: %s' % (self.iteration, self._weights))
+            passes += 1
+            logger.info('Weights after pass %s: %s' % (passes, self._weights))
+            logger.info('Score after pass %s: %s' % (passes, score))
+            delta = score - prev_score
+            prev_score = score
+            if examples is self.examples:
+                # One-shot iterator: there is no next pass.
+                break
+        return prev_score
+
+    def close(self):
+        """Stop the worker processes (if any)."""
+        if self._workers is not None:
+            self._workers.close()
+            self._workers = None
+
     def get_model(self):
         self.output_mode = True
         lines = []
@@ -557,20 +671,145 @@ class LFIProblem(SemiringProbability, LogicProgram):
         return '\n'.join(lines)
         
     def run(self):
+        if self.batch_size:
+            return self.run_batches()
         self.prepare()
         logging.getLogger('problog_lfi').info('Weights to learn: %s' % self.names)
         logging.getLogger('problog_lfi').info('Initial weights: %s' % self._weights)
         delta = 1000
         prev_score = -1e10
-        while self.iteration < self.max_iter and (delta < 0 or delta > self.min_improv):
-            score = self.step()
-            logging.getLogger('problog_lfi').info('Weights after iteration %s: %s' % (self.iteration, self._weights))
-            logging.getLogger('problog_lfi').info('Score after iteration %s: %s' % (self.iteration, score))
-            delta = score - prev_score
-            prev_score = score
+        try:
+            while self.iteration < self.max_iter and (delta < 0 or delta > self.min_improv):
+                score = self.step()
+                logging.getLogger('problog_lfi').info('Weights after iteration %s: %s' % (self.iteration, self._weights))
+                logging.getLogger('problog_lfi').info('Score after iteration %s: %s' % (self.iteration, score))
+                delta = score - prev_score
+                prev_score = score
+        finally:
+            self.close()
         return prev_score
 
 
+def collect_statistics(results):
+    """Compute the expected counts of the facts from the evaluation results of the examples.
+
+    :param results: results of :class:`ExampleEvaluator`
+    :return: tuple (fact_marg, fact_count, score) with the weighted marginals and counts per fact \
+    and the log-likelihood of the examples
+    """
+    fact_marg = defaultdict(float)
+    fact_count = defaultdict(int)
+    score = 0.0
+    for m, pEvidence, result in results:
+        for fact, value in result.items():
+            index = fact.args[0:2]
+            fact_marg[index] += value * m
+            fact_count[index] += m
+        try:
+            score += math.log(pEvidence)
+        except ValueError:
+            raise ProbLogError('Inconsistent evidence.')
+    return fact_marg, fact_count, score
+
+
+class ExampleWorkerPool(object):
+    """Worker processes that each compile a share of the examples and keep them for all \
+    iterations.
+    In each iteration only the current weights are sent to the workers, and the workers only \
+    return their expected counts.
+
+    The workers are forked (see :func:`problog.util.fork_context`), such that they inherit the \
+    learning problem and the prepared program, which can not be pickled.
+
+    :param lfi: learning problem
+    :type lfi: LFIProblem
+    :param baseprogram: prepared model
+    :param examples: examples to compile
+    :type examples: list[Example]
+    :param processes: number of worker processes
+    """
+
+    def __init__(self, lfi, baseprogram, examples, processes):
+        context = fork_context()
+        self._workers = []
+        for i in range(min(processes, len(examples))):
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=_example_worker,
+                                      args=(child_conn, lfi, baseprogram, examples[i::processes]))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self._workers.append((process, conn))
+        self._receive()
+
+    def evaluate(self, weights):
+        """Evaluate all examples with the given weights.
+
+        :param weights: current weights of the learning problem
+        :return: tuple (fact_marg, fact_count, score) (see :func:`collect_statistics`)
+        """
+        for process, conn in self._workers:
+            conn.send(weights)
+        fact_marg = defaultdict(float)
+        fact_count = defaultdict(int)
+        score = 0.0
+        for w_marg, w_count, w_score in self._receive():
+            for index, value in w_marg.items():
+                fact_marg[index] += value
+            for index, value in w_count.items():
+                fact_count[index] += value
+            score += w_score
+        return fact_marg, fact_count, score
+
+    def close(self):
+        """Stop the worker processes."""
+        for process, conn in self._workers:
+            try:
+                conn.send(None)
+                conn.close()
+            except (IOError, OSError):
+                pass
+        for process, conn in self._workers:
+            process.join()
+        self._workers = []
+
+    def _receive(self):
+        results = []
+        error = None
+        for process, conn in self._workers:
+            try:
+                success, result = conn.recv()
+            except EOFError:
+                success, result = False, ProbLogError('LFI worker process terminated unexpectedly.')
+            if success:
+                results.append(result)
+            elif error is None:
+                error = result
+        if error is not None:
+            self.close()
+            raise error
+        return results
+
+
+def _example_worker(conn, lfi, baseprogram, examples):
+    """Main loop of a worker process of :class:`ExampleWorkerPool`."""
+    try:
+        for example in examples:
+            example.compile(lfi, baseprogram)
+        conn.send((True, None))
+        while True:
+            weights = conn.recv()
+            if weights is None:
+                break
+            try:
+                conn.send((True, collect_statistics(map(ExampleEvaluator(weights), examples))))
+            except Exception as err:
+                conn.send((False, err))
+    except Exception as err:
+        conn.send((False, err))
+    conn.close()
+
+
 class ExampleSet(object):
 
     def __init__(self):
@@ -709,6 +948,20 @@ def extract_evidence(pl):
     return [(at, str2bool(vl)) for at, vl in atoms]
 
 
+class ExampleStream(object):
+    """Examples read lazily from the given files.
+    Unlike :func:`read_examples`, the files are read again each time the stream is iterated.
+
+    :param filenames: files containing the examples
+    """
+
+    def __init__(self, *filenames):
+        self.filenames = filenames
+
+    def __iter__(self):
+        return read_examples(*self.filenames)
+
+
 def read_examples(*filenames):
     
     for filename in filenames:
@@ -785,6 +1038,12 @@ def argparser():
                         default=True,
                         help="Disable evidence propagation")
     parser.add_argument('--normalize', action='store_true', help="Normalize AD-weights.")
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=None,
+                        help='Use stepwise EM with mini-batches of the given size.')
+    parser.add_argument('--step-decay', dest='step_decay', type=float, default=0.7,
+                        help='Step size decay for stepwise EM (default: 0.7).')
+    parser.add_argument('-j', '--jobs', dest='processes', type=int, default=1,
+                        help='Number of worker processes for compiling and evaluating examples.')
     parser.add_argument('-v', '--verbose', action='count', default=0)
     parser.add_argument('--web', action='store_true', help=argparse.SUPPRESS)
     parser.add_argument('-a', '--arg', dest='args', action='append',
@@ -825,11 +1084,14 @@ def main(argv, result_handler=None):
     create_logger('problog', args.verbose - 1)
 
     program = PrologFile(args.model)
-    examples = list(read_examples(*args.examples))
-    if len(examples) == 0:
-        logging.getLogger('problog_lfi').warn('no examples specified')
+    if args.batch_size:
+        examples = ExampleStream(*args.examples)
     else:
-        logging.getLogger('problog_lfi').info('Number of examples: %s' % len(examples))
+        examples = list(read_examples(*args.examples))
+        if len(examples) == 0:
+            logging.getLogger('problog_lfi').warn('no examples specified')
+        else:
+            logging.getLogger('problog_lfi').info('Number of examples: %s' % len(examples))
     options = vars(args)
     del options['examples']
 
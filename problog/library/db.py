@@ -2,18 +2,24 @@ from __future__ import print_function
 
 from problog.extern import problog_export, problog_export_nondet, problog_export_raw
 
-from problog.logic import Term, Constant
+from problog.logic import Term, Constant, make_safe
 from problog.errors import UserError, InvalidValue
 
 import sqlite3
 import os
+import re
 import logging
 
 logger = logging.getLogger('problog')
 
 def db2pl(dbvalue):
+    """Convert a database value to a term.
+
+    Text values become atoms that are written the way they would be in a program \
+    (e.g. ``bob`` and ``'Bob'``), such that they are the same terms as the atoms in the program.
+    """
     if type(dbvalue) == str:
-        return Term("'" + dbvalue + "'")
+        return Term(make_safe(dbvalue))
     else:
         return Constant(dbvalue)
 
@@ -33,8 +39,64 @@ def get_colnames(conn, tablename):
     return res
 
 
+def get_options(options):
+    """Parse a list of load options.
+
+    Supported options are ``facts`` (add the rows to the database as facts instead of querying \
+    the table), ``index`` (create indexes on the columns that are used in calls) and \
+    ``index(Column)`` (create an index on the given column).
+    For an SQLite database, the indexes are written to the database file.
+
+    :param options: list of option terms
+    :return: tuple (facts, auto_index, indexed columns)
+    """
+    facts = False
+    auto_index = False
+    indexes = []
+    for option in options:
+        if option == Term('facts'):
+            facts = True
+        elif option == Term('index'):
+            auto_index = True
+        elif isinstance(option, Term) and option.functor == 'index' and option.arity == 1:
+            indexes.append(str(option.args[0]).strip("'"))
+        else:
+            raise UserError('Unknown option \'%s\'' % option)
+    return facts, auto_index, indexes
+
+
+def create_index(conn, tablename, columns):
+    name = re.sub(r'[^a-zA-Z0-9_]', '', '_'.join(['idx', tablename] + list(columns)))
+    conn.execute('CREATE INDEX IF NOT EXISTS %s ON %s(%s);' % (name, tablename, ', '.join(columns)))
+
+
+def add_facts(predicate, rows):
+    """Add the given rows to the database as facts of the given predicate."""
+    database = problog_export.database
+    for row in rows:
+        database.add_fact(Term(predicate, *map(db2pl, row)))
+
+
+def add_table(conn, tablename, columns, facts=False, auto_index=False, indexes=()):
+    if facts:
+        add_facts(tablename, conn.execute('SELECT %s FROM %s;' % (', '.join(columns), tablename)))
+    else:
+        for column in indexes:
+            create_index(conn, tablename, [column])
+        conn.commit()
+        types = ['+term'] * len(columns)
+        problog_export_raw(*types)(QueryFunc(conn, tablename, columns, auto_index=auto_index),
+                                   funcname=tablename, modname=None)
+
+
 @problog_export('+str')
 def sqlite_load(filename):
+    return sqlite_load_options(filename, [])
+
+
+@problog_export('+str', '+list', functor='sqlite_load')
+def sqlite_load_options(filename, options):
+    facts, auto_index, indexes = get_options(options)
 
     filename = problog_export.database.resolve_filename(filename)
     if not os.path.exists(filename):
@@ -49,45 +111,32 @@ def sqlite_load(filename):
 
     for table in tables:
         columns = get_colnames(conn, table)
-        types = ['+term'] * len(columns)
-        problog_export_raw(*types)(QueryFunc(conn, table, columns), funcname=table, modname=None)
+        add_table(conn, table, columns, facts, auto_index,
+                  [c for c in indexes if c in columns])
+    if facts:
+        conn.close()
 
     return ()
 
 
-@problog_export('+str', '+str')
-def csv_load(filename, predicate):
-    import tempfile
-    import csv
-    import re
+def read_csv(filename):
+    """Read a CSV file with column names on the first line.
 
-    filename = problog_export.database.resolve_filename(filename)
-    if not os.path.exists(filename):
-        raise UserError('Can\'t find csv file \'%s\'' % filename)
+    The type of each column (INTEGER, REAL or TEXT) is determined by its value on the second line.
+
+    :param filename: name of the CSV file
+    :return: tuple (column names, SQL types of the columns, generator of rows)
+    """
+    import csv
 
     csvfile = open(filename, 'r')
-    line = 0
     reader = csv.reader(csvfile)
     # Column names
     row = next(reader)
-    line += 1
     invalid_chars = re.compile(r'''[^a-zA-Z0-9_]''')
     columns = [invalid_chars.sub('',field) for field in row]
 
-    filepath, ext = os.path.splitext(os.path.basename(filename))
-    sql_dir = tempfile.mkdtemp()
-    sql_filename = os.path.join(sql_dir, filepath+'.sqlite')
-    idx = 1
-    while os.path.exists(sql_filename):
-        sql_filename = os.path.join(sql_dir, filepath+'_'+str(idx)+'.sqlite')
-        idx += 1
-    logger.debug('CSV->SQLite: '+sql_filename)
-    conn = sqlite3.connect(sql_filename)
-
-    cursor = conn.cursor()
-
     row = next(reader)
-    line += 1
     column_types_sql = []
     column_types_py = []
     for field in row:
@@ -107,62 +156,119 @@ def csv_load(filename, predicate):
             pass
         column_types_sql.append('TEXT')
         column_types_py.append(str)
+    column_types = list(zip(column_types_sql, column_types_py))
 
-    coldefs = [n+" "+t for n,t in zip(columns,column_types_sql)]
-    cursor.execute("CREATE TABLE "+predicate+"("+",".join(coldefs)+");")
-
-    def insert_statement(row):
+    def convert(row, line):
         values = []
-        for value, sqltype, pytype in zip(row, column_types_sql, column_types_py):
+        for value, (sqltype, pytype) in zip(row, column_types):
             try:
                 if sqltype == 'TEXT':
-                    values.append("'"+pytype(value.strip())+"'")
+                    values.append(pytype(value.strip()))
                 else:
-                    values.append(str(pytype(value)))
+                    values.append(pytype(value))
             except ValueError:
                 raise InvalidValue('{}:{}. Expected type {}, found value {}'.format(filename, line, pytype.__name__, value))
-        return "INSERT INTO "+predicate+"("+",".join(columns)+") VALUES ("+",".join(values)+");"
+        return tuple(values)
 
-    cursor.execute(insert_statement(row))
-    for row in reader:
-        line += 1
-        if len(row) == 0:
-            continue
-        cursor.execute(insert_statement(row))
+    def rows(row):
+        with csvfile:
+            yield convert(row, 2)
+            for line, row in enumerate(reader, start=3):
+                if len(row) == 0:
+                    continue
+                yield convert(row, line)
+
+    return columns, column_types_sql, rows(row)
+
+
+@problog_export('+str', '+str')
+def csv_load(filename, predicate):
+    return csv_load_options(filename, predicate, [])
+
+
+@problog_export('+str', '+str', '+list', functor='csv_load')
+def csv_load_options(filename, predicate, options):
+    import tempfile
+
+    facts, auto_index, indexes = get_options(options)
+
+    filename = problog_export.database.resolve_filename(filename)
+    if not os.path.exists(filename):
+        raise UserError('Can\'t find csv file \'%s\'' % filename)
+
+    columns, column_types_sql, rows = read_csv(filename)
+    if facts:
+        add_facts(predicate, rows)
+        return ()
 
+    filepath, ext = os.path.splitext(os.path.basename(filename))
+    sql_dir = tempfile.mkdtemp()
+    sql_filename = os.path.join(sql_dir, filepath+'.sqlite')
+    idx = 1
+    while os.path.exists(sql_filename):
+        sql_filename = os.path.join(sql_dir, filepath+'_'+str(idx)+'.sqlite')
+        idx += 1
+    logger.debug('CSV->SQLite: '+sql_filename)
+    conn = sqlite3.connect(sql_filename)
+    # The database is a temporary copy of the CSV file.
+    conn.execute('PRAGMA journal_mode = OFF;')
+    conn.execute('PRAGMA synchronous = OFF;')
+
+    coldefs = [n+" "+t for n,t in zip(columns,column_types_sql)]
+    conn.execute("CREATE TABLE "+predicate+"("+",".join(coldefs)+");")
+
+    # All rows are inserted in a single transaction.
+    conn.executemany("INSERT INTO "+predicate+"("+",".join(columns)+") VALUES ("+
+                     ",".join(['?'] * len(columns))+");", rows)
     conn.commit()
-    cursor.close()
-    csvfile.close()
 
-    types = ['+term'] * len(columns)
-    problog_export_raw(*types)(QueryFunc(conn, predicate, columns), funcname=predicate, modname=None)
+    # The indexes of a temporary database can always be created on demand.
+    add_table(conn, predicate, columns, auto_index=True, indexes=indexes)
 
     return ()
 
 
 class QueryFunc(object):
+    """Predicate that queries a database table.
 
-    def __init__(self, db, tablename, columns):
+    The query for each combination of bound arguments is built once (the sqlite3 module reuses \
+    the prepared statement) and the results of each call are cached.
+    The database should not change during inference.
+
+    :param db: database connection
+    :param tablename: name of the table
+    :param columns: names of the columns of the table
+    :param auto_index: create an index on the bound columns the first time they are used
+    """
+
+    def __init__(self, db, tablename, columns, auto_index=False):
         self.db = db
         self.tablename = tablename
         self.columns = columns
+        self.auto_index = auto_index
+        self._queries = {}  # Query for the bound columns: dict(tuple(bool): str)
+        self._results = {}  # Results of a call: dict(tuple(value or None): list)
+
+    def _get_query(self, bound):
+        query = self._queries.get(bound)
+        if query is None:
+            columns = [c for c, b in zip(self.columns, bound) if b]
+            where = ' AND '.join('%s = ?' % c for c in columns)
+            if where:
+                where = ' WHERE ' + where
+                if self.auto_index:
+                    create_index(self.db, self.tablename, columns)
+                    self.db.commit()
+            query = 'SELECT %s FROM %s%s' % (', '.join(self.columns), self.tablename, where)
+            self._queries[bound] = query
+        return query
 
     def __call__(self, *args, **kwargs):
-        where = []
-        values = []
-        for c, a in zip(self.columns, args):
-            if a is not None:
-                where.append('%s = ?' % c)
-                values.append(pl2db(a))
-        where = ' AND '.join(where)
-        if where:
-            where = ' WHERE ' + where
-
-        query = 'SELECT %s FROM %s%s' % (', '.join(self.columns), self.tablename, where)
-        cur = self.db.cursor()
-
-        cur.execute(query, values)
-        res = [tuple(map(db2pl, r)) for r in cur.fetchall()]
-        cur.close()
+        key = tuple(None if a is None else pl2db(a) for a in args)
+        res = self._results.get(key)
+        if res is None:
+            query = self._get_query(tuple(a is not None for a in args))
+            values = [v for v in key if v is not None]
+            res = [tuple(map(db2pl, r)) for r in self.db.execute(query, values)]
+            self._results[key] = res
         return res
-
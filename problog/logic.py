@@ -663,6 +663,12 @@ class Term(object):
             self.__hash = hash((self.__functor, self.__arity, firstarg, self._list_length()))
         return self.__hash
 
+    def __getstate__(self):
+        # The cached hash depends on the string hashes of the current process.
+        state = self.__dict__.copy()
+        state['_Term__hash'] = None
+        return state
+
     def __lshift__(self, body):
         return Clause(self, body)
 
@@ -102,8 +102,155 @@ class SCIPSolver(MIPMaxSATSolver):
         raise UnsatisfiableError()
 
 
+class BranchAndBoundSolver(MaxSATSolver):
+    """Weighted partial MaxSAT solver that runs in the current process.
+
+    The problem is passed to the solver as a list of clauses, without writing it to a file or \
+    starting a process, which makes it suitable for many small problems.
+    It performs depth-first branch-and-bound search with unit propagation on the hard clauses.
+    The lower bound of a partial assignment is its cost plus the cost of the cheapest value of \
+    each unassigned variable.
+    Soft clauses with more than one literal are replaced by hard clauses with an additional \
+    variable that carries the weight.
+    """
+
+    def __init__(self):
+        MaxSATSolver.__init__(self, None)
+
+    def prepare_input(self, formula, **kwargs):
+        return formula._contents(weighted=float, **kwargs)
+
+    def call_process(self, inputf):
+        header, clauses = inputf
+        return self.solve(header[0], clauses, header[2])
+
+    def process_output(self, output):
+        if output is None:
+            raise UnsatisfiableError()
+        return output
+
+    def solve(self, variables, clauses, top=None):
+        """Find an assignment that satisfies the hard clauses and minimizes the total weight of \
+        the violated soft clauses.
+
+        :param variables: number of variables
+        :param clauses: list of clauses [weight, literal, ...]
+        :param top: clauses with at least this weight are hard (default: all clauses are hard)
+        :return: list of literals (one for each variable) or None if the hard clauses are \
+        unsatisfiable
+        """
+        infinity = float('inf')
+        n = variables
+        hard = []
+        cost = [[0.0, 0.0] for _ in range(n + 1)]  # cost of setting a variable to false / true
+        for clause in clauses:
+            # A clause can contain the FALSE node (None), e.g. for inconsistent evidence.
+            weight, literals = clause[0], [lit for lit in clause[1:] if lit is not None]
+            if top is None or weight >= top or weight in (infinity, -infinity):
+                literals = set(literals)
+                if not any(-lit in literals for lit in literals):
+                    hard.append(list(literals))
+            elif len(literals) == 1:
+                lit = literals[0]
+                cost[abs(lit)][lit < 0] += weight
+            elif literals:
+                # Relaxation variable: true when the clause is violated.
+                n += 1
+                cost.append([0.0, weight])
+                if weight > 0:
+                    hard.append(literals + [n])
+                else:
+                    hard += [[-lit, -n] for lit in literals]
+
+        occurs = [[] for _ in range(2 * n + 1)]  # clauses that contain the literal (index n + lit)
+        for i, clause in enumerate(hard):
+            if not clause:
+                return None
+            for lit in clause:
+                occurs[n + lit].append(i)
+
+        value = [None] * (n + 1)
+        extra = [c[1] - min(c) if v else c[0] - min(c) for c in cost for v in (False, True)]
+        trail = []
+        bound = [sum(min(c) for c in cost)]
+
+        def assign(lit):
+            value[abs(lit)] = lit > 0
+            trail.append(lit)
+            bound[0] += extra[2 * abs(lit) + (lit > 0)]
+
+        def undo(mark):
+            while len(trail) > mark:
+                lit = trail.pop()
+                value[abs(lit)] = None
+                bound[0] -= extra[2 * abs(lit) + (lit > 0)]
+
+        def propagate(start):
+            i = start
+            while i < len(trail):
+                lit = trail[i]
+                i += 1
+                for c in occurs[n - lit]:
+                    unassigned = None
+                    count = 0
+                    for other in hard[c]:
+                        v = value[abs(other)]
+                        if v is None:
+                            count += 1
+                            unassigned = other
+                        elif v == (other > 0):
+                            break
+                    else:
+                        if count == 0:
+                            return False
+                        elif count == 1:
+                            assign(unassigned)
+            return True
+
+        for clause in hard:
+            if len(clause) == 1 and value[abs(clause[0])] is None:
+                assign(clause[0])
+        consistent = all(value[abs(c[0])] == (c[0] > 0) for c in hard if len(c) == 1) \
+            and propagate(0)
+
+        # Branch on the variables with the largest difference in cost first.
+        order = sorted(range(1, n + 1), key=lambda v: (-abs(cost[v][1] - cost[v][0]),
+                                                        -len(occurs[n + v]) - len(occurs[n - v])))
+        best = None
+        best_cost = infinity
+        stack = []  # (trail length, position in order, alternative literal)
+        position = 0
+        while True:
+            if consistent and bound[0] < best_cost:
+                while position < len(order) and value[order[position]] is not None:
+                    position += 1
+                if position < len(order):
+                    var = order[position]
+                    lit = var if cost[var][1] <= cost[var][0] else -var
+                    stack.append((len(trail), position, -lit))
+                    assign(lit)
+                    consistent = propagate(len(trail) - 1)
+                    continue
+                best_cost = bound[0]
+                best = [v if value[v] else -v for v in range(1, variables + 1)]
+            # Backtrack to the last decision that has an untried alternative.
+            while stack:
+                mark, position, lit = stack.pop()
+                undo(mark)
+                if lit is not None:
+                    stack.append((mark, position, None))
+                    assign(lit)
+                    consistent = propagate(mark)
+                    break
+            else:
+                break
+        return best
+
+
 def get_solver(prefer=None):
-    if prefer == 'scip':
+    if prefer == 'builtin':
+        return BranchAndBoundSolver()
+    elif prefer == 'scip':
         return SCIPSolver()
     elif prefer == 'sat4j':
         return MaxSATSolver(['java', '-jar',
@@ -114,4 +261,4 @@ def get_solver(prefer=None):
 
 def get_available_solvers():
     # TODO check whether they are actually available
-    return ['maxsatz', 'scip', 'sat4j']
+    return ['maxsatz', 'scip', 'sat4j', 'builtin']
@@ -150,10 +150,24 @@ SPECIAL_ARGLIST = 11
 SPECIAL_SHARP_OPEN = 12
 SPECIAL_SHARP_CLOSE = 13
 
+import copy
 import re
 
 RE_FLOAT = re.compile(r'[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?')
 
+# Whitespace and comments between statements.
+RE_LAYOUT = re.compile(r'(?:[\x00- ]+|%[^\n]*|/\*.*?\*/)*', re.DOTALL)
+
+# Statements of the form 'f(a,1,...).' or 'p::f(a,1,...).' where all arguments are atoms or
+#  non-negative numbers. These are parsed directly without tokenizing (see PrologParser).
+_RE_ATOM = r'[a-z][A-Za-z0-9_]*'
+_RE_NUMBER = r'[0-9]+(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?'
+_RE_ARG = r'(?:%s|%s)' % (_RE_ATOM, _RE_NUMBER)
+RE_FACT = re.compile(r'(?:(?P<prob>%s)[\x00- ]*(?P<op>::)[\x00- ]*)?(?P<functor>%s)'
+                     r'(?:\((?P<args>[\x00- ]*%s(?:[\x00- ]*,[\x00- ]*%s)*[\x00- ]*)\))?'
+                     r'[\x00- ]*\.(?=[\x00- ]|%%|/|\Z)' % (_RE_NUMBER, _RE_ATOM, _RE_ARG, _RE_ARG))
+RE_FACT_ARG = re.compile(_RE_ARG)
+
 
 def skip_to(s, pos, char):
     end = s.find(char, pos)
@@ -750,15 +764,165 @@ class PrologParser(object):
     def _parse_statement(self, string, tokens):
         return self.collapse(string, tokens)
 
+    def _parse_fact(self, string, match):
+        """Build a statement matched by RE_FACT.
+
+        :param string: the string being parsed
+        :param match: match of RE_FACT in string
+        :return: the parsed fact, or None if it should be parsed by the tokenizer \
+          (i.e. it contains an operator name such as 'is' or 'not')
+        """
+        factory = self.factory
+        functor = match.group('functor')
+        if functor in self.string_operators:
+            return None
+        arguments = []
+        if match.group('args') is not None:
+            for arg in RE_FACT_ARG.finditer(string, match.start('args'), match.end('args')):
+                value = arg.group(0)
+                if is_digit(value[0]):
+                    if value.find('.') >= 0 or value.find('e') >= 0 or value.find('E') >= 0:
+                        value = float(value)
+                    else:
+                        value = int(value)
+                    arguments.append(factory.build_constant(value, location=arg.start()))
+                elif value in self.string_operators:
+                    return None
+                else:
+                    arguments.append(factory.build_function(value, (), location=arg.start()))
+        fact = factory.build_function(functor, arguments, location=match.start('functor'))
+        probability = match.group('prob')
+        if probability is not None:
+            if probability.find('.') >= 0 or probability.find('e') >= 0 or \
+                    probability.find('E') >= 0:
+                probability = float(probability)
+            else:
+                probability = int(probability)
+            probability = factory.build_constant(probability, location=match.start('prob'))
+            fact = factory.build_probabilistic(functor='::', operand1=probability, operand2=fact,
+                                               location=match.start('op'), priority=1000,
+                                               opspec='xfx')
+        return fact
+
+    def _parse_statements(self, string, pos=0, partial=False):
+        """Parse the statements in the given string.
+
+        Plain facts (see RE_FACT) are built directly from a regular expression match.
+        All other statements are tokenized and parsed by :meth:`_parse_statement`.
+
+        :param string: string to parse
+        :param pos: position at which to start parsing
+        :param partial: the string may end in the middle of a statement; in that case the \
+          generator stops before that statement instead of raising an error
+        :return: generator of tuples (statement, position after the statement)
+        """
+        s_len = len(string)
+        while True:
+            pos = RE_LAYOUT.match(string, pos).end()
+            if pos >= s_len:
+                return
+            match = RE_FACT.match(string, pos)
+            if match is not None:
+                fact = self._parse_fact(string, match)
+                if fact is not None:
+                    pos = match.end()
+                    yield fact, pos
+                    continue
+            statement = []
+            try:
+                while True:
+                    if pos >= s_len:
+                        if partial:
+                            return
+                        raise ParseError(string, 'Incomplete statement', s_len)
+                    token, pos = self.next_token(string, pos)
+                    if token is None:
+                        pass
+                    elif token.is_special(SPECIAL_END):
+                        break
+                    else:
+                        statement.append(token)
+            except ParseError:
+                if partial:
+                    # The error may be caused by a quote or comment that continues after the end.
+                    return
+                raise
+            if not statement:
+                raise ParseError(string, 'Empty statement found', token.location)
+            yield self._parse_statement(string, statement), pos
+
     def parseString(self, string):
-        return self.factory.build_program(mapl(lambda x: self._parse_statement(string, x),
-                                               self._extract_statements(string,
-                                                                        self._tokenize(string))))
+        pos = 0
+        if string[:2] == '#!':
+            pos = skip_comment_line(string, pos)
+        return self.factory.build_program([statement for statement, _ in
+                                           self._parse_statements(string, pos)])
 
     def parseFile(self, filename):
         with open(filename) as f:
             return self.parseString(f.read())
 
+    def parseStream(self, stream, block_size=1 << 20):
+        """Parse the statements read from a file object without loading the whole file.
+
+        The file is read in blocks of the given size.
+        Only the statements that are not yet complete are kept in memory.
+        The locations of the statements are character offsets in the whole file.
+        The statements are not passed to the factory's build_program.
+        A ParseError is raised at the first statement that requires a transformation of the \
+        whole program (e.g. a negative head literal in ExtendedPrologFactory).
+
+        :param stream: file object to read from
+        :param block_size: number of characters to read at once
+        :return: generator of statements
+        """
+        factory = _OffsetFactory(self.factory)
+        parser = copy.copy(self)
+        parser.factory = factory
+        parser.prepare()
+
+        buffer = stream.read(block_size)
+        pos = 0
+        if buffer[:2] == '#!':
+            pos = skip_comment_line(buffer, pos)
+        lineno = 0  # number of lines before the buffer
+        while buffer:
+            block = stream.read(block_size)
+            if block:
+                # Only parse complete lines such that a '.' at the end of the buffer is final.
+                end = buffer.rfind('\n') + 1
+                if end == 0:
+                    buffer += block
+                    continue
+                text = buffer[:end]
+                buffer = buffer[end:] + block
+            else:
+                text = buffer
+                buffer = ''
+            try:
+                begin = pos
+                for statement, pos in parser._parse_statements(text, pos, partial=bool(block)):
+                    if self.factory.requires_program():
+                        raise ParseError(text, 'Statement requires a transformation of the whole '
+                                               'program and can not be parsed as a stream',
+                                         RE_LAYOUT.match(text, begin).end())
+                    yield statement
+                    begin = pos
+            except ParseError as err:
+                fn, line, col = err.location
+                err.location = (fn, line + lineno, col)
+                err.message = err._message()
+                raise
+            if not block:
+                break
+            # Keep the remainder of the text (an incomplete statement) from the start of its line.
+            start = text.rfind('\n', 0, pos) + 1
+            lineno += text.count('\n', 0, start)
+            factory.offset += start
+            buffer = text[start:] + buffer
+            pos -= start
+
+
     def collapse(self, string, tokens):
         """Combine tokens into subexpressions."""
 
@@ -973,12 +1137,47 @@ class ParenExpression(SubExpression):
         return self.tokens
 
 
+class _OffsetFactory(object):
+    """Wrapper around a factory that adds an offset to the locations passed to it.
+
+    Used by :meth:`PrologParser.parseStream` to report locations in the whole file while \
+    parsing a part of it.
+
+    :param factory: factory to wrap
+    :param offset: offset to add to locations
+    """
+
+    def __init__(self, factory, offset=0):
+        self.factory = factory
+        self.offset = offset
+
+    def __getattr__(self, name):
+        method = getattr(self.factory, name)
+        if not name.startswith('build_') or not callable(method):
+            return method
+
+        def build(*args, **kwargs):
+            location = kwargs.get('location')
+            if location is not None:
+                kwargs['location'] = location + self.offset
+            return method(*args, **kwargs)
+        setattr(self, name, build)
+        return build
+
+
 class Factory(object):
     """Factory object for creating suitable objects from the parse tree."""
 
     def build_program(self, clauses):
         return '\n'.join(map(str, clauses))
 
+    def requires_program(self):
+        """Check whether the statements built so far have to be transformed by build_program.
+
+        Such statements can not be parsed as a stream (see :meth:`PrologParser.parseStream`).
+        """
+        return False
+
     def build_function(self, functor, arguments, location=None):
         return '%s(%s)' % (functor, ', '.join(map(str, arguments)))
 
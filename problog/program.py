@@ -475,6 +475,9 @@ class ExtendedPrologFactory(PrologFactory):
             clauses.append(new_clause)
         return clauses
 
+    def requires_program(self):
+        return bool(self.neg_head_lits)
+
     def neg_head_literal_to_pos_literal(self, literal):
         """Translate a negated literal into a positive literal and remember
         the literal to update the complete program later (in build_program).
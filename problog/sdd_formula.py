@@ -23,12 +23,18 @@ Interface to Sentential Decision Diagrams (SDD)
 """
 from __future__ import print_function
 
-from .formula import LogicDAG, LogicFormula
+from .formula import LogicDAG, LogicFormula, LogicNNF
 from .core import transform
+from .constraint import ConstraintAD
 from .errors import InstallError
 from .dd_formula import DD, build_dd, DDManager
+from .batch import BatchEvaluator, batch_weights, evidence_literals
 from .util import mktempfile
 import os
+import struct
+import sys
+from array import array
+from collections import OrderedDict
 
 
 # noinspection PyBroadException
@@ -37,6 +43,31 @@ try:
 except Exception as err:
     sdd = None
 
+_SDD_MAGIC = b'PLSDD\x00\x00\x01'
+
+
+def _array_to_bytes(values):
+    """Get the little-endian bytes of an integer array."""
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    try:
+        return values.tobytes()
+    except AttributeError:  # Python 2
+        return values.tostring()
+
+
+def _array_from_bytes(data):
+    """Create an integer array from little-endian bytes."""
+    values = array('i')
+    try:
+        values.frombytes(data)
+    except AttributeError:  # Python 2
+        values.fromstring(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
 
 class SDD(DD):
     """A propositional logic formula consisting of and, or, not and atoms represented as an SDD.
@@ -78,6 +109,36 @@ class SDD(DD):
             formula.add_name(n, i, l)
         return formula
 
+    def _create_batch_evaluator(self, weights=None):
+        manager = self.get_manager()
+        evidence = [self.get_inode(ev) for ev in evidence_literals(self)]
+        evidence_inode = manager.conjoin(self.get_constraint_inode(), *evidence)
+
+        formula = LogicNNF()
+        cache = {}
+        queries = []
+        for name, node, label in self.labeled():
+            query_inode = manager.conjoin(self.get_inode(node), evidence_inode)
+            queries.append((name, self._to_formula(formula, query_inode, cache), ()))
+            manager.deref(query_inode)
+        evidence_root = self._to_formula(formula, evidence_inode, cache)
+        manager.deref(evidence_inode)
+
+        # Atoms extracted from the SDD are identified by their SDD variable, except for the extra
+        # atoms that the annotated disjunctions of the new formula add for their missing mass.
+        extra = dict((c.group, c.extra_node) for c in self.constraints()
+                     if isinstance(c, ConstraintAD))
+        slots = {}
+        for key, node, t in formula:
+            if t == 'atom':
+                if node.identifier in self.var2atom:
+                    slots[key] = self.var2atom[node.identifier]
+                else:
+                    slots[key] = extra[node.group]
+        weights, facts, constraints = batch_weights(self, weights)
+        return BatchEvaluator(formula, slots, weights, facts, constraints, queries,
+                              (evidence_root, ()), smooth=True)
+
     def _to_formula(self, formula, current_node, cache=None):
         if cache is not None and int(current_node) in cache:
             return cache[int(current_node)]
@@ -111,6 +172,56 @@ class SDD(DD):
             cache[int(current_node)] = retval
         return retval
 
+    def _evaluate_inode(self, inode, semiring, weights, cache):
+        # Walk the decision nodes directly: (p1 x s1) + (p2 x s2) + ...
+        # Values are stored by SDD node id, which is never reused by the SDD library.
+        manager = self.get_manager()
+        values = cache.values
+        key = sdd.sdd_id(inode)
+        if key in values:
+            cache.hits += 1
+            return values[key]
+
+        stack = [(inode, False)]
+        while stack:
+            node, expanded = stack.pop()
+            key = sdd.sdd_id(node)
+            if not expanded and key in values:
+                continue
+            if sdd.sdd_node_is_decision(node):
+                size = sdd.sdd_node_size(node)
+                elements = sdd.sdd_node_elements(node)
+                children = [sdd.sdd_array_element(elements, i) for i in range(0, size * 2)]
+                if not expanded:
+                    stack.append((node, True))
+                    for child in children:
+                        if sdd.sdd_id(child) in values:
+                            cache.hits += 1
+                        else:
+                            stack.append((child, False))
+                    continue
+                value = semiring.zero()
+                for i in range(0, size * 2, 2):
+                    value = semiring.plus(value,
+                                          semiring.times(values[sdd.sdd_id(children[i])],
+                                                         values[sdd.sdd_id(children[i + 1])]))
+            elif manager.is_true(node):
+                value = semiring.one()
+            elif manager.is_false(node):
+                value = semiring.zero()
+            else:
+                lit = sdd.sdd_node_literal(node)
+                weight = weights.get(abs(lit))
+                if weight is None:
+                    value = semiring.one() if lit > 0 else semiring.negate(semiring.one())
+                elif lit > 0:
+                    value = weight[0]
+                else:
+                    value = weight[1]
+            values[key] = value
+            cache.misses += 1
+        return values[sdd.sdd_id(inode)]
+
 
 
 class SDDManager(DDManager):
@@ -119,19 +230,25 @@ class SDDManager(DDManager):
     It wraps around the SDD library and offers some additional methods.
     """
 
-    def __init__(self, varcount=0, auto_gc=True):
+    def __init__(self, varcount=0, auto_gc=True, wmc_cache_size=32):
         """Create a new SDD manager.
 
         :param varcount: number of initial variables
         :type varcount: int
         :param auto_gc: use automatic garbage collection and minimization
         :type auto_gc: bool
+        :param wmc_cache_size: number of WMC managers to keep for reuse (not used with auto_gc)
+        :type wmc_cache_size: int
         """
         DDManager.__init__(self)
         if varcount is None or varcount == 0:
             varcount = 1
         self.__manager = sdd.sdd_manager_create(varcount, auto_gc)
         self.varcount = varcount
+        self.auto_gc = auto_gc
+        self.wmc_cache_size = wmc_cache_size
+        # WMC managers in order of last use: (node id, logspace) => (wmc manager, node, weights)
+        self._wmc_cache = OrderedDict()
 
     def get_manager(self):
         """Get the underlying sdd manager."""
@@ -139,6 +256,8 @@ class SDDManager(DDManager):
 
     def add_variable(self, label=0):
         if label == 0 or label > self.varcount:
+            # WMC managers can not be used after a change of the vtree.
+            self.clear_wmc_cache()
             sdd.sdd_manager_add_var_after_last(self.__manager)
             self.varcount += 1
             return self.varcount
@@ -199,59 +318,289 @@ class SDDManager(DDManager):
     def write_to_dot(self, node, filename):
         sdd.sdd_save_as_dot(filename, node)
 
-    def wmc(self, node, weights, semiring, literal=None):
+    def _wmc_manager(self, node, weights, semiring):
+        """Get a WMC manager for the given node with the given literal weights.
+
+        The WMC managers of the most recently used nodes are kept, and only the weights that \
+        changed since their last use are set.
+        A manager obtained with this method should be released with :meth:`_release_wmc_manager`.
+
+        :return: tuple (wmc manager, node, weights set in the manager)
+        """
         logspace = 0
         if semiring.one() == 0.0:
             logspace = 1
-        wmc_manager = sdd.wmc_manager_new(node, logspace, self.get_manager())
+        key = (sdd.sdd_id(node), logspace)
+        entry = self._wmc_cache.pop(key, None)
+        if entry is None:
+            wmc_manager = sdd.wmc_manager_new(node, logspace, self.get_manager())
+            if self.wmc_cache_size and not self.auto_gc:
+                # Keep the node alive as long as its WMC manager is cached.
+                self.ref(node)
+                entry = (wmc_manager, node, {})
+            else:
+                entry = (wmc_manager, None, {})
+        if entry[1] is not None:
+            self._wmc_cache[key] = entry
+            while len(self._wmc_cache) > self.wmc_cache_size:
+                self._free_wmc_manager(self._wmc_cache.popitem(last=False)[1])
+
+        wmc_manager, _, current = entry
+        one = semiring.one()
+        for n in [n for n in current if n not in weights]:
+            # Reset to the default weight of a new WMC manager.
+            sdd.wmc_set_literal_weight(n, one, wmc_manager)
+            sdd.wmc_set_literal_weight(-n, one, wmc_manager)
+            del current[n]
+        self._set_wmc_weights(entry, weights)
+        return entry
+
+    def _set_wmc_weights(self, entry, weights):
+        """Set the weights that differ from the current weights of the WMC manager."""
+        wmc_manager, _, current = entry
         varcount = sdd.sdd_manager_var_count(self.get_manager())
         for n in weights:
             pos, neg = weights[n]
-            if n <= varcount:
+            if n <= varcount and current.get(n) != (pos, neg):
                 sdd.wmc_set_literal_weight(n, pos, wmc_manager)  # Set positive literal weight
                 sdd.wmc_set_literal_weight(-n, neg, wmc_manager)  # Set negative literal weight
-        result = sdd.wmc_propagate(wmc_manager)
-        if literal is not None:
-            result = sdd.wmc_literal_pr(literal, wmc_manager)
+                current[n] = (pos, neg)
+
+    def _release_wmc_manager(self, entry):
+        """Release a WMC manager obtained with :meth:`_wmc_manager`."""
+        if entry[1] is None:
+            self._free_wmc_manager(entry)
+
+    def _free_wmc_manager(self, entry):
+        wmc_manager, node, _ = entry
         sdd.wmc_manager_free(wmc_manager)
+        if node is not None:
+            self.deref(node)
+
+    def clear_wmc_cache(self):
+        """Free all WMC managers that are kept for reuse."""
+        while self._wmc_cache:
+            self._free_wmc_manager(self._wmc_cache.popitem()[1])
+
+    def wmc(self, node, weights, semiring, literal=None):
+        entry = self._wmc_manager(node, weights, semiring)
+        result = sdd.wmc_propagate(entry[0])
+        if literal is not None:
+            result = sdd.wmc_literal_pr(literal, entry[0])
+        self._release_wmc_manager(entry)
         return result
 
     def wmc_literal(self, node, weights, semiring, literal):
         return self.wmc(node, weights, semiring, literal)
 
+    def wmc_literals(self, node, weights, semiring, literals):
+        # The upward and downward pass of the SDD library give all literal probabilities at once.
+        entry = self._wmc_manager(node, weights, semiring)
+        sdd.wmc_propagate(entry[0])
+        result = [sdd.wmc_literal_pr(literal, entry[0]) for literal in literals]
+        self._release_wmc_manager(entry)
+        return result
+
+    def wmc_updates(self, node, weights, semiring, updates, literal=None):
+        # Only the weights in each update are set before propagating again.
+        entry = self._wmc_manager(node, weights, semiring)
+        result = []
+        for update in updates:
+            self._set_wmc_weights(entry, update)
+            value = sdd.wmc_propagate(entry[0])
+            if literal is not None:
+                value = sdd.wmc_literal_pr(literal, entry[0])
+            result.append(value)
+        self._release_wmc_manager(entry)
+        return result
+
     def wmc_true(self, weights, semiring):
         return self.wmc(self.true(), weights, semiring)
 
     def __del__(self):
+        if sdd is not None and self._wmc_cache:
+            for wmc_manager, node, weights in self._wmc_cache.values():
+                sdd.wmc_manager_free(wmc_manager)
+            self._wmc_cache.clear()
         # if sdd is not None and sdd.sdd_manager_free is not None:
         #     sdd.sdd_manager_free(self.__manager)
         self.__manager = None
 
-    def __getstate__(self):
-        tempfile = mktempfile()
-        vtree = sdd.sdd_manager_vtree(self.get_manager())
-        sdd.sdd_vtree_save(tempfile, vtree)
-        with open(tempfile) as f:
-            vtree_data = f.read()
+    def to_bytes(self):
+        """Serialize the vtree and all nodes of the manager in a compact binary format.
 
-        nodes = []
-        for n in self.nodes:
-            if n is not None:
-                sdd.sdd_save(tempfile, n)
+        The nodes are stored once as a shared DAG in which each node refers to its elements by \
+        their position.
+        The result can be loaded with :meth:`from_bytes` or, after writing it to a file, with \
+        :meth:`load`.
 
-                with open(tempfile) as f:
-                    nodes.append(f.read())
+        :return: serialized manager
+        :rtype: bytes
+        """
+        manager = self.get_manager()
+
+        # Vtree in postorder: leaf (0, var, 0) or internal node (1, left, right)
+        vtree_data = array('i')
+        positions = {}
+        stack = [(sdd.sdd_manager_vtree(manager), False)]
+        while stack:
+            vtree, expanded = stack.pop()
+            if sdd.sdd_vtree_is_leaf(vtree):
+                vtree_data.extend((0, sdd.sdd_vtree_var(vtree), 0))
+            elif expanded:
+                vtree_data.extend((1, positions[sdd.sdd_vtree_position(sdd.sdd_vtree_left(vtree))],
+                                   positions[sdd.sdd_vtree_position(sdd.sdd_vtree_right(vtree))]))
             else:
-                nodes.append(None)
+                stack.append((vtree, True))
+                stack.append((sdd.sdd_vtree_right(vtree), False))
+                stack.append((sdd.sdd_vtree_left(vtree), False))
+                continue
+            positions[sdd.sdd_vtree_position(vtree)] = len(vtree_data) // 3 - 1
+
+        # Nodes in postorder: true (-1), false (-2), literal (0, lit) or decision (k, p1, s1, ...)
+        node_data = array('i')
+        indices = {}
+        roots = array('i')
+        for root in self.nodes + [self.constraint_dd]:
+            if root is None:
+                roots.append(-1)
+                continue
+            stack = [(root, False)]
+            while stack:
+                node, expanded = stack.pop()
+                key = sdd.sdd_id(node)
+                if key in indices:
+                    continue
+                if sdd.sdd_node_is_decision(node):
+                    size = sdd.sdd_node_size(node)
+                    elements = sdd.sdd_node_elements(node)
+                    children = [sdd.sdd_array_element(elements, i) for i in range(0, size * 2)]
+                    if not expanded:
+                        stack.append((node, True))
+                        stack.extend((c, False) for c in reversed(children))
+                        continue
+                    index = len(indices)
+                    node_data.append(size)
+                    node_data.extend(indices[sdd.sdd_id(c)] for c in children)
+                elif sdd.sdd_node_is_true(node):
+                    node_data.append(-1)
+                elif sdd.sdd_node_is_false(node):
+                    node_data.append(-2)
+                else:
+                    node_data.extend((0, sdd.sdd_node_literal(node)))
+                indices[key] = len(indices)
+            roots.append(indices[sdd.sdd_id(root)])
+
+        header = struct.pack('<8s4i', _SDD_MAGIC, self.varcount, len(vtree_data), len(node_data),
+                             len(roots))
+        return header + b''.join(_array_to_bytes(a) for a in (vtree_data, node_data, roots))
 
-        sdd.sdd_save(tempfile, self.constraint_dd)
-        with open(tempfile) as f:
-            constraint_dd = f.read()
+    @classmethod
+    def from_bytes(cls, data):
+        """Load a manager that was serialized with :meth:`to_bytes`.
 
+        :param data: serialized manager
+        :return: new manager
+        :rtype: SDDManager
+        """
+        result = cls.__new__(cls)
+        result._read_bytes(data)
+        return result
+
+    def save(self, filename):
+        """Write the manager to a file in the format of :meth:`to_bytes`.
+
+        :param filename: name of the file
+        """
+        with open(filename, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, filename):
+        """Load a manager from a file written by :meth:`save`.
+
+        :param filename: name of the file
+        :return: new manager
+        :rtype: SDDManager
+        """
+        with open(filename, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+    def _read_bytes(self, data):
+        magic, varcount, vtree_size, node_size, root_count = struct.unpack('<8s4i', data[:24])
+        if magic != _SDD_MAGIC:
+            raise ValueError('Not a serialized SDD manager.')
+        offset = 24
+        vtree_data = _array_from_bytes(data[offset:offset + 4 * vtree_size])
+        offset += 4 * vtree_size
+        node_data = _array_from_bytes(data[offset:offset + 4 * node_size])
+        offset += 4 * node_size
+        roots = _array_from_bytes(data[offset:offset + 4 * root_count])
+
+        # The SDD library can only read a vtree from a file.
+        lines = ['vtree %d' % (len(vtree_data) // 3)]
+        for i in range(0, len(vtree_data), 3):
+            if vtree_data[i] == 0:
+                lines.append('L %d %d' % (i // 3, vtree_data[i + 1]))
+            else:
+                lines.append('I %d %d %d' % (i // 3, vtree_data[i + 1], vtree_data[i + 2]))
+        tempfile = mktempfile()
+        with open(tempfile, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        vtree = sdd.sdd_vtree_read(tempfile)
         os.remove(tempfile)
-        return {'varcount': self.varcount, 'nodes': nodes, 'vtree': vtree_data, 'constraint_dd': constraint_dd}
+
+        DDManager.__init__(self)
+        self.__manager = sdd.sdd_manager_new(vtree)
+        self.varcount = varcount
+        self.auto_gc = False
+        self.wmc_cache_size = 32
+        self._wmc_cache = OrderedDict()
+
+        # The SDD of a decision node is rebuilt from its elements: (p1 ^ s1) v (p2 ^ s2) v ...
+        # For the same vtree, this gives the same (canonical) SDD.
+        manager = self.__manager
+        nodes = []
+        i = 0
+        while i < len(node_data):
+            size = node_data[i]
+            if size == -1:
+                node = sdd.sdd_manager_true(manager)
+                i += 1
+            elif size == -2:
+                node = sdd.sdd_manager_false(manager)
+                i += 1
+            elif size == 0:
+                node = sdd.sdd_manager_literal(node_data[i + 1], manager)
+                i += 2
+            else:
+                node = sdd.sdd_manager_false(manager)
+                for j in range(i + 1, i + 1 + size * 2, 2):
+                    element = sdd.sdd_conjoin(nodes[node_data[j]], nodes[node_data[j + 1]], manager)
+                    node = sdd.sdd_disjoin(node, element, manager)
+                i += 1 + size * 2
+            nodes.append(node)
+
+        self.nodes = [nodes[r] if r >= 0 else None for r in roots[:-1]]
+        self.constraint_dd = nodes[roots[-1]] if roots[-1] >= 0 else None
+        for node in self.nodes + [self.constraint_dd]:
+            if node is not None:
+                sdd.sdd_ref(node, manager)
+
+    def __getstate__(self):
+        return {'data': self.to_bytes()}
 
     def __setstate__(self, state):
+        if 'data' in state:
+            self._read_bytes(state['data'])
+        else:
+            self._read_text_state(state)
+
+    def _read_text_state(self, state):
+        # State written by older versions: every node saved separately in the SDD text format.
+        self._wmc_cache = OrderedDict()
+        self.auto_gc = False
+        self.wmc_cache_size = 32
         self.nodes = []
         self.varcount = state['varcount']
         tempfile = mktempfile()
@@ -272,7 +621,6 @@ class SDDManager(DDManager):
             f.write(state['constraint_dd'])
         self.constraint_dd = sdd.sdd_read(tempfile, self.__manager)
         os.remove(tempfile)
-        return
 
 
 @transform(LogicDAG, SDD)
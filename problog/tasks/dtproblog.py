@@ -24,10 +24,15 @@ import sys
 import logging
 import traceback
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from ..program import PrologFile
 from ..engine import DefaultEngine
 from ..logic import Term
-from ..errors import process_error, ProbLogError
+from ..errors import process_error, ProbLogError, InconsistentEvidenceError
 from .. import get_evaluatables, get_evaluatable
 from ..util import init_logger, Timer, format_dictionary
 
@@ -76,7 +81,7 @@ def dtproblog(model, search=None, koption=None, locations=False, web=False, **kw
 
     :param model: ProbLog model
     :type model: problog.logic.LogicProgram
-    :param search: specifies search ('exhaustive' or 'local')
+    :param search: specifies search ('exhaustive', 'local', 'gradient' or 'bnb')
     :param koption: specifies knowledge compilation tool (omit for system default)
     :param locations: add Term locations to results
     :param web: prepare for web mode
@@ -119,6 +124,12 @@ def dtproblog(model, search=None, koption=None, locations=False, web=False, **kw
             with Timer('Optimize', logger='dtproblog'):
                 if search == 'local':
                     result = search_local(knowledge, decisions, utilities, constraints, **kwargs)
+                elif search == 'gradient':
+                    result = search_gradient(knowledge, decisions, utilities, constraints,
+                                             **kwargs)
+                elif search == 'bnb':
+                    result = search_branch_and_bound(knowledge, decisions, utilities, constraints,
+                                                     **kwargs)
                 else:
                     result = search_exhaustive(knowledge, decisions, utilities, constraints, **kwargs)
         else:
@@ -146,7 +157,7 @@ def evaluate(formula, decisions, utilities, verbose=0):
         score += vpos * float(utilities.get(r, 0.0))
         score += vneg * float(utilities.get(-r, 0.0))
 
-    if verbose >= 3:
+    if verbose is not None and verbose >= 3:
         print ('---------------')
         print ('Decisions:')
         print (format_dictionary(decisions))
@@ -200,15 +211,7 @@ def search_local(formula, decisions, utilities, constraints, verbose=0, **kwargs
         if not c.is_true():
             raise ProbLogError('Local search does not support constraints')
 
-    choices = {}
-    # Create the initial strategy:
-    #  for each decision, take option that has highest local utility
-    #   (takes false if no utility is given for the decision variable)
-    for ident, key in decisions:
-        if key in utilities and float(utilities[key]) > 0:
-            choices[key] = 1
-        else:
-            choices[key] = 0
+    choices = initial_choices(decisions, utilities)
 
     # Compute the score of the initial strategy.
     best_score = evaluate(formula, choices, utilities)
@@ -246,6 +249,168 @@ def search_local(formula, decisions, utilities, constraints, verbose=0, **kwargs
     return choices, best_score, stats
 
 
+def initial_choices(decisions, utilities):
+    """Create the initial strategy for local search: for each decision, take the option that \
+    has the highest local utility (false if no utility is given for the decision variable).
+
+    :param decisions: list of (node, name) of the decisions
+    :param utilities: dictionary of utilities
+    :return: dictionary {decision name: 0 or 1}
+    """
+    choices = {}
+    for ident, key in decisions:
+        if key in utilities and float(utilities[key]) > 0:
+            choices[key] = 1
+        else:
+            choices[key] = 0
+    return choices
+
+
+def search_gradient(formula, decisions, utilities, constraints, verbose=0, **kwargs):
+    """Performs local search by flipping the decision that improves the score most.
+
+    The scores of all strategies that differ from the current one in a single decision are \
+    computed together, with one forward and backward pass over the circuit (see \
+    :meth:`problog.batch.BatchEvaluator.gradient`).
+    Each step therefore costs about two evaluations instead of one per decision.
+
+    :param formula: compiled formula (must support batch evaluation, e.g. d-DNNF or SDD)
+    :param decisions: list of (node, name) of the decisions
+    :param utilities: dictionary of utilities
+    :param constraints: constraints on the decisions (not supported)
+    :param verbose: verbosity level
+    :param kwargs: additional arguments (ignored)
+    :return: best decisions, score of best decision, statistics
+    """
+    stats = {'eval': 0}
+
+    for c in constraints:
+        if not c.is_true():
+            raise ProbLogError('Gradient search does not support constraints')
+
+    choices = initial_choices(decisions, utilities)
+    evaluator, names, coefficients, constant = _prepare_batch(formula, decisions, utilities)
+
+    while True:
+        current = numpy.array([[choices[n] for n in names]], dtype=float)
+        value, d_value, evidence, d_evidence = evaluator.gradient(current, coefficients, names)
+        stats['eval'] += 1
+        # Strategies under which the evidence is impossible get score -inf.
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            score = constant + value[0] / evidence[0]
+        if not numpy.isfinite(score):
+            score = -numpy.inf
+        if not names:
+            break
+        # The probabilities are linear in each decision, so this is the exact score after
+        # flipping the decision.
+        flip = 1.0 - 2.0 * current[0]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            flip_score = constant + (value[0] + flip * d_value[0]) / \
+                (evidence[0] + flip * d_evidence[0])
+        flip_score[~numpy.isfinite(flip_score)] = -numpy.inf
+        best = int(numpy.argmax(flip_score))
+        if flip_score[best] == -numpy.inf or score > -numpy.inf and \
+                flip_score[best] <= score + _EPSILON * (1.0 + abs(score)):
+            break
+        choices[names[best]] = 1 - choices[names[best]]
+        logging.getLogger('dtproblog').debug('Improvement: %s -> %s'
+                                             % (choices, flip_score[best]))
+    if score == -numpy.inf:
+        raise InconsistentEvidenceError(context=' for the strategy found by gradient search')
+    return choices, float(score), stats
+
+
+def search_branch_and_bound(formula, decisions, utilities, constraints, verbose=0, **kwargs):
+    """Performs exhaustive search in which partial strategies are pruned when an upper bound \
+    on their score is not better than the best strategy found so far.
+
+    The search starts from the result of :func:`search_gradient`.
+    Decisions with the largest effect on the score are assigned first.
+    The bounds are computed by evaluating the circuit with the undecided decisions relaxed \
+    (see :meth:`problog.batch.BatchEvaluator.bounds`).
+
+    :param formula: compiled formula (must support batch evaluation, e.g. d-DNNF or SDD)
+    :param decisions: list of (node, name) of the decisions
+    :param utilities: dictionary of utilities
+    :param constraints: constraints on the decisions (not supported)
+    :param verbose: verbosity level
+    :param kwargs: additional arguments (ignored)
+    :return: best decisions, score of best decision, statistics
+    """
+    for c in constraints:
+        if not c.is_true():
+            raise ProbLogError('Branch-and-bound search does not support constraints')
+
+    choices, best_score, stats = search_gradient(formula, decisions, utilities, constraints)
+    evaluator, names, coefficients, constant = _prepare_batch(formula, decisions, utilities)
+
+    # Assign the decisions with the largest effect on the score (at the initial solution) first.
+    current = numpy.array([[choices[n] for n in names]], dtype=float)
+    value, d_value, evidence, d_evidence = evaluator.gradient(current, coefficients, names)
+    stats['eval'] += 1
+    order = numpy.argsort(-numpy.abs(d_value[0] * evidence[0] - value[0] * d_evidence[0]),
+                          kind='mergesort')
+
+    def upper_bound(assignments, free):
+        lower, upper = evaluator.bounds(assignments, free, names)
+        stats['eval'] += 1
+        return constant + numpy.where(coefficients > 0, coefficients * upper,
+                                      coefficients * lower).sum(axis=1)
+
+    best = current[0]
+    stack = [(0, numpy.zeros(len(names)), numpy.inf)]
+    while stack:
+        depth, assignment, bound = stack.pop()
+        if bound <= best_score + _EPSILON * (1.0 + abs(best_score)):
+            continue
+        if depth == len(names):
+            score = constant + float(evaluator.evaluate(assignment[None, :], names)[0].dot(
+                coefficients))
+            stats['eval'] += 1
+            if score > best_score:
+                best_score = score
+                best = assignment
+                logging.getLogger('dtproblog').debug('Improvement: %s -> %s'
+                                                     % (assignment, best_score))
+            continue
+        children = numpy.repeat(assignment[None, :], 2, axis=0)
+        children[1, order[depth]] = 1.0
+        bounds = upper_bound(children, [names[i] for i in order[depth + 1:]])
+        # Explore the most promising branch first.
+        for i in numpy.argsort(bounds, kind='mergesort'):
+            stack.append((depth + 1, children[i], bounds[i]))
+
+    for name, value in zip(names, best):
+        choices[name] = int(value)
+    return choices, best_score, stats
+
+
+_EPSILON = 1e-9
+
+
+def _prepare_batch(formula, decisions, utilities):
+    """Prepare the batch evaluation of the expected utility of strategies.
+
+    The expected utility is ``constant + sum(coefficients * P(queries))`` (see :func:`evaluate`).
+
+    :return: tuple (batch evaluator, decision names in the circuit, coefficients, constant)
+    """
+    names = [name for ident, name in decisions]
+    evaluator = formula.get_batch_evaluator(weights=dict((n, 0.0) for n in names))
+    facts = set(evaluator.facts)
+    names = [n for n in names if n in facts]
+
+    coefficients = []
+    constant = 0.0
+    for r in evaluator.queries:
+        vpos = float(utilities.get(r, 0.0))
+        vneg = float(utilities.get(-r, 0.0))
+        coefficients.append(vpos - vneg)
+        constant += vneg
+    return evaluator, names, numpy.array(coefficients), constant
+
+
 def num2bits(n, nbits):
     bits = [False] * nbits
     for i in range(1, nbits + 1):
@@ -314,7 +479,10 @@ def argparser():
     parser.add_argument('--knowledge', '-k', dest='koption',
                         choices=get_evaluatables(),
                         default=None, help="Knowledge compilation tool.")
-    parser.add_argument('-s', '--search', choices=('local', 'exhaustive'), default='exhaustive')
+    parser.add_argument('-s', '--search', choices=('local', 'exhaustive', 'gradient', 'bnb'),
+                        default='exhaustive',
+                        help='search strategy (gradient: local search using circuit derivatives, '
+                             'bnb: exhaustive search with branch-and-bound)')
     parser.add_argument('-v', '--verbose', action='count', help='Set verbosity level')
     parser.add_argument('-o', '--output', type=str, default=None,
                         help='Write output to given file (default: write to stdout)')
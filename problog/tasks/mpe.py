@@ -34,6 +34,9 @@ from problog.evaluator import Semiring, OperationNotSupported, SemiringProbabili
 from problog.logic import Term
 from problog.util import init_logger, Timer
 
+# Knowledge compilation methods that can be used as solver (see mpe_circuit).
+CIRCUIT_SOLVERS = ('ddnnf', 'sdd')
+
 
 def main(argv):
     args = argparser().parse_args(argv)
@@ -150,7 +153,12 @@ def main_mpe_maxsat(args):
 
             dag = LogicDAG.createFrom(pl, avoid_name_clash=True, label_all=True, labels=[('output', 1)])
 
-            prob, output_facts = mpe_maxsat(dag, verbose=args.verbose, solver=args.solver, minpe=args.minpe)
+            if args.solver in CIRCUIT_SOLVERS:
+                prob, output_facts = mpe_circuit(dag, verbose=args.verbose, solver=args.solver,
+                                                 minpe=args.minpe)
+            else:
+                prob, output_facts = mpe_maxsat(dag, verbose=args.verbose, solver=args.solver,
+                                                minpe=args.minpe)
 
             result_handler((True, (prob, output_facts)), outf)
         except Exception as err:
@@ -209,6 +217,48 @@ def mpe_maxsat(dag, verbose=0, solver=None, minpe=False):
     return prob, output_facts
 
 
+def mpe_circuit(dag, verbose=0, solver='ddnnf', minpe=False):
+    """Compute the most probable explanation with a max-product pass over a compiled circuit.
+
+    :param dag: ground program
+    :type dag: LogicDAG
+    :param verbose: verbosity level
+    :param solver: knowledge compilation method that produces a deterministic and decomposable \
+    circuit (see :data:`CIRCUIT_SOLVERS`)
+    :param minpe: compute the least probable explanation instead
+    :return: probability of the explanation and the output facts (None if the evidence is \
+    impossible)
+    """
+    logger = init_logger(verbose)
+    logger.info('Ground program size: %s' % len(dag))
+
+    with Timer('Compilation'):
+        kc = get_evaluatable(solver).create_from(dag)
+    with Timer('Max-product'):
+        prob, literals = kc.get_batch_evaluator().mpe(minimize=minpe)[0]
+    if literals is None:
+        return prob, None
+
+    queries = list(dag.labeled())
+    if not queries:
+        return prob, literals
+
+    facts = []
+    for lit in literals:
+        if lit.is_negated():
+            facts.append(-dag.get_node_by_name(-lit))
+        else:
+            facts.append(dag.get_node_by_name(lit))
+    values = reduce_formula(dag, facts)
+    output_facts = []
+    for qn, qi, ql in queries:
+        if qi == dag.TRUE or qi is not None and values[abs(qi) - 1] == (qi > 0):
+            output_facts.append(qn)
+        else:
+            output_facts.append(-qn)
+    return prob, output_facts
+
+
 def print_result(result, output=sys.stdout):
     success, result = result
     if success:
@@ -262,9 +312,20 @@ def reduce_formula(formula, facts):
         else:
             values[-f - 1] = False
 
+    def child_value(c):
+        if c == 0:
+            return True
+        elif c is None:
+            return False
+        value = values[abs(c) - 1]
+        if value is None or c > 0:
+            return value
+        return not value
+
     from collections import deque
     nodes = deque(range(1, len(formula) + 1))
-    while nodes:
+    waiting = 0     # number of nodes pushed back since the last update
+    while nodes and waiting <= len(nodes):
         index = nodes.popleft()
         value = values[index - 1]
         if value is None:
@@ -273,13 +334,15 @@ def reduce_formula(formula, facts):
             if nodetype == 'atom':
                 pass  # Really shouldn't happen
             else:
-                children = [values[c] if c > 0 else not values[-c] for c in node.children]
+                children = [child_value(c) for c in node.children]
                 if nodetype == 'disj':
                     if True in children:
                         values[index - 1] = True
                     elif None in children:
                         # not ready yet, push it back on the queue
                         nodes.append(index)
+                        waiting += 1
+                        continue
                     else:
                         values[index - 1] = False
                 else:
@@ -287,8 +350,11 @@ def reduce_formula(formula, facts):
                         values[index - 1] = False
                     elif None in children:
                         nodes.append(index)
+                        waiting += 1
+                        continue
                     else:
                         values[index - 1] = True
+                waiting = 0
     return values
 
 
@@ -355,8 +421,10 @@ def argparser():
 
     parser = argparse.ArgumentParser()
     parser.add_argument('inputfile')
-    parser.add_argument('--solver', choices=get_available_solvers(),
-                        default=None, help="MaxSAT solver to use")
+    parser.add_argument('--solver', choices=get_available_solvers() + list(CIRCUIT_SOLVERS),
+                        default=None, help="MaxSAT solver to use ('builtin' runs in-process; "
+                                           "'ddnnf' and 'sdd' use max-product on a compiled "
+                                           "circuit)")
     parser.add_argument('--full', dest='output_all', action='store_true',
                         help='Also show false atoms.')
     parser.add_argument('-o', '--output', type=str, default=None,
@@ -26,10 +26,11 @@ import traceback
 from ..program import PrologFile, SimpleProgram
 from ..engine import DefaultEngine
 from ..evaluator import SemiringLogProbability, SemiringProbability, SemiringSymbolic
+from ..circuit_cache import CircuitCache
 from .. import get_evaluatable, get_evaluatables, library_paths
 
 from ..util import Timer, start_timer, stop_timer, init_logger, format_dictionary, format_value
-from ..errors import process_error
+from ..errors import process_error, ProbLogError
 
 
 def print_result(d, output, debug=False, precision=8):
@@ -82,7 +83,8 @@ def print_result_json(d, output, precision=8):
     return 0
 
 
-def execute(filename, knowledge=None, semiring=None, combine=False, profile=False, trace=False, **kwdargs):
+def execute(filename, knowledge=None, semiring=None, combine=False, profile=False, trace=False,
+            cache_dir=None, cache_size=None, **kwdargs):
     """Run ProbLog.
 
     :param filename: input file
@@ -91,6 +93,8 @@ def execute(filename, knowledge=None, semiring=None, combine=False, profile=Fals
     :param parse_class: prolog parser to use
     :param debug: enable advanced error output
     :param engine_debug: enable engine debugging output
+    :param cache_dir: directory in which to cache compiled circuits (default: no caching)
+    :param cache_size: maximal size of the circuit cache in megabytes (default: no limit)
     :param kwdargs: additional arguments
     :return: tuple where first value indicates success, and second value contains result details
     """
@@ -107,10 +111,19 @@ def execute(filename, knowledge=None, semiring=None, combine=False, profile=Fals
                         model.source_root = filemodel.source_root
             else:
                 model = PrologFile(filename)
-            if profile or trace:
+            detailed = kwdargs.get('profile_level') is not None
+            if profile and (trace or detailed) \
+                    and kwdargs.get('profile_format') not in (None, 'text'):
+                raise ProbLogError('The %s profile format is not available with --trace or '
+                                   '--profile-level' % kwdargs.get('profile_format'))
+            if trace or profile and detailed:
                 from problog.debug import EngineTracer
                 profiler = EngineTracer(keep_trace=trace)
                 kwdargs['debugger'] = profiler
+            elif profile:
+                from problog.debug import EngineProfiler
+                profiler = EngineProfiler()
+                kwdargs['debugger'] = profiler
             else:
                 profiler = None
 
@@ -121,7 +134,13 @@ def execute(filename, knowledge=None, semiring=None, combine=False, profile=Fals
                 semiring = db_semiring
             if knowledge is None or type(knowledge) == str:
                 knowledge = get_evaluatable(knowledge, semiring=semiring)
-            formula = knowledge.create_from(db, engine=engine, database=db, **kwdargs)
+            if cache_dir:
+                if cache_size is not None:
+                    cache_size *= 1024 * 1024
+                cache = CircuitCache(cache_dir, max_size=cache_size)
+                formula = cache.create_from(knowledge, db, engine=engine, database=db, **kwdargs)
+            else:
+                formula = knowledge.create_from(db, engine=engine, database=db, **kwdargs)
             result = formula.evaluate(semiring=semiring, **kwdargs)
 
             # Update location information on result terms
@@ -133,7 +152,8 @@ def execute(filename, knowledge=None, semiring=None, combine=False, profile=Fals
                 if trace:
                     print (profiler.show_trace())
                 if profile:
-                    print (profiler.show_profile(kwdargs.get('profile_level', 0)))
+                    write_profile(profiler, kwdargs.get('profile_format'),
+                                  kwdargs.get('profile_output'), kwdargs.get('profile_level'))
         return True, result
     except KeyboardInterrupt as err:
         trace = traceback.format_exc()
@@ -149,6 +169,30 @@ def execute(filename, knowledge=None, semiring=None, combine=False, profile=Fals
         return False, err
 
 
+def write_profile(profiler, profile_format=None, filename=None, profile_level=None):
+    """Write the profile collected during grounding.
+
+    :param profiler: profiler used as debugger of the engine
+    :type profiler: problog.debug.EngineProfiler | problog.debug.EngineTracer
+    :param profile_format: 'text' (default), 'json' or 'folded' (flamegraph input); the last \
+    two require :class:`problog.debug.EngineProfiler`
+    :param filename: output file (default: stdout)
+    :param profile_level: aggregation level of the table (only for \
+    :class:`problog.debug.EngineTracer`)
+    """
+    if profile_format == 'json':
+        content = profiler.to_json()
+    elif profile_format == 'folded':
+        content = profiler.to_folded()
+    else:
+        content = profiler.show_profile(profile_level or 0)
+    if filename is None:
+        print (content)
+    else:
+        with open(filename, 'w') as f:
+            print (content, file=f)
+
+
 def argparser():
     """Create the default argument parser for ProbLog.
     :return: argument parser
@@ -193,6 +237,11 @@ def argparser():
                         default=None, help="Knowledge compilation tool.")
     parser.add_argument('--combine', help="Combine input files into single model.", action='store_true')
     parser.add_argument('--grounder', choices=['yap', 'default', 'yap_debug'], default=None)
+    parser.add_argument('--cache-dir', dest='cache_dir', default=None,
+                        help="Cache compiled circuits in this directory and reuse them when only "
+                             "weights or evidence change.")
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=None,
+                        help="Maximal size of the circuit cache in MB (default: no limit).")
 
     # Evaluation semiring
     ls_group = parser.add_mutually_exclusive_group()
@@ -220,7 +269,13 @@ def argparser():
                         help='Pass additional arguments to the cmd_args builtin.')
     parser.add_argument('--profile', action='store_true', help='output runtime profile')
     parser.add_argument('--trace', action='store_true', help='output runtime trace')
-    parser.add_argument('--profile-level', type=int, default=0)
+    parser.add_argument('--profile-level', type=int, default=None,
+                        help='output a detailed profile (0: per call, 1: per call term, 2: per '
+                             'predicate)')
+    parser.add_argument('--profile-format', choices=['text', 'json', 'folded'], default='text',
+                        help='format of the profile (folded: input for flamegraph tools)')
+    parser.add_argument('--profile-output', default=None,
+                        help='write the profile to this file (default: stdout)')
     parser.add_argument('--format', choices=['text', 'prolog'])
     parser.add_argument('-L', '--library', action='append', help='Add to ProbLog library search path')
 
@@ -240,6 +295,18 @@ def argparser():
                         help='stop anytime when bounds are within this range')
     parser.add_argument('--unbuffered', '-u', action='store_true', default=argparse.SUPPRESS,
                         help=argparse.SUPPRESS)
+    parser.add_argument('--cycle-breaking', dest='cycle_breaking', choices=['default', 'scc'],
+                        default=argparse.SUPPRESS,
+                        help='cycle breaking algorithm (scc: unfold cycles only within strongly '
+                             'connected components)')
+    parser.add_argument('--time-budget', dest='time_budget', type=float,
+                        default=argparse.SUPPRESS,
+                        help='anytime: stop refining bounds after this number of seconds')
+    parser.add_argument('--max-iterations', dest='max_iterations', type=int,
+                        default=argparse.SUPPRESS,
+                        help='anytime: stop refining bounds after this number of solver calls')
+    parser.add_argument('--processes', type=int, default=argparse.SUPPRESS,
+                        help='anytime: number of solver calls to run in parallel')
 
     # SDD garbage collection
     sdd_auto_gc_group = parser.add_mutually_exclusive_group()
@@ -46,9 +46,10 @@ from problog.program import PrologFile
 from problog.logic import Term, Constant, ArithmeticError, term2list, list2term
 from problog.engine import DefaultEngine, UnknownClause, UnknownClauseInternal
 from problog.engine_builtin import check_mode, builtin_simple
-from problog.formula import LogicFormula
+from problog.formula import LogicFormula, LogicDAG
+from problog.batch import BatchSampler
 from problog.errors import process_error, GroundingError
-from problog.util import start_timer, stop_timer, format_dictionary, init_logger
+from problog.util import start_timer, stop_timer, format_dictionary, init_logger, fork_context
 from problog.engine_unify import UnifyError, unify_value
 import random
 import math
@@ -56,6 +57,8 @@ import signal
 import time
 import traceback
 import logging
+import hashlib
+from collections import defaultdict, deque
 
 try:
     from tqdm import tqdm
@@ -65,6 +68,35 @@ except ImportError:
         def update(self, x):
             pass
 
+def _sample_poisson(l, rng=random):
+    # http://www.johndcook.com/blog/2010/06/14/generating-poisson-random-values/
+    if l >= 30:
+        c = 0.767 - 3.36 / l
+        beta = math.pi / math.sqrt(3.0 * l)
+        alpha = beta * l
+        k = math.log(c) - l - math.log(beta)
+
+        while True:
+            u = rng.random()
+            x = (alpha - math.log((1.0 - u) / u)) / beta
+            n = math.floor(x + 0.5)
+            if n < 0:
+                continue
+            v = rng.random()
+            y = alpha - beta * x
+            lhs = y + math.log(v / (1.0 + math.exp(y)) ** 2)
+            rhs = k + n * math.log(l) - math.lgamma(n + 1)
+            if lhs <= rhs:
+                return n
+    else:
+        l2 = math.exp(-l)
+        k = 1
+        p = 1
+        while p > l2:
+            k += 1
+            p *= rng.random()
+        return k - 1
+
 try:
 
     import numpy.random
@@ -76,38 +108,7 @@ try:
 except ImportError:
     numpy = None
 
-    def sample_poisson(l):
-        l = list(l)[0]
-        # http://www.johndcook.com/blog/2010/06/14/generating-poisson-random-values/
-        if l >= 30:
-            c = 0.767 - 3.36 / l
-            beta = math.pi / math.sqrt(3.0 * l)
-            alpha = beta * l
-            k = math.log(c) - l - math.log(beta)
-
-            while True:
-                u = random.random()
-                x = (alpha - math.log((1.0 - u) / u)) / beta
-                n = math.floor(x + 0.5)
-                if n < 0:
-                    continue
-                v = random.random()
-                y = alpha - beta * x
-                lhs = y + math.log(v / (1.0 + math.exp(y)) ** 2)
-                rhs = k + n * math.log(l) - math.lgamma(n + 1)
-                if lhs <= rhs:
-                    return n
-        else:
-            l2 = math.exp(-l)
-            k = 1
-            p = 1
-            while p > l2:
-                k += 1
-                p *= random.random()
-            return k - 1
-
-
-
+    sample_poisson = _sample_poisson
 
 
 class FunctionStore(object):
@@ -141,26 +142,47 @@ class FunctionStore(object):
 
 
 class SampledFormula(LogicFormula):
+    """Formula that holds a single sample of a program.
 
-    def __init__(self, **kwargs):
+    With clamped facts the sample is drawn by likelihood weighting: clamped facts are not \
+    sampled but take their given value, and ``weight`` is multiplied with the probability of \
+    that value.
+
+    :param rng: random number generator used for sampling (default: the global generator of \
+    the :mod:`random` module)
+    :type rng: random.Random
+    :param clamped: values of facts that are fixed by the evidence {identifier: bool}
+    :type clamped: dict
+    """
+
+    def __init__(self, rng=None, clamped=None, **kwargs):
         LogicFormula.__init__(self, **kwargs)
         self.facts = {}
         self.groups = {}
         self.probability = 1.0  # Try to compute
         self.values = []
+        self.clamped = clamped or {}
+        self.weight = 1.0   # Likelihood of the clamped facts
+
+        if rng is None:
+            rng = random
+            poisson = sample_poisson
+        else:
+            poisson = lambda l: _sample_poisson(l, rng)
+        self.rng = rng
 
         self.distributions = {
-            'normal': random.normalvariate,
-            'gaussian': random.normalvariate,
-            'poisson': sample_poisson,
-            'exponential': random.expovariate,
-            'beta': random.betavariate,
-            'gamma': random.gammavariate,
-            'uniform': random.uniform,
-            'triangular': random.triangular,
-            'vonmises': random.vonmisesvariate,
-            'weibull': random.weibullvariate,
-            'in_range': random.randint
+            'normal': rng.normalvariate,
+            'gaussian': rng.normalvariate,
+            'poisson': poisson,
+            'exponential': rng.expovariate,
+            'beta': rng.betavariate,
+            'gamma': rng.gammavariate,
+            'uniform': rng.uniform,
+            'triangular': rng.triangular,
+            'vonmises': rng.vonmisesvariate,
+            'weibull': rng.weibullvariate,
+            'in_range': rng.randint
         }
 
     def sample_value(self, term):
@@ -203,9 +225,13 @@ class SampledFormula(LogicFormula):
         if group is None:  # Simple fact
             if identifier not in self.facts:
                 if self._is_simple_probability(probability):
-                    p = random.random()
                     prob = float(probability)
-                    value = p < prob
+                    if identifier in self.clamped:
+                        value = self.clamped[identifier]
+                        self.weight *= prob if value else 1.0 - prob
+                    else:
+                        p = self.rng.random()
+                        value = p < prob
                     if value:
                         result_node = self.TRUE
                         self.probability *= prob
@@ -231,11 +257,17 @@ class SampledFormula(LogicFormula):
                     else:
                         r = 1.0
 
+                    clamp = self.clamped.get(identifier)
                     if r is None or r < 1e-8:
                         # r is too small or another choice was made for this origin
                         value = False
+                        if clamp:
+                            self.weight = 0.0
+                    elif clamp is not None:
+                        value = clamp
+                        self.weight *= p / r if value else 1.0 - p / r
                     else:
-                        value = (random.random() <= p / r)
+                        value = (self.rng.random() <= p / r)
                     if value:
                         self.probability *= p
                         self.groups[origin] = None   # Other choices in group are not allowed
@@ -292,7 +324,7 @@ class SampledFormula(LogicFormula):
 
     # noinspection PyUnusedLocal
     def to_string(self, db, with_facts=False, with_probability=False, oneline=False,
-                  as_evidence=False, strip_tag=False, **extra):
+                  as_evidence=False, strip_tag=False, with_weight=False, **extra):
         self.compute_probability()
 
         if as_evidence:
@@ -329,6 +361,8 @@ class SampledFormula(LogicFormula):
         lines = list(set(lines))
         if with_probability:
             lines.append('%% Probability: %.8g' % self.probability)
+        if with_weight:
+            lines.append('%% Weight: %.8g' % self.weight)
         return sep.join(lines)
 
     def to_dict(self):
@@ -473,6 +507,15 @@ def init_db(engine, model, propagate_evidence=False):
     return db, evidence_facts, ev_target
 
 
+def evidence_clamps(evidence_facts):
+    """Get the values of the facts that are fixed by the evidence.
+
+    :param evidence_facts: evidence facts (see :func:`init_db`)
+    :return: {identifier: value} (see :class:`SampledFormula`)
+    """
+    return dict((fact[0], fact[1] > 0.5) for fact in evidence_facts)
+
+
 class RateCounter(object):
 
     def __init__(self):
@@ -492,18 +535,62 @@ class RateCounter(object):
         self.rate.update(1)
 
 
-def sample(model, n=1, format='str', propagate_evidence=False, distributions=None, progress=False, **kwdargs):
+def sample(model, n=1, format='str', propagate_evidence=False, distributions=None, progress=False,
+           jobs=None, seed=None, block_size=None, weighted=False, **kwdargs):
+    """Generate samples of the queries of a model.
+
+    :param model: model
+    :param n: number of samples (0 for infinite)
+    :param format: 'str' or 'dict'
+    :param propagate_evidence: propagate evidence before sampling
+    :param distributions: additional distributions {name: function}
+    :param progress: show progress
+    :param jobs: draw samples in blocks using this number of worker processes (see \
+    :func:`sample_blocks`); the default is to sample in the current process using the global \
+    random generator
+    :param seed: seed of the blocks (only used when ``jobs`` is given)
+    :param block_size: number of samples per block (default: SAMPLE_BLOCK_SIZE)
+    :param weighted: use likelihood weighting (the weight is added to samples in 'str' format)
+    :param kwdargs: additional arguments for the engine and the output format
+    :return: generator of samples
+    """
     engine = init_engine(**kwdargs)
-    db, evidence, ev_target = init_db(engine, model, propagate_evidence)
+    clamped = None
+    if weighted:
+        db, evidence, ev_target = init_db(engine, model, propagate_evidence=True)
+        clamped = evidence_clamps(evidence)
+        evidence, ev_target = [], None
+        kwdargs['with_weight'] = True
+    else:
+        db, evidence, ev_target = init_db(engine, model, propagate_evidence)
     i = 0
     r = 0
 
     if progress:
         rate = RateCounter()
 
+    if jobs is not None:
+        blocks = sample_blocks(_sample_worker_block, n, jobs, seed, db, evidence, ev_target,
+                               block_size=block_size, format=format, distributions=distributions,
+                               clamped=clamped, **kwdargs)
+        try:
+            for samples, rejected in blocks:
+                for s in samples:
+                    yield s
+                    if progress:
+                        rate.update()
+                r += rejected
+        except KeyboardInterrupt:
+            pass
+        finally:
+            blocks.close()
+        if r:
+            logging.getLogger('problog_sample').info('Rejected samples: %s' % r)
+        return
+
     try:
         while i < n or n == 0:
-            target = SampledFormula()
+            target = SampledFormula(clamped=clamped)
             if distributions is not None:
                 target.distributions.update(distributions)
 
@@ -512,7 +599,7 @@ def sample(model, n=1, format='str', propagate_evidence=False, distributions=Non
 
             engine.functions = FunctionStore(target=target, database=db, engine=engine)
             result = ground(engine, db, target=target)
-            if verify_evidence(engine, db, ev_target, target):
+            if verify_evidence(engine, db, ev_target, target) and target.weight > 0.0:
                 if format == 'str':
                     yield result.to_string(db, **kwdargs)
                 else:
@@ -557,7 +644,7 @@ def verify_evidence(engine, db, ev_target, q_target):
                 weights[k] = p
                 weights[-k] = 1.0 - p
 
-        relevant_nodes = set([x for x, y in enumerate(ev_target.extract_relevant()) if y])
+        relevant_nodes = set(ev_target.relevant_nodes())
 
         update = True
         while relevant_nodes and update:
@@ -615,49 +702,299 @@ def verify_evidence(engine, db, ev_target, q_target):
         return True
 
 
+SAMPLE_BLOCK_SIZE = 1000
+
+
+def block_random(seed, block):
+    """Create the random generator of a block of samples.
+
+    The generator only depends on the seed and the index of the block, such that the samples \
+    are the same regardless of the number of processes that draw them.
+
+    :param seed: global seed
+    :param block: index of the block
+    :return: random number generator
+    :rtype: random.Random
+    """
+    digest = hashlib.sha1(('%r:%d' % (seed, block)).encode('utf-8')).hexdigest()
+    return random.Random(int(digest, 16))
+
+
+def sample_block(engine, db, evidence, ev_target, rng, size, format='str', distributions=None,
+                 clamped=None, **kwdargs):
+    """Draw a block of samples that satisfy the evidence.
+
+    The block starts without a previous sample (see ``previous/2``).
+
+    :param engine: engine (see :func:`init_engine`)
+    :param db: prepared program
+    :param evidence: evidence facts (see :func:`init_db`)
+    :param ev_target: ground evidence (see :func:`init_db`)
+    :param rng: random number generator
+    :param size: number of samples to draw
+    :param format: 'str', 'dict' or None for the sampled formulae
+    :param distributions: additional distributions {name: function}
+    :param clamped: facts fixed by the evidence for likelihood weighting (see \
+    :class:`SampledFormula`)
+    :param kwdargs: additional arguments for the output format
+    :return: tuple (samples, number of rejected samples)
+    """
+    samples = []
+    rejected = 0
+    engine.previous_result = None
+    while len(samples) < size:
+        target = SampledFormula(rng=rng, clamped=clamped)
+        if distributions is not None:
+            target.distributions.update(distributions)
+
+        for ev_fact in evidence:
+            target.add_atom(*ev_fact)
+
+        engine.functions = FunctionStore(target=target, database=db, engine=engine)
+        result = ground(engine, db, target=target)
+        if verify_evidence(engine, db, ev_target, target) and target.weight > 0.0:
+            if format == 'str':
+                samples.append(result.to_string(db, **kwdargs))
+            elif format == 'dict':
+                samples.append(result.to_dict())
+            else:
+                samples.append(result)
+        else:
+            rejected += 1
+        engine.previous_result = result
+    return samples, rejected
+
+
+def sample_blocks(function, n, processes, seed, db, evidence, ev_target, block_size=None,
+                  **kwdargs):
+    """Draw samples in blocks in a pool of worker processes.
+
+    Each block of samples uses its own random generator (see :func:`block_random`).
+    The workers are forked, such that they inherit the prepared program, which can not be \
+    pickled (see :func:`problog.util.fork_context`).
+    Where this is not available, the blocks are drawn in the current process.
+    At most two blocks per worker are scheduled ahead of the consumer.
+
+    :param function: function executed in the worker for each block, called with the block \
+    index and the block size
+    :param n: total number of samples (0 for infinite)
+    :param processes: number of worker processes
+    :param seed: global seed (default: random)
+    :param db: prepared program
+    :param evidence: evidence facts (see :func:`init_db`)
+    :param ev_target: ground evidence (see :func:`init_db`)
+    :param block_size: number of samples per block (default: SAMPLE_BLOCK_SIZE)
+    :param kwdargs: additional arguments for :func:`init_engine` and :func:`sample_block`
+    :return: generator of the results of function, in the order of the blocks
+    """
+    if block_size is None:
+        block_size = SAMPLE_BLOCK_SIZE
+    if seed is None:
+        seed = random.random()
+    context = fork_context()
+    if context is None:
+        logging.getLogger('problog_sample').warning('Worker processes are not available on this '
+                                                    'platform: sampling in the current process.')
+        _set_worker_state(seed, db, evidence, ev_target, kwdargs)
+        block = 0
+        remaining = n
+        while n == 0 or remaining > 0:
+            size = block_size if n == 0 else min(block_size, remaining)
+            yield function(block, size)
+            remaining -= size
+            block += 1
+        return
+
+    pool = context.Pool(processes, _init_sample_worker, (seed, db, evidence, ev_target, kwdargs))
+    try:
+        pending = deque()
+        block = 0
+        remaining = n
+        while True:
+            while len(pending) < 2 * processes and (n == 0 or remaining > 0):
+                size = block_size if n == 0 else min(block_size, remaining)
+                pending.append(pool.apply_async(function, (block, size)))
+                remaining -= size
+                block += 1
+            if not pending:
+                break
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+_worker_state = None
+
+
+def _init_sample_worker(seed, db, evidence, ev_target, kwdargs):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _set_worker_state(seed, db, evidence, ev_target, kwdargs)
+
+
+def _set_worker_state(seed, db, evidence, ev_target, kwdargs):
+    global _worker_state
+    engine = init_engine(**kwdargs)
+    _worker_state = seed, engine, db, evidence, ev_target, kwdargs
+
+
+def _sample_worker_block(block, size):
+    seed, engine, db, evidence, ev_target, kwdargs = _worker_state
+    return sample_block(engine, db, evidence, ev_target, block_random(seed, block), size,
+                        **kwdargs)
+
+
+def _estimate_worker_block(block, size):
+    seed, engine, db, evidence, ev_target, kwdargs = _worker_state
+    samples, rejected = sample_block(engine, db, evidence, ev_target, block_random(seed, block),
+                                     size, format=None, clamped=kwdargs.get('clamped'))
+    estimates = defaultdict(float)
+    total = 0.0
+    squares = 0.0
+    for result in samples:
+        w = result.weight
+        for k, v in result.queries():
+            if v == 0:
+                estimates[k] += w
+        total += w
+        squares += w * w
+    return dict(estimates), len(samples), total, squares, rejected
+
+
 # noinspection PyUnusedLocal
-def estimate(model, n=0, propagate_evidence=False, **kwdargs):
-    from collections import defaultdict
+def estimate(model, n=0, propagate_evidence=False, jobs=None, seed=None, block_size=None,
+             weighted=False, vectorized=False, **kwdargs):
+    """Estimate the probabilities of the queries of a model.
+
+    With likelihood weighting, evidence on probabilistic facts (and facts that are fixed by \
+    propagating the evidence) is not sampled but clamped, and each sample is weighted by the \
+    likelihood of the clamped facts.
+    Only samples that violate the remaining evidence are rejected.
+    The effective sample size of the weighted samples is reported.
+
+    :param model: model
+    :param n: number of accepted samples (0 for sampling until interrupted)
+    :param propagate_evidence: propagate evidence before sampling
+    :param jobs: draw samples in blocks using this number of worker processes (see \
+    :func:`sample_blocks`)
+    :param seed: seed of the blocks (only used when ``jobs`` is given)
+    :param block_size: number of samples per block (default: SAMPLE_BLOCK_SIZE)
+    :param weighted: use likelihood weighting instead of rejecting samples on all evidence
+    :param vectorized: ground the program once and sample it with :class:`BatchSampler` \
+    (``jobs`` and ``weighted`` are ignored)
+    :param kwdargs: additional arguments for the engine
+    :return: estimated probabilities {query: probability}
+    """
+    if vectorized:
+        return estimate_vectorized(model, n, seed=seed, **kwdargs)
 
     engine = init_engine(**kwdargs)
-    db, evidence, ev_target = init_db(engine, model, propagate_evidence)
+    clamped = None
+    if weighted:
+        db, evidence, ev_target = init_db(engine, model, propagate_evidence=True)
+        clamped = evidence_clamps(evidence)
+        evidence, ev_target = [], None
+    else:
+        db, evidence, ev_target = init_db(engine, model, propagate_evidence)
 
     start_time = time.time()
     estimates = defaultdict(float)
     counts = 0.0
+    total = 0.0     # Sum of the weights
+    squares = 0.0   # Sum of the squared weights
     r = 0
+    blocks = None
     try:
-        while n == 0 or counts < n:
-            target = SampledFormula()
-            for ev_fact in evidence:
-                target.add_atom(*ev_fact)
-
-            result = ground(engine, db, target=target)
-            if verify_evidence(engine, db, ev_target, target):
-                for k, v in result.queries():
-                    if v == 0:
-                        estimates[k] += 1.0
-                counts += 1.0
-            else:
-                r += 1
-            engine.previous_result = result
+        if jobs is not None:
+            blocks = sample_blocks(_estimate_worker_block, n, jobs, seed, db, evidence, ev_target,
+                                   block_size=block_size, clamped=clamped, **kwdargs)
+            for block_estimates, accepted, weights, weights2, rejected in blocks:
+                for k, v in block_estimates.items():
+                    estimates[k] += v
+                counts += accepted
+                total += weights
+                squares += weights2
+                r += rejected
+        else:
+            while n == 0 or counts < n:
+                target = SampledFormula(clamped=clamped)
+                for ev_fact in evidence:
+                    target.add_atom(*ev_fact)
+
+                result = ground(engine, db, target=target)
+                if verify_evidence(engine, db, ev_target, target) and target.weight > 0.0:
+                    w = target.weight
+                    for k, v in result.queries():
+                        if v == 0:
+                            estimates[k] += w
+                    counts += 1.0
+                    total += w
+                    squares += w * w
+                else:
+                    r += 1
+                engine.previous_result = result
     except KeyboardInterrupt:
         pass
     except SystemExit:
         pass
+    finally:
+        if blocks is not None:
+            blocks.close()
 
     total_time = time.time() - start_time
     rate = counts / total_time
-    print ('%% Probability estimate after %d samples (%.4f samples/second):' % (counts, rate))
+    if weighted:
+        ess = total * total / squares if squares > 0.0 else 0.0
+        print ('%% Probability estimate after %d samples (%.4f samples/second, '
+               'effective sample size %.1f):' % (counts, rate, ess))
+    else:
+        print ('%% Probability estimate after %d samples (%.4f samples/second):' % (counts, rate))
 
     if r:
         logging.getLogger('problog_sample').info('Rejected samples: %s' % r)
 
     for k in estimates:
-        estimates[k] = estimates[k] / counts
+        estimates[k] = estimates[k] / total
     return estimates
 
 
+def estimate_vectorized(model, n=0, seed=None, **kwdargs):
+    """Estimate the probabilities of the queries of a model by sampling a fixed ground program.
+
+    The model is grounded once (with evidence propagation) and sampled in batches with \
+    :class:`problog.batch.BatchSampler`.
+    All probabilities in the model must be numbers.
+
+    :param model: model
+    :param n: number of accepted samples (0 for sampling until interrupted)
+    :param seed: seed of the random generator
+    :param kwdargs: additional arguments for grounding
+    :return: estimated probabilities {query: probability}
+    """
+    kwdargs['propagate_evidence'] = True
+    formula = LogicDAG.create_from(model, **kwdargs)
+    if seed is not None:
+        seed = int(hashlib.sha1(('%r' % seed).encode('utf-8')).hexdigest(), 16) % (1 << 32)
+    sampler = BatchSampler(formula, seed=seed)
+
+    start_time = time.time()
+    try:
+        while n == 0 or sampler.accepted < n:
+            sampler.sample(sampler.batch_size if n == 0 else n - sampler.accepted)
+    except KeyboardInterrupt:
+        pass
+    except SystemExit:
+        pass
+
+    total_time = time.time() - start_time
+    rate = (sampler.accepted + sampler.rejected) / total_time
+    print ('%% Probability estimate after %d samples (%.4f samples/second):'
+           % (sampler.accepted, rate))
+    if sampler.rejected:
+        logging.getLogger('problog_sample').info('Rejected samples: %s' % sampler.rejected)
+    return sampler.estimate()
+
+
 def print_result(result, output=sys.stdout, oneline=False):
     success, result = result
     if success:
@@ -727,6 +1064,17 @@ def main(args, result_handler=None):
     parser.add_argument('-a', '--arg', dest='args', action='append',
                         help='Pass additional arguments to the cmd_args builtin.')
     parser.add_argument('--progress', help='show progress', action='store_true')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None,
+                        help='Sample in blocks using this number of worker processes; '
+                             'results only depend on the seed, not on the number of workers.')
+    parser.add_argument('--likelihood-weighting', '-W', dest='weighted', action='store_true',
+                        help='Clamp evidence on probabilistic facts and weight the samples '
+                             'instead of rejecting them.')
+    parser.add_argument('--vectorized', action='store_true',
+                        help='Ground once and estimate with bit-parallel NumPy sampling '
+                             '(with --estimate; requires numeric probabilities).')
+    parser.add_argument('--block-size', dest='block_size', type=int, default=None,
+                        help='Number of samples per block (default: %d).' % SAMPLE_BLOCK_SIZE)
 
 
     args = parser.parse_args(args)
@@ -739,6 +1087,7 @@ def main(args, result_handler=None):
         seed = random.random()
         logging.getLogger('problog_sample').debug('Seed: %s', seed)
         random.seed(seed)
+        args.seed = seed
 
     pl = PrologFile(args.filename)
 
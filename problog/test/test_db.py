@@ -0,0 +1,83 @@
+"""
+Part of the ProbLog distribution.
+
+Copyright 2015 KU Leuven, DTAI Research Group
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import print_function
+
+import sqlite3
+import unittest
+
+from problog import root_path, get_evaluatable
+from problog.library.db import QueryFunc
+from problog.logic import Term, Constant
+from problog.program import PrologString
+
+
+class TestQueryFunc(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('CREATE TABLE friend_of(name1 TEXT, name2 TEXT, probability REAL);')
+        self.conn.executemany('INSERT INTO friend_of VALUES (?, ?, ?);',
+                              [('ann', 'bob', 0.2), ('ann', 'carl', 0.4), ('bob', 'carl', 0.5)])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_query(self):
+        """Calls are translated to queries on the bound columns, with indexes on demand."""
+        func = QueryFunc(self.conn, 'friend_of', ['name1', 'name2', 'probability'],
+                         auto_index=True)
+        self.assertEqual([(Term('ann'), Term('carl'), Constant(0.4)),
+                          (Term('bob'), Term('carl'), Constant(0.5))],
+                         sorted(func(None, Term('carl'), None), key=str))
+        self.assertEqual(3, len(func(None, None, None)))
+        self.assertEqual([], func(Term('ann'), None, Constant(0.5)))
+
+        indexes = [r[0] for r in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='index';")]
+        self.assertEqual(['idx_friend_of_name1_probability', 'idx_friend_of_name2'],
+                         sorted(indexes))
+
+        # Results are cached: the table should not change during inference.
+        self.conn.execute("DELETE FROM friend_of WHERE name1 = 'bob';")
+        self.assertEqual(2, len(func(None, Term('carl'), None)))
+
+
+class TestLoad(unittest.TestCase):
+
+    program = """
+        :- use_module(library(db)).
+        %s
+        P :: influences(X, Y) :- friend_of(X, Y, P).
+        0.3::smokes(X) :- person(X).
+        smokes(X) :- influences(Y,X), smokes(Y).
+        query(smokes(bob)).
+    """
+
+    def _evaluate(self, load):
+        program = PrologString(self.program % load)
+        return get_evaluatable().create_from(program).evaluate()[Term('smokes', Term('bob'))]
+
+    def test_facts(self):
+        """Loading the rows as facts gives the same results as querying the tables."""
+        csv = ":- csv_load('%s', person%%s). :- csv_load('%s', friend_of%%s)." \
+            % (root_path('test', 'smokers_person.csv'), root_path('test', 'smokers_friend_of.csv'))
+        sqlite = ":- sqlite_load('%s'%%s)." % root_path('test', 'smokers.sqlite')
+        for load in (csv, sqlite):
+            for options in ('', ', [facts]'):
+                self.assertAlmostEqual(0.62021313744,
+                                       self._evaluate(load % ((options,) * load.count('%s'))))
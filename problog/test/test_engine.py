@@ -107,6 +107,125 @@ class TestEngine(unittest.TestCase):
         self.assertCollectionEqual( r3, [])
 
 
+    def test_clause_index(self):
+        """Indexed lookup of facts"""
+
+        program = '\n'.join('f(%s, %s).' % (i, i % 5) for i in range(0, 50)) + """
+            f(X, 3) :- X = a.
+            f(b, Y) :- Y = 7.
+        """
+
+        engine = DefaultEngine()
+        db = engine.prepare(PrologString(program))
+
+        first = engine.query(db, Term('f', Constant(12), None))
+        self.assertCollectionEqual([tuple(map(str, r)) for r in first], [('12', '2')])
+
+        second = engine.query(db, Term('f', None, Constant(3)))
+        self.assertEqual([tuple(map(str, r)) for r in second],
+                         [(str(i), '3') for i in range(3, 50, 5)] + [('a', '3')])
+
+        both = engine.query(db, Term('f', Term('b'), Constant(7)))
+        self.assertEqual([tuple(map(str, r)) for r in both], [('b', '7')])
+
+        stats = db.get_index_statistics()['f/2']
+        self.assertCollectionEqual(stats['indexes'].keys(), [(0,), (1,), (0, 1)])
+        self.assertEqual(stats['scans'], 0)
+
+
+    def test_bounded_cache(self):
+        """Evaluation with a bounded table"""
+
+        program = '\n'.join('0.5::e(%s, %s).' % (i, i + 1) for i in range(0, 30)) + """
+            p(X, Y) :- e(X, Y).
+            p(X, Y) :- e(X, Z), p(Z, Y).
+        """
+
+        expected = DefaultEngine().ground(PrologString(program), Term('p', Constant(0), None),
+                                          label='query')
+        expected = sorted(str(q) for q, n in expected.queries())
+
+        for policy in ('lru', 'lfu'):
+            engine = DefaultEngine(cache_max_entries=5, cache_policy=policy)
+            result = engine.ground(engine.prepare(PrologString(program)),
+                                   Term('p', Constant(0), None), label='query')
+            self.assertEqual(sorted(str(q) for q, n in result.queries()), expected)
+
+            stats = result._cache.get_statistics()
+            self.assertLessEqual(stats['entries'], 5)
+            self.assertGreater(stats['evictions'], 0)
+
+    def test_cache_delete(self):
+        """Deleted tables no longer count towards the bounds of the table."""
+        from problog.engine_stack import DefineCache
+
+        goals = [('p', (Constant(i),)) for i in range(3)]
+        for max_entries in (None, 2):
+            cache = DefineCache(set(), max_entries=max_entries)
+            cache[goals[0]] = {goals[0][1]: 0}
+            cache[goals[1]] = {goals[1][1]: 0}
+            del cache[goals[0]]
+            cache[goals[2]] = {goals[2][1]: 0}
+            stats = cache.get_statistics()
+            self.assertEqual((stats['entries'], stats['evictions']), (2, 0))
+            self.assertEqual(stats['size'], 2 * (cache.TABLE_SIZE + cache.RESULT_SIZE))
+            self.assertTrue(goals[1] in cache)
+            self.assertFalse(goals[0] in cache)
+
+    def test_persistent_tables(self):
+        """Reuse of tables between queries"""
+
+        program = """
+            e(1, 2). 0.5::e(2, 3).
+            p(X, Y) :- e(X, Y).
+            p(X, Y) :- e(X, Z), p(Z, Y).
+        """
+
+        engine = DefaultEngine(persistent_tables=True)
+        db = engine.prepare(PrologString(program))
+
+        first = engine.query(db, Term('p', Constant(1), None))
+        hits = engine._get_query_target(db)._cache.hits
+        second = engine.query(db, Term('p', Constant(1), None))
+        self.assertEqual(first, second)
+        self.assertGreater(engine._get_query_target(db)._cache.hits, hits)
+
+        db.add_fact(Term('e', Constant(3), Constant(4)))
+        third = engine.query(db, Term('p', Constant(1), None))
+        self.assertEqual(len(third), 3)
+
+        # The ground program is started over when it exceeds the given number of nodes.
+        engine.persistent_max_nodes = 0
+        target = engine._get_query_target(db)
+        engine.query(db, Term('p', Constant(2), None))
+        self.assertIsNot(engine._get_query_target(db), target)
+
+
+    def test_profiler(self):
+        """Profile statistics per predicate"""
+        from problog.debug import EngineProfiler
+
+        program = """
+            e(1, 2). e(2, 3). e(1, 3).
+            p(X, Y) :- e(X, Y).
+            p(X, Y) :- e(X, Z), p(Z, Y).
+            q :- p(1, 3), p(1, 3).
+            query(q).
+        """
+
+        profiler = EngineProfiler(capacity=4)
+        engine = DefaultEngine(debugger=profiler)
+        engine.ground_all(engine.prepare(PrologString(program)))
+
+        stats = dict((s['predicate'], s) for s in profiler.get_statistics())
+        self.assertEqual(stats['q/0']['calls'], 1)
+        self.assertEqual(stats['p/2']['answers'], 3)
+        self.assertGreater(stats['p/2']['cache_hits'], 0)
+        self.assertGreaterEqual(stats['q/0']['inclusive'], stats['p/2']['inclusive'])
+        stacks = [line.rsplit(' ', 1)[0] for line in profiler.to_folded().strip().split('\n')]
+        self.assertIn('q/0;p/2;e/2', stacks)
+
+
 class TestEngineCycles(unittest.TestCase):
 
     def setUp(self) :
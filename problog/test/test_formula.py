@@ -0,0 +1,659 @@
+"""
+Part of the ProbLog distribution.
+
+Copyright 2015 KU Leuven, DTAI Research Group
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import print_function
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from problog.program import PrologString
+from problog.formula import LogicFormula, LogicDAG, LogicNNF, CompactNodeStore, atom, conj, disj
+from problog.cnf_formula import CNF
+from problog.ddnnf_formula import DDNNF
+from problog.bdd_formula import BDD
+from problog.sdd_formula import SDD, SDDManager
+from problog.circuit_cache import CircuitCache, MemoryCircuitCache
+from problog.evaluator import Semiring, SemiringProbability
+from problog.batch import BatchEvaluator, BatchSampler
+from problog.kbest import KBestFormula
+from problog.maxsat import get_available_solvers, BranchAndBoundSolver
+from problog.tasks.mpe import mpe_maxsat, mpe_circuit
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from problog.logic import Term
+from problog.util import Bitset
+
+
+class TestCompactNodeStore(unittest.TestCase):
+
+    program = """
+        0.3::edge(a, b). 0.4::edge(b, c). 0.5::edge(c, a). 0.6::edge(b, d).
+        path(X, Y) :- edge(X, Y).
+        path(X, Y) :- edge(X, Z), path(Z, Y).
+        query(path(a, d)).
+        query(path(c, c)).
+    """
+
+    def test_store_operations(self):
+        """Node tuples are preserved by the compact store."""
+        store = CompactNodeStore()
+        store.append(atom(1, 0.3, None, Term('a'), None))
+        store.append(conj((1, -1), None))
+        store.append(disj((2,), Term('b')))
+
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store[0], atom(1, 0.3, None, Term('a'), None))
+        self.assertEqual(store[1], conj((1, -1), None))
+        self.assertEqual(store[-1], disj((2,), Term('b')))
+
+        for i in range(3, 100):
+            store[2] = disj(store[2].children + (i,), Term('b'))
+        self.assertEqual(store[2].children, (2,) + tuple(range(3, 100)))
+        self.assertEqual(store[1], conj((1, -1), None))
+
+        store[1] = conj((None, 0), None)
+        self.assertEqual(store[1].children, (None, 0))
+        self.assertEqual(list(store)[0].probability, 0.3)
+
+    def test_ground_equivalence(self):
+        """Grounding with a compact store produces the same formula."""
+        default = LogicFormula.create_from(PrologString(self.program))
+        compact = LogicFormula.create_from(PrologString(self.program), compact_nodes=True)
+
+        self.assertIsInstance(compact._nodes, CompactNodeStore)
+        self.assertEqual(list(default), list(compact))
+        self.assertEqual(str(default), str(compact))
+
+    def test_cycles_and_cnf(self):
+        """Cycle breaking and CNF conversion work on a compact store."""
+        default = LogicDAG.create_from(PrologString(self.program))
+        compact = LogicDAG.create_from(PrologString(self.program), compact_nodes=True)
+
+        self.assertIsInstance(compact._nodes, CompactNodeStore)
+        self.assertEqual(list(default), list(compact))
+        self.assertEqual(CNF.create_from(default).to_dimacs(), CNF.create_from(compact).to_dimacs())
+
+    def test_relevant(self):
+        """The relevant nodes are the same for both stores and match a node-by-node traversal."""
+        default = LogicFormula.create_from(PrologString(self.program), keep_all=True)
+        compact = LogicFormula.create_from(PrologString(self.program), keep_all=True,
+                                           compact_nodes=True)
+        roots = [default.get_node_by_name(Term('path', Term('c'), Term('c')))]
+        expected = sorted(default._relevant_python(roots)[1])
+        self.assertLess(len(expected), len(default))
+        self.assertEqual(list(default.relevant_nodes(roots)), expected)
+        self.assertEqual(list(compact.relevant_nodes(roots)), expected)
+        self.assertEqual([i for i, r in enumerate(default.extract_relevant(roots)) if r], expected)
+
+
+class TestCycleBreaking(unittest.TestCase):
+
+    program = """
+        0.3::e(1, 2). 0.4::e(2, 1). 0.5::e(2, 3). 0.6::e(3, 2). 0.7::e(3, 4). 0.2::e(4, 1).
+        0.8::e(4, 5). 0.1::e(5, 5). 0.9::e(1, 5).
+        p(X, Y) :- e(X, Y).
+        p(X, Y) :- e(X, Z), p(Z, Y).
+        query(p(1, 5)). query(p(2, 4)). query(p(5, 5)). query(p(3, 1)).
+        evidence(p(4, 2)).
+    """
+
+    def test_equivalence(self):
+        """SCC-based cycle breaking gives the same probabilities as recursive unfolding."""
+        formula = LogicFormula.create_from(PrologString(self.program))
+        default = LogicDAG.create_from(formula)
+        scc = LogicDAG.create_from(formula, cycle_breaking='scc')
+        expected = DDNNF.create_from(default).evaluate()
+        result = DDNNF.create_from(scc).evaluate()
+        self.assertEqual(len(result), 4)
+        for name, value in expected.items():
+            self.assertAlmostEqual(result[name], value)
+
+    def test_deep(self):
+        """Deep formulas do not exceed the recursion limit."""
+        formula = LogicFormula()
+        previous = formula.add_atom(1, 0.5)
+        for i in range(2, 5000):
+            current = formula.add_or((formula.add_atom(i, 0.5), previous), compact=False)
+            previous = current
+        formula.add_query(Term('q'), previous)
+        dag = LogicDAG.create_from(formula, cycle_breaking='scc')
+        self.assertEqual(len(dag), len(formula))
+
+
+class TestBitset(unittest.TestCase):
+
+    def test_operations(self):
+        """Bulk operations and conversions of bitsets."""
+        a = Bitset.from_indices([1, 5, 64, 200])
+        b = Bitset.from_mask([i % 5 == 0 for i in range(100)])
+        self.assertEqual(list(a), [1, 5, 64, 200])
+        self.assertEqual(list(a & b), [5])
+        self.assertEqual(len(a | b), 23)
+        self.assertEqual(list(a - b), [1, 64, 200])
+        self.assertTrue(64 in a)
+        self.assertFalse(65 in a)
+        self.assertEqual(a.to_list(7), [False, True, False, False, False, True, False])
+        a.discard(200)
+        a.add(3)
+        self.assertEqual(list(a.iter_set_bits()), [1, 3, 5, 64])
+        self.assertFalse(Bitset())
+
+
+class TestHashConsing(unittest.TestCase):
+
+    def test_reuse(self):
+        """Structurally equal compound nodes are shared."""
+        formula = LogicFormula()
+        a = formula.add_atom(1, 0.1)
+        b = formula.add_atom(2, 0.2)
+        c = formula.add_atom(3, 0.3)
+        ab = formula.add_and((a, b))
+        self.assertEqual(formula.add_and((b, a)), ab)
+        self.assertNotEqual(formula.add_or((a, b)), ab)
+        self.assertNotEqual(formula.add_and((a, c)), ab)
+        self.assertEqual(len(formula), 6)
+
+    def test_collision(self):
+        """Nodes with colliding hashes are told apart by their children."""
+        formula = LogicFormula()
+        a = formula.add_atom(1, 0.1)
+        b = formula.add_atom(2, 0.2)
+        ab = formula.add_and((a, b), compact=False)
+        formula._index_compound(formula._index_conj, 42, ab)
+        self.assertIsNone(formula._find_compound(formula._index_conj, 42, (a, -b)))
+        abn = formula._add(conj((a, -b), None), reuse=False)
+        formula._index_compound(formula._index_conj, 42, abn)
+        self.assertEqual(formula._find_compound(formula._index_conj, 42, (a, -b)), abn)
+        self.assertEqual(formula._find_compound(formula._index_conj, 42, (a, b)), ab)
+
+    def test_add_disjunct(self):
+        """Updating an indexed disjunction updates its index entry."""
+        formula = LogicFormula()
+        a = formula.add_atom(1, 0.1)
+        b = formula.add_atom(2, 0.2)
+        c = formula.add_atom(3, 0.3)
+        ab = formula.add_or((a, b), compact=False)
+        formula.add_disjunct(ab, c)
+        self.assertEqual(formula.add_or((a, b, c), compact=False), ab)
+        self.assertNotEqual(formula.add_or((a, b), compact=False), ab)
+
+
+class TestCircuitCache(unittest.TestCase):
+
+    program = """
+        %s::a. 0.4::b. 0.5::c; 0.2::d.
+        p :- a, c. p :- b, \\+d.
+        query(p). evidence(%s).
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _compile(self, cache, probability, evidence):
+        source = PrologString(self.program % (probability, evidence))
+        result = cache.create_from(DDNNF, source, propagate_evidence=False).evaluate()
+        expected = DDNNF.create_from(source, propagate_evidence=False).evaluate()
+        self.assertEqual(result, expected)
+
+    def test_reuse(self):
+        """Circuits are reused when only weights or evidence values change."""
+        cache = CircuitCache(self.directory)
+        self._compile(cache, 0.3, 'a')
+        self._compile(cache, 0.6, 'a')
+        self._compile(cache, 0.6, 'a, false')
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self._compile(cache, 0.6, 'b')
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    @unittest.skipIf(not SDD.is_available(), 'No SDD library available')
+    def test_execute_sdd(self):
+        """Compiled SDDs are stored and reused by the probability task."""
+        from problog.tasks.probability import execute
+
+        filename = os.path.join(self.directory, 'model.pl')
+        with open(filename, 'w') as f:
+            f.write(self.program % (0.3, 'a'))
+        cache_dir = os.path.join(self.directory, 'cache')
+        success, expected = execute(filename, knowledge='sdd')
+        self.assertTrue(success)
+        for i in range(2):
+            success, result = execute(filename, knowledge='sdd', cache_dir=cache_dir)
+            self.assertTrue(success)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            for name, value in expected.items():
+                self.assertAlmostEqual(result[name], value)
+
+    def test_eviction(self):
+        """Least recently used entries are removed when the cache is full."""
+        cache = CircuitCache(self.directory, max_size=1)
+        self._compile(cache, 0.3, 'a')
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_memory(self):
+        """The in-memory cache reuses circuits and keeps a limited number of them."""
+        cache = MemoryCircuitCache(max_entries=1)
+        self._compile(cache, 0.3, 'a')
+        self._compile(cache, 0.6, 'a, false')
+        self._compile(cache, 0.6, 'b')
+        self._compile(cache, 0.6, 'a')
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        self.assertEqual(len(cache), 1)
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not available')
+class TestBatchEvaluation(unittest.TestCase):
+
+    def test_ddnnf(self):
+        """Batch evaluation matches evaluation with overridden weights."""
+        self._check_batch(DDNNF)
+
+    @unittest.skipIf(not SDD.is_available(), 'No SDD library available')
+    def test_sdd(self):
+        """Batch evaluation of an SDD, with an annotated disjunction that is not exhaustive."""
+        self._check_batch(SDD)
+
+    def _check_batch(self, formula_class):
+        program = """
+            0.3::a. 0.4::b. 0.5::c; 0.2::d.
+            p :- a, c. p :- b, \\+d. q :- a, \\+b.
+            query(p). query(q). query(a). evidence(e, false).
+            e :- c, d. e :- b, a.
+        """
+        formula = formula_class.create_from(PrologString(program))
+        evaluator = formula.get_batch_evaluator()
+        facts = evaluator.facts
+        self.assertEqual(len(facts), 4)
+        weights = numpy.array([[0.1, 0.2, 0.3, 0.4], [0.4, 0.35, 0.25, 0.15], [0.2, 0.0, 0.0, 0.4]])
+        result = formula.evaluate_batch(weights)
+        self.assertEqual(result.shape, (3, 3))
+        for i in range(3):
+            override = dict(zip(facts, weights[i]))
+            for name, value in formula.evaluate(weights=override,
+                                                semiring=SemiringProbability()).items():
+                self.assertAlmostEqual(result[i, evaluator.queries.index(name)], value)
+
+    def test_smoothing(self):
+        """Disjunctions that don't mention the same atoms are smoothed."""
+        formula = LogicNNF()
+        a = formula.add_atom(1, 0.3)
+        b = formula.add_atom(2, 0.4)
+        root = formula.add_or((a, formula.add_and((-a, b))))
+        weights = {a: (0.3, 0.7), b: (0.4, 0.6)}
+        facts = [(Term('a'), a), (Term('b'), b)]
+        queries = [(Term('q'), root, (-b,))]
+        evaluator = BatchEvaluator(formula, {a: a, b: b}, weights, facts, [], queries, (0, ()),
+                                   smooth=True)
+        result = evaluator.evaluate([[0.3, 0.4], [0.5, 0.5]])
+        self.assertAlmostEqual(result[0, 0], 0.3 * 0.6)
+        self.assertAlmostEqual(result[1, 0], 0.5 * 0.5)
+
+    def test_gradient_and_bounds(self):
+        """The gradient matches finite differences and the bounds contain all assignments."""
+        program = """
+            0.3::a. 0.4::b. 0.5::c; 0.2::d. 0.6::f.
+            p :- a, c. p :- b, \\+d. q :- a, \\+b. r :- f, \\+a. r :- d.
+            query(p). query(q). query(r). evidence(e, false).
+            e :- c, d. e :- b, a.
+        """
+        formula = DDNNF.create_from(PrologString(program))
+        evaluator = formula.get_batch_evaluator()
+        facts = evaluator.facts
+        values = {'a': (0.3, 0.7), 'b': (0.0, 0.35), 'choice(4,0,c)': (0.5, 0.25),
+                  'choice(4,1,d)': (0.2, 0.15), 'f': (1.0, 0.5)}
+        weights = numpy.array([values[str(f)] for f in facts]).T
+        coefficients = numpy.array([1.0, -2.0, 3.0])
+        value, d_value, evidence, d_evidence = evaluator.gradient(weights, coefficients)
+        result = evaluator.evaluate(weights)
+        for i in range(2):
+            self.assertAlmostEqual(value[i] / evidence[i], result[i].dot(coefficients))
+        for j in range(len(facts)):
+            shifted = weights.copy()
+            shifted[:, j] += 1e-6
+            v2, _, e2, _ = evaluator.gradient(shifted, coefficients)
+            for i in range(2):
+                self.assertAlmostEqual((v2[i] - value[i]) / 1e-6, d_value[i, j], places=4)
+                self.assertAlmostEqual((e2[i] - evidence[i]) / 1e-6, d_evidence[i, j], places=4)
+
+        free = [Term('a'), Term('f')]
+        columns = [facts.index(f) for f in free]
+        lower, upper = evaluator.bounds(weights, free)
+        for a in (0.0, 1.0):
+            for f in (0.0, 1.0):
+                exact = weights.copy()
+                exact[:, columns] = (a, f)
+                values = evaluator.evaluate(exact)
+                self.assertTrue(numpy.all(numpy.isnan(values) | (lower - 1e-9 <= values)))
+                self.assertTrue(numpy.all(numpy.isnan(values) | (values <= upper + 1e-9)))
+        choice = [f for f in facts if str(f).startswith('choice')][:1]
+        self.assertRaises(ValueError, evaluator.bounds, weights, choice)
+
+    def test_decision_search(self):
+        """Branch-and-bound search finds the same strategy score as exhaustive search."""
+        from problog.tasks.dtproblog import dtproblog
+        program = """
+            ?::umbrella. ?::raincoat.
+            0.3::rain. 0.5::wind.
+            broken_umbrella :- umbrella, rain, wind.
+            dry :- rain, raincoat. dry :- rain, umbrella, \\+broken_umbrella. dry :- \\+rain.
+            utility(broken_umbrella, -40). utility(raincoat, -20). utility(umbrella, -2).
+            utility(dry, 60).
+        """
+        scores = {}
+        for search in ('exhaustive', 'gradient', 'bnb'):
+            choices, score, stats = dtproblog(PrologString(program), search=search)
+            scores[search] = score
+        self.assertAlmostEqual(scores['bnb'], scores['exhaustive'])
+        self.assertLessEqual(scores['gradient'], scores['exhaustive'] + 1e-9)
+
+    def test_decision_search_impossible_evidence(self):
+        """Strategies under which the evidence is impossible are left or reported."""
+        from problog.tasks.dtproblog import dtproblog
+        from problog.errors import InconsistentEvidenceError
+        program = """
+            ?::d0. ?::d1. ?::d2.
+            h :- d0, %s.
+            evidence(h).
+            utility(d0, -1). utility(d1, -1). utility(d2, -1).
+        """
+        for search in ('gradient', 'bnb'):
+            choices, score, stats = dtproblog(PrologString(program % 'true'), search=search)
+            self.assertEqual(sorted(choices.values()), [0, 0, 1])
+            self.assertAlmostEqual(score, -1.0)
+            self.assertRaises(InconsistentEvidenceError, dtproblog,
+                              PrologString(program % 'd1, d2'), search=search)
+
+    def test_sampler(self):
+        """Vectorized sampling estimates converge to the exact probabilities."""
+        program = """
+            0.3::a. 0.6::b. 0.2::c. 0.1::e(1); 0.5::e(2); 0.3::e(3).
+            x :- a, b. x :- c, \\+e(2).
+            y :- \\+a, e(1). y :- e(3), \\+x.
+            query(x). query(y). query(e(_)).
+            evidence(w). w :- a. w :- e(2).
+        """
+        formula = LogicDAG.create_from(PrologString(program))
+        sampler = BatchSampler(formula, seed=1, batch_size=1000)
+        self.assertEqual(sampler.batch_size, 1024)
+        sampler.sample(100000)
+        self.assertEqual(sampler.accepted + sampler.rejected, 100000)
+        expected = DDNNF.create_from(formula).evaluate()
+        for name, value in sampler.estimate().items():
+            self.assertAlmostEqual(value, expected[name], delta=0.01)
+
+
+class TestMPE(unittest.TestCase):
+
+    program = """
+        0.3::a. 0.6::b. 0.2::c. 0.1::e(1); 0.5::e(2); 0.3::e(3).
+        x :- a, b. x :- c, \\+e(2).
+        y :- \\+a, e(1). y :- e(3), \\+x.
+        evidence(y).
+        query(x). query(a). query(e(3)).
+    """
+
+    def _ground(self):
+        return LogicDAG.create_from(PrologString(self.program), avoid_name_clash=True,
+                                    label_all=True)
+
+    def test_builtin_solver(self):
+        """The in-process MaxSAT solver finds an optimal assignment."""
+        solver = BranchAndBoundSolver()
+        clauses = [[10, 1, 2], [10, -1, -2], [10, -3, 1], [2, 3], [2, -1], [3, 2, 3], [-1, -2]]
+        self.assertEqual(solver.solve(3, clauses, 10), [-1, 2, -3])
+        self.assertIsNone(solver.solve(1, [[10, 1], [10, -1]], 10))
+
+        prob, facts = mpe_maxsat(self._ground(), solver='builtin')
+        self.assertAlmostEqual(prob, 0.7 * 0.6 * 0.8 * 0.3)
+        self.assertEqual(set(map(str, facts)), {'\\+x', '\\+a', 'e(3)'})
+
+    def test_builtin_solver_inconsistent(self):
+        """The in-process MaxSAT solver reports evidence that can't be satisfied."""
+        from problog.maxsat import UnsatisfiableError
+        dag = LogicDAG.create_from(PrologString('0.5::b. a :- fail. evidence(a). query(b).'),
+                                   label_all=True, propagate_evidence=False)
+        self.assertRaises(UnsatisfiableError, mpe_maxsat, dag, solver='builtin')
+
+    @unittest.skipIf(numpy is None, 'NumPy is not available')
+    def test_circuit(self):
+        """Max-product on a compiled circuit finds the same explanation as MaxSAT."""
+        prob, facts = mpe_circuit(self._ground(), solver='ddnnf')
+        self.assertAlmostEqual(prob, 0.7 * 0.6 * 0.8 * 0.3)
+        self.assertEqual(set(map(str, facts)), {'\\+x', '\\+a', 'e(3)'})
+
+        prob, facts = mpe_circuit(self._ground(), solver='ddnnf', minpe=True)
+        expected, facts = mpe_maxsat(self._ground(), solver='builtin', minpe=True)
+        self.assertAlmostEqual(prob, expected)
+
+
+@unittest.skipIf(not get_available_solvers(), 'No MaxSAT solver available')
+class TestKBest(unittest.TestCase):
+
+    program = """
+        0.3::a. 0.6::b. 0.2::c.
+        x :- a, b. x :- c.
+        y :- x, \\+a.
+        query(x). query(y).
+    """
+
+    def test_budget(self):
+        """Bounds that are computed within an iteration budget contain the exact probability."""
+        formula = KBestFormula.create_from(PrologString(self.program))
+        expected = DDNNF.create_from(PrologString(self.program)).evaluate()
+        evaluator = formula.get_evaluator(semiring=SemiringProbability(), max_iterations=2)
+        for name, node, label in formula.labeled():
+            lower, upper = evaluator.evaluate(node)
+            self.assertLessEqual(lower, expected[name] + 1e-9)
+            self.assertGreaterEqual(upper, expected[name] - 1e-9)
+            self.assertLess(lower, upper)
+        self.assertEqual(len(evaluator.history), 2)
+
+    def test_parallel(self):
+        """Queries refined in parallel converge to the exact probability."""
+        formula = KBestFormula.create_from(PrologString(self.program))
+        expected = DDNNF.create_from(PrologString(self.program)).evaluate()
+        result = formula.evaluate(semiring=SemiringProbability(), processes=2)
+        for name, value in result.items():
+            if type(value) != tuple:
+                value = value, value
+            self.assertAlmostEqual(value[0], expected[name])
+            self.assertAlmostEqual(value[1], expected[name])
+
+
+@unittest.skipIf(not BDD.is_available(), 'No BDD library available')
+class TestIncrementalEvidence(unittest.TestCase):
+
+    program = """
+        0.3::a. 0.4::b. 0.2::c. 0.6::d. 0.7::f.
+        x :- a, b. x :- c.
+        z :- f. z :- x, d.
+        u :- x, \\+d.
+        query(x). query(z). query(u). query(f).
+    """
+
+    def _evaluate(self, evidence):
+        program = self.program + ' '.join('evidence(%s, %s).' % e for e in evidence)
+        formula = BDD.create_from(PrologString(program), propagate_evidence=False)
+        return formula.evaluate(semiring=SemiringProbability())
+
+    def test_update_evidence(self):
+        """Adding evidence incrementally gives the same results as compiling it."""
+        formula = BDD.create_from(PrologString(self.program), propagate_evidence=False)
+        evaluator = formula.get_evaluator(semiring=SemiringProbability())
+        for name, node, label in formula.labeled():
+            evaluator.evaluate(node)
+
+        evidence = []
+        for name, value in [('b', 'true'), ('f', 'false'), ('u', 'false')]:
+            evaluator.update_evidence(formula.get_node_by_name(Term(name)), value == 'true')
+            evidence.append((name, value))
+            for query, expected in self._evaluate(evidence).items():
+                self.assertAlmostEqual(evaluator.evaluate(formula.get_node_by_name(query)),
+                                       expected)
+
+    def test_keep_unaffected(self):
+        """Only results that depend on the new evidence are discarded."""
+        formula = BDD.create_from(PrologString(self.program), propagate_evidence=False)
+        evaluator = formula.get_evaluator(semiring=SemiringProbability())
+        for name, node, label in formula.labeled():
+            evaluator.evaluate(node)
+        evaluator.update_evidence(formula.get_node_by_name(Term('b')), True)
+        kept = set(str(n) for n, k, l in formula.labeled() if k in evaluator._results)
+        self.assertEqual(kept, set(['f']))
+
+    def test_all_marginals(self):
+        """Evaluating all queries in one pass gives the same results as one query at a time."""
+        program = self.program + 'query(a). query(\\+c). evidence(u, false).'
+        formula = BDD.create_from(PrologString(program), propagate_evidence=False)
+        expected = formula.evaluate(semiring=SemiringProbability(), all_marginals=False)
+        for query_indicators in (False, True):
+            result = formula.evaluate(semiring=SemiringProbability(),
+                                      query_indicators=query_indicators)
+            self.assertEqual(set(expected), set(result))
+            for name, value in expected.items():
+                self.assertAlmostEqual(value, result[name])
+
+    def test_all_marginals_lazy(self):
+        """Other compound queries are only evaluated along if indicators are used."""
+        formula = BDD.create_from(PrologString(self.program), propagate_evidence=False)
+        for query_indicators, expected in ((False, ['f', 'x']), (True, ['f', 'u', 'x', 'z'])):
+            evaluator = formula.get_evaluator(semiring=SemiringProbability(),
+                                              query_indicators=query_indicators)
+            evaluator.evaluate(formula.get_node_by_name(Term('x')))
+            evaluated = [str(n) for n, k, l in formula.labeled() if k in evaluator._results]
+            self.assertEqual(sorted(evaluated), expected)
+
+    def test_set_weight(self):
+        """Results are recomputed after a change of the weights."""
+        formula = BDD.create_from(PrologString('0.3::a. 0.6::b. q :- a. q :- b. '
+                                               'query(q). query(a).'))
+        evaluator = formula.get_evaluator(semiring=SemiringProbability())
+        q = formula.get_node_by_name(Term('q'))
+        a = formula.get_node_by_name(Term('a'))
+        self.assertAlmostEqual(0.72, evaluator.evaluate(q))
+        self.assertAlmostEqual(0.3, evaluator.evaluate(a))
+        evaluator.set_weight(formula.atom2var[a], 0.9, 0.1)
+        self.assertAlmostEqual(0.96, evaluator.evaluate(q))
+        self.assertAlmostEqual(0.9, evaluator.evaluate(a))
+        evaluator.set_evidence(formula.atom2var[a], False)
+        self.assertAlmostEqual(0.6, evaluator.evaluate(q))
+        self.assertAlmostEqual(0.0, evaluator.evaluate(a))
+
+
+class FloatSemiring(Semiring):
+    """Probability semiring that is not recognized as such by the evaluators."""
+
+    def one(self):
+        return 1.0
+
+    def zero(self):
+        return 0.0
+
+    def plus(self, a, b):
+        return a + b
+
+    def times(self, a, b):
+        return a * b
+
+    def negate(self, a):
+        return 1.0 - a
+
+    def value(self, a):
+        return float(a)
+
+    def normalize(self, a, z):
+        return a / z
+
+    def is_dsp(self):
+        return True
+
+
+@unittest.skipIf(not SDD.is_available(), 'No SDD library available')
+class TestSDDEvaluation(unittest.TestCase):
+
+    def test_custom_semiring(self):
+        """A custom semiring gives the same results and reuses the values of shared nodes."""
+        program = """
+            0.3::a. 0.4::b. 0.5::c; 0.2::d. 0.6::f.
+            p :- a, c. p :- b, \\+d. q :- a, \\+b. r :- f, \\+a. r :- d, q.
+            query(p). query(q). query(r). query(a). evidence(e, false).
+            e :- c, d. e :- b, a.
+        """
+        formula = SDD.create_from(PrologString(program))
+        expected = formula.evaluate(semiring=SemiringProbability())
+        evaluator = formula.get_evaluator(semiring=FloatSemiring())
+        for name, node, label in formula.labeled():
+            self.assertAlmostEqual(expected[name], evaluator.evaluate(node))
+        statistics = evaluator.inode_cache.get_statistics()
+        self.assertGreater(statistics['entries'], 0)
+        self.assertGreater(statistics['hits'], 0)
+
+    def test_wmc_updates(self):
+        """Reused WMC managers give the same results as new ones."""
+        formula = SDD.create_from(PrologString("""
+            0.3::a. 0.4::b. 0.5::c. p :- a, b. p :- \\+a, c. query(p).
+        """))
+        manager = formula.get_manager()
+        node = formula.get_inode(formula.get_node_by_name(Term('p')))
+        a, b, c = [formula.atom2var[formula.get_node_by_name(Term(n))] for n in 'abc']
+        weights = {a: (0.3, 0.7), b: (0.4, 0.6), c: (0.5, 0.5)}
+        semiring = SemiringProbability()
+        updates = [{a: (0.8, 0.2)}, {b: (1.0, 0.0), c: (0.1, 0.9)}, {a: (0.0, 1.0)}]
+        results = manager.wmc_updates(node, weights, semiring, updates)
+
+        current = dict(weights)
+        for update, result in zip(updates, results):
+            current.update(update)
+            manager.clear_wmc_cache()
+            self.assertAlmostEqual(manager.wmc(node, current, semiring), result)
+
+        # Weights that are no longer given are reset.
+        manager.clear_wmc_cache()
+        expected = manager.wmc(node, {a: (0.3, 0.7)}, semiring)
+        manager.clear_wmc_cache()
+        manager.wmc(node, weights, semiring)
+        self.assertAlmostEqual(expected, manager.wmc(node, {a: (0.3, 0.7)}, semiring))
+
+    def test_serialization(self):
+        """A serialized SDD gives the same nodes and results."""
+        formula = SDD.create_from(PrologString("""
+            0.3::a. 0.4::b. 0.2::c; 0.5::d. p :- a, c. p :- b, \\+d. q :- \\+a, d.
+            query(p). query(q). evidence(e). e :- a. e :- d.
+        """))
+        expected = formula.evaluate()
+        self.assertEqual(expected, pickle.loads(pickle.dumps(formula)).evaluate())
+
+        manager = formula.get_manager()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'manager.sdd')
+            manager.save(filename)
+            loaded = SDDManager.load(filename)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(len(manager.to_bytes()), len(loaded.to_bytes()))
+        formula.inode_manager = loaded
+        self.assertEqual(expected, formula.evaluate())
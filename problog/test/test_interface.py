@@ -9,6 +9,7 @@ from problog.util import subprocess_call, subprocess_check_output
 import unittest
 import os
 import sys
+import tempfile
 
 
 class TestInterfaces(unittest.TestCase):
@@ -41,16 +42,77 @@ class TestInterfaces(unittest.TestCase):
     def test_cli_sample(self):
         return self._test_cmd('sample')
 
+    def test_cli_sample_parallel(self):
+        problogcli = root_path('problog-cli.py')
+        model = root_path('test', '7_probabilistic_graph.pl')
+        results = []
+        for jobs in ('1', '2'):
+            out = subprocess_check_output([sys.executable, problogcli, 'sample', model, '--estimate',
+                                           '-N', '50', '--seed', '1', '--block-size', '10',
+                                           '-j', jobs])
+            results.append(out.splitlines()[1:])
+        self.assertEqual(results[0], results[1])
+
+    def test_sample_without_fork(self):
+        """Blocks of samples are drawn in the current process if processes can't be forked."""
+        from problog.program import PrologFile
+        from problog.tasks import sample
+
+        model = PrologFile(root_path('test', '7_probabilistic_graph.pl'))
+        expected = sample.estimate(model, 50, jobs=2, seed=1, block_size=10)
+        fork_context = sample.fork_context
+        sample.fork_context = lambda: None
+        try:
+            result = sample.estimate(model, 50, jobs=2, seed=1, block_size=10)
+        finally:
+            sample.fork_context = fork_context
+        self.assertEqual(expected, result)
+
+    def test_cli_sample_weighted(self):
+        problogcli = root_path('problog-cli.py')
+        fd, model = tempfile.mkstemp('.pl')
+        with os.fdopen(fd, 'w') as f:
+            f.write('0.3::a. 0.001::c. r :- c. query(r). query(a). evidence(c).')
+        try:
+            out = subprocess_check_output([sys.executable, problogcli, 'sample', model,
+                                           '--estimate', '-N', '20', '--likelihood-weighting'])
+        finally:
+            os.remove(model)
+        lines = out.splitlines()
+        self.assertIn('effective sample size 20.0', lines[0])
+        self.assertIn('r:\t1', [line.strip() for line in lines])
+
     def test_cli_default(self):
         return self._test_cmd(None)
 
     def test_cli_learn(self):
+        return self._test_learn()
+
+    def test_cli_learn_parallel(self):
+        return self._test_learn('-j', '2')
+
+    def test_cli_learn_minibatch(self):
+        problogcli = root_path('problog-cli.py')
+
+        model = root_path('problog', 'learning', 'test1_model.pl')
+        examples = root_path('problog', 'learning', 'test1_examples.pl')
+
+        out = subprocess_check_output([sys.executable, problogcli, 'lfi', model, examples,
+                                       '--batch-size', '2', '-n', '100'])
+        outline = out.strip().split()
+
+        weights = [float(outline[i].strip('[],')) for i in (1, 2, 3, 4)]
+
+        self.assertAlmostEqual(weights[0], 1.0 / 3, places=2)
+        self.assertGreater(weights[2], 0.99)
+
+    def _test_learn(self, *options):
         problogcli = root_path('problog-cli.py')
 
         model = root_path('problog', 'learning', 'test1_model.pl')
         examples = root_path('problog', 'learning', 'test1_examples.pl')
 
-        out = subprocess_check_output([sys.executable, problogcli, 'lfi', model, examples])
+        out = subprocess_check_output([sys.executable, problogcli, 'lfi', model, examples] + list(options))
         outline = out.strip().split()
 
         self.assertGreater(int(outline[-1]), 2)
@@ -0,0 +1,89 @@
+"""
+Part of the ProbLog distribution.
+
+Copyright 2015 KU Leuven, DTAI Research Group
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import print_function
+
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from problog.parser import PrologParser, ParseError
+from problog.program import PrologFactory, ExtendedPrologFactory
+
+PROGRAM = """% facts
+0.3::edge(a, b, 1).
+edge(b,c,2.5).  0.7 :: node(a). node(b).
+/* block
+   comment */ 1e-2::rare.
+0.5::f(X) :- node(X).
+not(a).
+g(is).
+q :- edge(a, b, N), N > 1.
+"""
+
+
+class TestParser(unittest.TestCase):
+
+    def _describe(self, statement):
+        return str(statement), statement.location, [arg.location for arg in statement.args], \
+            statement.probability
+
+    def test_fact_fast_path(self):
+        """Plain facts are parsed the same as the equivalent tokenized statements"""
+        parser = PrologParser(PrologFactory())
+        statements = parser.parseString(PROGRAM)
+        self.assertEqual(['0.3::edge(a,b,1)', 'edge(b,c,2.5)', '0.7::node(a)', 'node(b)',
+                          '0.01::rare', '0.5::f(X) :- node(X)', 'not(a)', 'g(is)',
+                          'q :- edge(a,b,N), N>1'], list(map(str, statements)))
+
+        # Same result as tokenizing all statements
+        tokenized = [parser._parse_statement(PROGRAM, tokens) for tokens in
+                     parser._extract_statements(PROGRAM, parser._tokenize(PROGRAM))]
+        self.assertEqual(list(map(self._describe, tokenized)),
+                         list(map(self._describe, statements)))
+
+    def test_stream(self):
+        """Streaming gives the same statements and locations as parsing the whole string"""
+        expected = PrologParser(PrologFactory()).parseString(PROGRAM)
+        for block_size in (1, 7, 1000):
+            statements = list(PrologParser(PrologFactory()).parseStream(StringIO(PROGRAM),
+                                                                        block_size=block_size))
+            self.assertEqual(list(map(self._describe, expected)),
+                             list(map(self._describe, statements)))
+
+        try:
+            list(PrologParser(PrologFactory()).parseStream(StringIO(PROGRAM + 'a :- .\n'),
+                                                           block_size=5))
+            self.fail('Expected a parse error.')
+        except ParseError as err:
+            self.assertEqual(10, err.location[1])
+
+    def test_stream_program_transformation(self):
+        """Statements that change the rest of the program can not be streamed"""
+        statements = list(PrologParser(ExtendedPrologFactory()).parseStream(StringIO(PROGRAM)))
+        self.assertEqual(9, len(statements))
+
+        for statement in ('0.5::\\+a :- c.', '\\+a :- c.'):
+            try:
+                list(PrologParser(ExtendedPrologFactory()).parseStream(
+                    StringIO(PROGRAM + '0.3::a.\n' + statement + '\n'), block_size=5))
+                self.fail('Expected a parse error.')
+            except ParseError as err:
+                self.assertEqual((11, 1), err.location[1:])
@@ -0,0 +1,142 @@
+"""
+Part of the ProbLog distribution.
+
+Copyright 2015 KU Leuven, DTAI Research Group
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import print_function
+
+import json
+import logging
+import sys
+import unittest
+
+try:
+    from problog.web.workers import TaskRunner, WorkerPool, WorkerError
+    has_workers = True
+except ImportError:
+    # The workers use the resource module, which is not available on Windows.
+    has_workers = False
+
+
+model_a = """
+0.3::a.
+0.6::b.
+c :- a; b.
+evidence(b, %s).
+query(a).
+query(c).
+"""
+
+model_b = """
+0.4::x.
+query(x).
+"""
+
+
+def probabilities(output):
+    result = json.loads(output)
+    return dict((name, float(p)) for name, p, line, col in result['probs'])
+
+
+@unittest.skipIf(not has_workers, 'Worker processes are not supported on this platform.')
+class TestTaskRunner(unittest.TestCase):
+
+    def test_reuse(self):
+        """The circuit is reused when only the evidence values change."""
+        runner = TaskRunner()
+        result = probabilities(runner.run('prob', model_a % 'true'))
+        self.assertAlmostEqual(result['a'], 0.3)
+        self.assertAlmostEqual(result['c'], 1.0)
+        self.assertEqual((runner.circuits.hits, runner.circuits.misses), (0, 1))
+
+        result = probabilities(runner.run('prob', model_a % 'true'))
+        self.assertAlmostEqual(result['c'], 1.0)
+        self.assertEqual((runner.circuits.hits, runner.circuits.misses), (1, 1))
+
+        result = probabilities(runner.run('prob', model_a % 'false'))
+        self.assertAlmostEqual(result['a'], 0.3)
+        self.assertAlmostEqual(result['c'], 0.3)
+        self.assertEqual((runner.circuits.hits, runner.circuits.misses), (2, 1))
+        self.assertEqual(len(runner.circuits), 1)
+
+    def test_eviction(self):
+        """Only the most recently used programs and circuits are kept."""
+        runner = TaskRunner(cache_entries=1)
+        for model in (model_a % 'true', model_b, model_a % 'true'):
+            runner.run('prob', model)
+        self.assertEqual((runner.circuits.hits, runner.circuits.misses), (0, 3))
+        self.assertEqual(len(runner.circuits), 1)
+        self.assertEqual(len(runner._databases), 1)
+
+        result = probabilities(runner.run('prob', model_a % 'false'))
+        self.assertAlmostEqual(result['c'], 0.3)
+        self.assertEqual((runner.circuits.hits, runner.circuits.misses), (1, 3))
+
+    def test_error(self):
+        """A model that can not be parsed gives an error in the JSON output."""
+        runner = TaskRunner()
+        result = json.loads(runner.run('prob', '0.3::a. query(a'))
+        self.assertFalse(result['SUCCESS'])
+        self.assertEqual(result['err']['errtype'], 'ParseError')
+        self.assertEqual(len(runner.circuits), 0)
+
+        # The runner can still be used after an error.
+        result = probabilities(runner.run('prob', model_b))
+        self.assertAlmostEqual(result['x'], 0.4)
+
+
+@unittest.skipIf(not has_workers or sys.platform == 'win32',
+                 'Worker processes are not supported on this platform.')
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger('server').disabled = True
+        self.pool = WorkerPool(1, 60, None, cache_entries=1)
+
+    def tearDown(self):
+        self.pool.close()
+        logging.getLogger('server').disabled = False
+
+    def test_reuse(self):
+        """Requests are executed by the same warm worker."""
+        pid = self.pool._idle[0][1]
+        result = probabilities(self.pool.run('prob', model_a % 'true'))
+        self.assertAlmostEqual(result['c'], 1.0)
+        result = probabilities(self.pool.run('prob', model_a % 'false'))
+        self.assertAlmostEqual(result['c'], 0.3)
+        self.assertEqual(self.pool._idle[0][1], pid)
+        self.assertEqual(len(self.pool._idle[0][3]), 1)
+
+    def test_eviction(self):
+        """The worker only remembers the most recently served models."""
+        from problog.web.server import compute_hash
+        self.pool.run('prob', model_a % 'true')
+        self.pool.run('prob', model_b)
+        self.assertEqual(list(self.pool._idle[0][3]), [compute_hash(model_b)])
+
+    def test_error(self):
+        """A failing task raises an error and does not stop the worker."""
+        pid = self.pool._idle[0][1]
+        result = json.loads(self.pool.run('prob', '0.3::a. query(a'))
+        self.assertFalse(result['SUCCESS'])
+        self.assertRaises(WorkerError, self.pool.run, 'nosuchtask', model_b)
+        self.assertEqual(self.pool._idle[0][1], pid)
+
+        result = probabilities(self.pool.run('prob', model_b))
+        self.assertAlmostEqual(result['x'], 0.4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -34,6 +34,14 @@ import distutils.spawn
 import tempfile
 import imp
 import collections
+import binascii
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .errors import InstallError
 
 
 class ProbLogLogFormatter(logging.Formatter):
@@ -339,6 +347,25 @@ def mktempfile(suffix=''):
     return filename
 
 
+def fork_context():
+    """Get a multiprocessing context that starts processes by forking.
+
+    Prepared programs can not be pickled, so worker processes that need one have to be forked.
+
+    :return: multiprocessing context (or module), or None if forking is not available
+    """
+    import multiprocessing
+    if not hasattr(multiprocessing, 'get_context'):
+        # Python 2 always forks, except on Windows.
+        if sys.platform == 'win32':
+            return None
+        return multiprocessing
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        return None
+
+
 def load_module(filename):
     """Load a Python module from a filename or qualified module name.
 
@@ -579,6 +606,193 @@ class UHeap(object):
         return len(self._heap)
 
 
+def _int_to_bytes(value):
+    """Little-endian byte representation of a non-negative integer."""
+    h = '%x' % value
+    if len(h) % 2:
+        h = '0' + h
+    return binascii.unhexlify(h)[::-1]
+
+
+def _bytes_to_int(data):
+    """Non-negative integer from its little-endian byte representation."""
+    data = bytes(data)[::-1]
+    if not data:
+        return 0
+    return int(binascii.hexlify(data), 16)
+
+
+class Bitset(object):
+    """Set of non-negative integers stored as the bits of a (big) integer.
+
+    Bulk operations (``&``, ``|``, ``-``, ``^``, :meth:`popcount`) work on the whole integer at \
+    once.
+    Conversion from and to boolean masks and iteration over the set bits use NumPy when it \
+    is available, and otherwise process the bitset one byte at a time.
+
+    Single bit operations (``add``, ``in``) copy the integer.
+    For many membership tests, first convert the bitset with :meth:`to_list` or :meth:`to_mask`.
+
+    :param value: integer whose bits form the set
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value=0):
+        self.value = value
+
+    @classmethod
+    def from_indices(cls, indices):
+        """Create a bitset containing the given indices.
+
+        :param indices: iterable of non-negative integers
+        :return: bitset
+        :rtype: Bitset
+        """
+        data = bytearray()
+        for i in indices:
+            b = i >> 3
+            if b >= len(data):
+                data.extend(bytearray(b - len(data) + 1))
+            data[b] |= 1 << (i & 7)
+        return cls(_bytes_to_int(data))
+
+    @classmethod
+    def from_mask(cls, mask):
+        """Create a bitset from a sequence of booleans (e.g. a NumPy array).
+
+        :param mask: sequence of booleans, element i indicates whether i is in the set
+        :return: bitset
+        :rtype: Bitset
+        """
+        if numpy is not None:
+            mask = numpy.asarray(mask, dtype=bool)
+            return cls(_bytes_to_int(numpy.packbits(mask, bitorder='little').tobytes()))
+        else:
+            return cls.from_indices(i for i, x in enumerate(mask) if x)
+
+    def to_mask(self, size=None):
+        """Convert the bitset to a NumPy array of booleans.
+
+        :param size: length of the array (default: the smallest length that holds all elements)
+        :return: boolean array
+        """
+        if numpy is None:
+            raise InstallError('The NumPy library is required for this operation.')
+        data = numpy.frombuffer(_int_to_bytes(self.value), dtype=numpy.uint8)
+        mask = numpy.unpackbits(data, bitorder='little').astype(bool)
+        if size is None:
+            size = self.value.bit_length()
+        if size <= len(mask):
+            return mask[:size]
+        result = numpy.zeros(size, dtype=bool)
+        result[:len(mask)] = mask
+        return result
+
+    def to_list(self, size):
+        """Convert the bitset to a list of booleans.
+
+        :param size: length of the list
+        :return: list where element i indicates whether i is in the set
+        """
+        if numpy is not None:
+            return self.to_mask(size).tolist()
+        result = [False] * size
+        for i in self.iter_set_bits():
+            if i < size:
+                result[i] = True
+        return result
+
+    def iter_set_bits(self):
+        """Iterate over the elements of the set in increasing order.
+
+        :return: iterator of integers
+        """
+        if not self.value:
+            return iter(())
+        if numpy is not None:
+            return iter(numpy.flatnonzero(self.to_mask()).tolist())
+        return self._iter_bytes()
+
+    def _iter_bytes(self):
+        for b, byte in enumerate(bytearray(_int_to_bytes(self.value))):
+            if byte:
+                for i in range(8):
+                    if byte & (1 << i):
+                        yield (b << 3) + i
+
+    def popcount(self):
+        """Number of elements in the set.
+
+        :rtype: int
+        """
+        if _bit_count is not None:
+            return _bit_count(self.value)
+        return bin(self.value).count('1')
+
+    def add(self, index):
+        self.value |= 1 << index
+
+    def discard(self, index):
+        self.value &= ~(1 << index)
+
+    def __contains__(self, index):
+        return bool((self.value >> index) & 1)
+
+    def __getitem__(self, index):
+        return bool((self.value >> index) & 1)
+
+    def __iter__(self):
+        return self.iter_set_bits()
+
+    def __len__(self):
+        return self.popcount()
+
+    def __bool__(self):
+        return self.value != 0
+
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        return isinstance(other, Bitset) and self.value == other.value
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __and__(self, other):
+        return Bitset(self.value & other.value)
+
+    def __or__(self, other):
+        return Bitset(self.value | other.value)
+
+    def __xor__(self, other):
+        return Bitset(self.value ^ other.value)
+
+    def __sub__(self, other):
+        return Bitset(self.value & ~other.value)
+
+    def __iand__(self, other):
+        self.value &= other.value
+        return self
+
+    def __ior__(self, other):
+        self.value |= other.value
+        return self
+
+    def __isub__(self, other):
+        self.value &= ~other.value
+        return self
+
+    def __repr__(self):
+        return 'Bitset(%s)' % list(self.iter_set_bits())
+
+
+_bit_count = getattr(int, 'bit_count', None)
+
+
 class BitVector(object):
 
     def __init__(self):
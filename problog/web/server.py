@@ -12,6 +12,10 @@ The operation of the server is determined by four options:
     memout (default: 1Gb)       Maximum memory usage of the ProbLog subprocess
     servefiles (default: No)    Whether to serve a file for undefined paths. (This is potentially unsafe.)
 
+With ``--workers N`` requests are handled by a pool of N warm worker processes (see
+problog.web.workers) instead of a new ProbLog subprocess per request.
+The time and memory limits apply to each request of a worker.
+
 The server defines the following paths:
 
     http://hostname:port/problog?model=... [GET,POST]
@@ -61,6 +65,8 @@ CACHE_DIR = "cache"
 
 RUN_LOCAL = False
 
+WORKER_POOL = None  # Pool of warm worker processes (None: start a subprocess per request)
+
 # PYTHON_EXEC = 'python'    # Python 2
 PYTHON_EXEC = sys.executable  # Match with server
 
@@ -98,6 +104,7 @@ import mimetypes
 if sys.version_info.major == 2:
     import BaseHTTPServer
     import urlparse
+    from SocketServer import ThreadingMixIn
 
     def to_bytes(string):
         return bytes(string)
@@ -111,6 +118,7 @@ if sys.version_info.major == 2:
 else:
     import http.server as BaseHTTPServer
     import urllib.parse as urlparse
+    from socketserver import ThreadingMixIn
 
     def to_bytes(string):
         return bytes(string, 'UTF-8')
@@ -120,6 +128,20 @@ else:
     def compute_hash(model):
         return hashlib.md5(to_bytes(model)).hexdigest() # Python 3
 
+try:
+    from problog.web.workers import WorkerPool, WorkerError
+except ImportError:
+    WorkerPool = None
+
+    class WorkerError(Exception):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server that handles each request in a separate thread."""
+    daemon_threads = True
+
+
 # Contains special URL paths. Initialize with @handle_url
 PATHS = {}
 
@@ -211,12 +233,15 @@ def run_problog_task(task, model, callback=None, data=None, options=None):
         url = None
 
     try:
-        # Execute ProbLog
-        call_process(cmd, DEFAULT_TIMEOUT, DEFAULT_MEMOUT * (1 << 30))
+        if WORKER_POOL is not None:
+            result = WORKER_POOL.run(task, model, data, options)
+        else:
+            # Execute ProbLog
+            call_process(cmd, DEFAULT_TIMEOUT, DEFAULT_MEMOUT * (1 << 30))
 
-        # Read output produced by ProbLog
-        with open(outfile) as f:
-            result = f.read()
+            # Read output produced by ProbLog
+            with open(outfile) as f:
+                result = f.read()
 
         if url is not None:
             result = json.loads(result)
@@ -231,6 +256,10 @@ def run_problog_task(task, model, callback=None, data=None, options=None):
         result = {'SUCCESS': False, 'url': url,
                   'err': 'ProbLog exceeded time or memory limit'}
         return 200, 'application/json', wrap_callback(callback, json.dumps(result))
+    except WorkerError as err:
+        logger.error('ProbLog worker didn\'t finish correctly: %s' % err)
+        result = {'SUCCESS': False, 'url': url, 'err': str(err)}
+        return 200, 'application/json', wrap_callback(callback, json.dumps(result))
 
 
 @handle_url(api_root + 'inference')
@@ -509,6 +538,7 @@ def main(argv, **extra):
     global SERVE_FILES
     global CACHE_MODELS
     global RUN_LOCAL
+    global WORKER_POOL
 
     import argparse
 
@@ -520,6 +550,11 @@ def main(argv, **extra):
     parser.add_argument('--nocaching', action='store_true', help="Disable caching of submitted models")
     parser.add_argument('--browser', '-B', action='store_true', help="Open editor in web browser.")
     parser.add_argument('--local', '-l', action='store_true', help="Use local javascript libraries.")
+    parser.add_argument('--workers', '-w', type=int, default=0,
+                        help="Handle requests in a pool of warm worker processes of this size "
+                             "(default: start a new process for each request).")
+    parser.add_argument('--cache-entries', type=int, default=32,
+                        help="Number of programs and circuits cached in each worker.")
     args = parser.parse_args(argv)
 
     RUN_LOCAL = args.local
@@ -533,11 +568,23 @@ def main(argv, **extra):
     logger.info('Starting server on port %d (timeout=%d, memout=%dGb)' % (args.port, DEFAULT_TIMEOUT, DEFAULT_MEMOUT))
 
     server_address = ('', args.port)
-    httpd = BaseHTTPServer.HTTPServer(server_address, ProbLogHTTP)
+    if args.workers > 0:
+        if WorkerPool is None:
+            parser.error('Worker processes require the problog package to be importable.')
+        logger.info('Starting %d worker processes' % args.workers)
+        WORKER_POOL = WorkerPool(args.workers, DEFAULT_TIMEOUT, int(DEFAULT_MEMOUT * (1 << 30)),
+                                 cache_entries=args.cache_entries)
+        httpd = ThreadingHTTPServer(server_address, ProbLogHTTP)
+    else:
+        httpd = BaseHTTPServer.HTTPServer(server_address, ProbLogHTTP)
     if args.browser:
         import webbrowser
         webbrowser.open('http://localhost:%s/' % args.port, new=2, autoraise=True)
-    httpd.serve_forever()
+    try:
+        httpd.serve_forever()
+    finally:
+        if WORKER_POOL is not None:
+            WORKER_POOL.close()
 
 
 if __name__ == '__main__':
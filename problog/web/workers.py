@@ -0,0 +1,340 @@
+"""
+problog.web.workers - Warm worker processes for the ProbLog server
+-------------------------------------------------------------------
+
+Executes ProbLog tasks in long running worker processes instead of starting a new interpreter \
+for each request.
+
+Each worker keeps a least recently used cache of prepared programs (keyed by the hash of the \
+model) and of compiled circuits (keyed by the structure of the ground program).
+Circuits are reused when a model only differs in its evidence values.
+
+..
+    Part of the ProbLog distribution.
+
+    Copyright 2015 KU Leuven, DTAI Research Group
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+from __future__ import print_function
+
+import copy
+import logging
+import multiprocessing
+import os
+import resource
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+logger = logging.getLogger('server')
+
+
+class WorkerError(Exception):
+    """Raised when a worker process fails to execute a task (e.g. it exceeded its limits)."""
+    pass
+
+
+class WorkerPool(object):
+    """Pool of warm worker processes that execute ProbLog tasks.
+
+    Every worker runs with the memory limit ``memout`` (RLIMIT_AS).
+    Before each request its CPU limit (RLIMIT_CPU) is set to the CPU time it already used plus \
+    ``timeout``, such that a request that exceeds the limit kills the worker.
+    The worker is then replaced by a fresh one.
+    A request that does not finish within twice the timeout (wall clock) is also terminated.
+
+    Requests for the same model are preferably sent to the worker that handled it before, \
+    such that its caches can be reused.
+
+    :param processes: number of worker processes
+    :param timeout: CPU time limit per request in seconds
+    :param memout: memory limit per worker in bytes
+    :param cache_entries: number of programs and circuits cached in each worker
+    """
+
+    def __init__(self, processes, timeout, memout, cache_entries=32):
+        self.timeout = timeout
+        self.memout = memout
+        self.cache_entries = cache_entries
+        self._idle = []
+        self._condition = threading.Condition()
+        for i in range(processes):
+            self._idle.append(self._start_worker())
+
+    def run(self, task, model, data=None, options=None):
+        """Execute a task in one of the workers.
+
+        :param task: name of the task (see :mod:`problog.tasks`)
+        :param model: model as a string
+        :param data: additional input data (e.g. examples for learning) as a string
+        :param options: additional command line arguments for the task
+        :return: output of the task
+        :rtype: str
+        :raises WorkerError: if the task failed or the worker exceeded its limits
+        """
+        from .server import compute_hash
+        key = compute_hash(model)
+        worker = self._acquire(key)
+        try:
+            worker[2].send((task, model, data, options or []))
+            result = self._receive(worker)
+        except (IOError, OSError, EOFError):
+            result = None
+        if result is None:
+            self._stop_worker(worker)
+            worker = self._start_worker()
+        else:
+            models = worker[3]
+            models.pop(key, None)
+            models[key] = True
+            while len(models) > self.cache_entries:
+                models.popitem(last=False)
+        self._release(worker)
+
+        if result is None:
+            raise WorkerError('ProbLog exceeded time or memory limit')
+        success, output = result
+        if not success:
+            raise WorkerError(output)
+        return output
+
+    def close(self):
+        """Stop all worker processes."""
+        with self._condition:
+            for worker in self._idle:
+                self._stop_worker(worker)
+            self._idle = []
+
+    def _start_worker(self):
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_worker,
+                                          args=(child_conn, self.timeout, self.memout,
+                                                self.cache_entries))
+        process.daemon = True
+        process.start()
+        child_conn.close()
+        # (process, pid, connection, recently served model hashes)
+        return process, process.pid, conn, OrderedDict()
+
+    def _stop_worker(self, worker):
+        process, pid, conn, models = worker
+        try:
+            conn.send(None)
+            conn.close()
+        except (IOError, OSError):
+            pass
+        process.join(1)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+    def _acquire(self, key):
+        with self._condition:
+            while not self._idle:
+                self._condition.wait()
+            for i, worker in enumerate(self._idle):
+                if key in worker[3]:
+                    return self._idle.pop(i)
+            return self._idle.pop(0)
+
+    def _release(self, worker):
+        with self._condition:
+            self._idle.append(worker)
+            self._condition.notify()
+
+    def _receive(self, worker):
+        process, pid, conn, models = worker
+        deadline = time.time() + 2 * self.timeout
+        while not conn.poll(0.1):
+            if not process.is_alive() or time.time() > deadline:
+                logger.error('Worker %s did not finish its request.' % pid)
+                return None
+        return conn.recv()
+
+
+def _set_limits(timeout, memout):
+    """Restrict the remaining CPU time of the current process to the given timeout and \
+    optionally its memory to memout bytes."""
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(used.ru_utime + used.ru_stime) + 1
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    limit = used + timeout
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+    if memout is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memout, memout))
+
+
+def _worker(conn, timeout, memout, cache_entries):
+    """Main loop of a worker process of :class:`WorkerPool`."""
+    runner = TaskRunner(cache_entries)
+    _set_limits(timeout, memout)
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        _set_limits(timeout, None)
+        try:
+            result = True, runner.run(*request)
+        except Exception as err:
+            logger.error('Task failed: %s\n%s' % (err, traceback.format_exc()))
+            result = False, 'ProbLog didn\'t finish correctly: %s' % err
+        conn.send(result)
+    conn.close()
+
+
+class TaskRunner(object):
+    """Executes ProbLog tasks in the current process.
+
+    Inference requests (task ``prob``) reuse prepared programs and compiled circuits.
+    Other tasks are executed through their command line interface.
+
+    :param cache_entries: number of programs and circuits to cache
+    """
+
+    def __init__(self, cache_entries=32):
+        from ..circuit_cache import MemoryCircuitCache
+        self.cache_entries = cache_entries
+        self.circuits = MemoryCircuitCache(cache_entries)
+        self._databases = OrderedDict()
+
+    def run(self, task, model, data=None, options=None):
+        """Execute a task.
+
+        :param task: name of the task
+        :param model: model as a string
+        :param data: additional input data as a string
+        :param options: additional command line arguments
+        :return: output of the task (JSON for the tasks used by the server)
+        :rtype: str
+        """
+        if task == 'prob' and not options:
+            return self.run_inference(model)
+        else:
+            return self.run_task(task, model, data, options)
+
+    def run_inference(self, model):
+        """Compute the probabilities of the queries in a model.
+
+        Evidence is not propagated during grounding, such that the compiled circuit can be \
+        reused when only the evidence values change.
+
+        :param model: model as a string
+        :return: result in the JSON format of ``problog --web``
+        :rtype: str
+        """
+        from ..engine import DefaultEngine
+        from ..evaluator import SemiringLogProbability
+        from .. import get_evaluatable
+        from ..tasks.probability import print_result_json
+
+        output = StringIO()
+        try:
+            engine = DefaultEngine()
+            database = self.get_database(model, engine)
+            semiring = database.get_data('semiring')
+            if semiring is None:
+                semiring = SemiringLogProbability()
+            knowledge = get_evaluatable(None, semiring=semiring)
+            formula = self.circuits.create_from(knowledge, database, engine=engine,
+                                                database=database, propagate_evidence=False)
+            result = formula.evaluate(semiring=semiring)
+            for n, p in result.items():
+                if not n.location or not n.location[0]:
+                    n.loc = database.lineno(n.location)
+            print_result_json((True, result), output)
+        except Exception as err:
+            err.trace = traceback.format_exc()
+            print_result_json((False, err), output)
+        return output.getvalue()
+
+    def get_database(self, model, engine):
+        """Get a prepared copy of the given model.
+
+        The prepared program is cached; each call returns a new extension of it, such that \
+        changes made during grounding do not affect the cached program.
+
+        :param model: model as a string
+        :param engine: engine used for preparing the model
+        :return: prepared program
+        :rtype: ClauseDB
+        """
+        from ..program import PrologString
+        from .server import compute_hash
+
+        key = compute_hash(model)
+        database = self._databases.pop(key, None)
+        if database is None:
+            database = engine.prepare(PrologString(model))
+        self._databases[key] = database
+        while len(self._databases) > self.cache_entries:
+            self._databases.popitem(last=False)
+
+        result = database.extend()
+        result.data = dict((k, copy.copy(v)) for k, v in database.data.items())
+        return result
+
+    def run_task(self, task, model, data=None, options=None):
+        """Execute a task through its command line interface.
+
+        :param task: name of the task
+        :param model: model as a string
+        :param data: additional input data as a string
+        :param options: additional command line arguments
+        :return: content of the output file
+        :rtype: str
+        """
+        from ..util import mktempfile
+        filenames = [mktempfile('.pl')]
+        inputs = [model]
+        if data is not None:
+            filenames.append(mktempfile('.data'))
+            inputs.append(data)
+        outfile = mktempfile('.out')
+        try:
+            for filename, content in zip(filenames, inputs):
+                with open(filename, 'w') as f:
+                    f.write(content)
+            _call_task(task, filenames + ['-o', outfile, '--web'] + (options or []))
+            with open(outfile) as f:
+                return f.read()
+        finally:
+            for filename in filenames + [outfile]:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+
+def _call_task(task, args):
+    """Call the main function of a task, ignoring its exit code.
+
+    The task's output file is closed when this function returns.
+    """
+    from ..tasks import load_task
+    try:
+        load_task(task).main(args)
+    except SystemExit:
+        pass
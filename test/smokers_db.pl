@@ -1,5 +1,5 @@
 %Expected outcome:
-% smokes(bob)   0.73289308
+% smokes(bob)   0.62021313744
 
 
 :- use_module(library(db)).